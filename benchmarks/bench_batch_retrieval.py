@@ -0,0 +1,60 @@
+"""
+Benchmark Database.batch_search against a serial loop of Database.search, with embeddings served by a
+local fake embedding server.
+
+    python benchmarks/bench_batch_retrieval.py --queries 1000 --chunks 5000 --mode vector
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema.document import Document
+from fake_ollama import FakeOllamaServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--mode", default="vector", choices=["vector", "hybrid", "keyword"])
+    parser.add_argument("--vector-index", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path, FakeOllamaServer(latency=args.latency, per_text_latency=0.0002) as server:
+        os.environ["OLLAMA_HOST"] = server.url
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(path, "embedding_cache.sqlite3")
+        from services.chroma_db import Database
+
+        db = Database(chroma_path=os.path.join(path, "chroma"), retrieval_mode=args.mode,
+                      vector_index=args.vector_index)
+        chunks = [Document(page_content=f"section {i} pump assembly torque P/N-{4000 + i}",
+                           metadata={"id": f"doc{i % 50}.pdf:{i}:0", "source": f"doc{i % 50}.pdf", "page": i})
+                  for i in range(args.chunks)]
+        db.add_documents(chunks, [chunk.metadata["id"] for chunk in chunks])
+
+        def queries(prefix):
+            return [f"{prefix} what is the torque for P/N-{4000 + i}?" for i in range(args.queries)]
+
+        runs = {
+            "serial search": lambda: [db.search(query) for query in queries("serial")],
+            "batch_search": lambda: db.batch_search(queries("batch")),
+            "abatch_search": lambda: asyncio.run(db.abatch_search(queries("async"), batch_size=128)),
+        }
+        for name, run in runs.items():
+            server.requests = 0
+            start = time.perf_counter()
+            results = run()
+            elapsed = time.perf_counter() - start
+            assert len(results) == args.queries
+            print(f"{name:>14}: {elapsed:.2f}s, {args.queries / elapsed:.0f} queries/s, "
+                  f"{server.requests} embedding requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare the prompt built by joining every retrieved chunk with the one built by ContextPacker, in
+tokens and, when --model names a model served by a local Ollama, in time to first token.
+
+    python benchmarks/bench_context_packer.py --k 8 --history 12
+    python benchmarks/bench_context_packer.py --model deepseek-r1:8b --num-ctx 4096
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.prompts import ChatPromptTemplate
+from services.context_packer import ContextPacker
+from services.ollama_interface import PROMPT_TEMPLATE
+from services.text_splitter import OffsetTextSplitter
+from bench_text_splitter import make_pages
+
+
+def retrieved_context(k, seed=0):
+    # Retrieval tends to return neighbouring chunks of the same page, which share their 80 char overlap
+    rng = random.Random(seed)
+    chunks = OffsetTextSplitter(800, 80).split_documents(make_pages(20, seed))
+    picked = []
+    while len(picked) < k:
+        start = rng.randrange(len(chunks) - 2)
+        picked.extend(chunks[start:start + rng.choice((1, 2, 3))])
+    return [(chunk, rank) for rank, chunk in enumerate(picked[:k])]
+
+
+def chat_history(turns, seed=0):
+    rng = random.Random(seed)
+    words = ["pump", "torque", "clause", "section", "revenue", "assembly"]
+    return [{"role": "user" if i % 2 == 0 else "assistant",
+             "content": " ".join(rng.choice(words) for _ in range(rng.randint(20, 300)))} for i in range(turns)]
+
+
+def unpacked_messages(question, context, history, history_limit=5):
+    # The prompt construction OllamaInterface.query used before ContextPacker
+    context_text = "\n\n---\n\n".join(doc.page_content for doc, _score in context)
+    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE).format(context=context_text, question=question)
+    return (history + [{"role": "user", "content": prompt}])[-(history_limit * 2):]
+
+
+def time_to_first_token(model, messages, num_ctx):
+    import ollama
+    start = time.perf_counter()
+    for _part in ollama.chat(model=model, messages=messages, stream=True, keep_alive=-1,
+                             options={"num_ctx": num_ctx, "num_predict": 1}):
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--history", type=int, default=12)
+    parser.add_argument("--num-ctx", type=int, default=4096)
+    parser.add_argument("--model", default=None)
+    args = parser.parse_args()
+
+    question = "What torque is specified for the pump assembly P/N-4471-B?"
+    context = retrieved_context(args.k)
+    history = chat_history(args.history)
+    packer = ContextPacker(num_ctx=args.num_ctx)
+
+    before = unpacked_messages(question, context, history)
+    packed = packer.pack(ChatPromptTemplate.from_template(PROMPT_TEMPLATE), question, context=context,
+                         history=history, max_history_messages=9)
+    after = packed["history"] + [{"role": "user", "content": packed["prompt"]}]
+    for name, messages in (("joined", before), ("packed", after)):
+        tokens = sum(packer.counter.count(message["content"]) for message in messages)
+        line = f"{name}: {len(messages)} messages, {tokens} tokens (num_ctx {args.num_ctx})"
+        if args.model:
+            # Load the model first, with a prompt that shares no prefix with the measured one
+            time_to_first_token(args.model, [{"role": "user", "content": "hi"}], args.num_ctx)
+            line += f", time to first token {time_to_first_token(args.model, messages, args.num_ctx):.2f}s"
+        print(line)
+    print(f"packed budget use: {packed['tokens']}")
+
+
+if __name__ == "__main__":
+    main()
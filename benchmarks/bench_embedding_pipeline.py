@@ -0,0 +1,52 @@
+"""
+Benchmark the batched embedding pipeline against a local fake embedding server.
+
+    python benchmarks/bench_embedding_pipeline.py --chunks 2000 --failure-rate 0.05
+
+Each configuration is checked to write every chunk exactly once, failed batches included.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema.document import Document
+from langchain_ollama import OllamaEmbeddings
+from services.embedding_pipeline import EmbeddingPipeline
+from fake_ollama import FakeOllamaServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    chunks = [Document(page_content=f"chunk {i} " + "lorem ipsum " * 60, metadata={"source": "bench", "page": i})
+              for i in range(args.chunks)]
+    ids = [f"bench:{i}:0" for i in range(args.chunks)]
+
+    with FakeOllamaServer(latency=args.latency, failure_rate=args.failure_rate) as server:
+        embeddings = OllamaEmbeddings(model="nomic-embed-text", base_url=server.url)
+        print(f"{'batch':>6} {'conc':>5} {'seconds':>8} {'chunks/s':>9} {'requests':>9} {'failed':>7} {'peak':>5}")
+        for batch_size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                server.requests = server.failures = server.max_in_flight = 0
+                pipeline = EmbeddingPipeline(embeddings, batch_size=batch_size, max_concurrency=concurrency,
+                                             max_retries=5, retry_backoff=0.01)
+                written = []
+                start = time.perf_counter()
+                failed = pipeline.run(chunks, ids, lambda c, batch_ids, e: written.extend(batch_ids))
+                elapsed = time.perf_counter() - start
+                assert sorted(written + failed) == sorted(ids)
+                print(f"{batch_size:>6} {concurrency:>5} {elapsed:>8.2f} {len(written) / elapsed:>9.0f} "
+                      f"{server.requests:>9} {len(failed):>7} {server.max_in_flight:>5}")
+
+
+if __name__ == "__main__":
+    main()
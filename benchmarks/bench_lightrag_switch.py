@@ -0,0 +1,92 @@
+"""
+Measure the per-ingest overhead of switching between the ingest and generation models, against graph
+size: rebuilding LightRAG for each switch (which reloads the graph, KV and vector storages from
+working_dir) versus LightRagWrapper.using_model, which keeps the loaded instance.
+
+    python benchmarks/bench_lightrag_switch.py --sizes 1000 10000 50000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from lightrag.lightrag import LightRAG
+from lightrag.utils import EmbeddingFunc
+from services.lightrag_wrapper import LightRagWrapper
+
+
+async def fake_embed(texts, dim=768):
+    rng = np.random.default_rng(len(texts))
+    return rng.standard_normal((len(texts), dim), dtype=np.float32)
+
+
+async def fake_complete(prompt, **kwargs):
+    return ""
+
+
+def build_rag(working_dir):
+    rag = LightRAG(working_dir=working_dir, llm_model_func=fake_complete, llm_model_name="ingest",
+                   embedding_func=EmbeddingFunc(embedding_dim=768, max_token_size=8192, func=fake_embed))
+    if hasattr(rag, "initialize_storages"):
+        asyncio.get_event_loop().run_until_complete(rag.initialize_storages())
+    return rag
+
+
+async def fill_graph(rag, nodes, edges_per_node=3, batch_size=1000):
+    graph = rag.chunk_entity_relation_graph
+    rng = np.random.default_rng(0)
+    for i in range(nodes):
+        await graph.upsert_node(f"ENTITY {i}", {"entity_id": f"ENTITY {i}", "entity_type": "component",
+                                                "description": f"Component {i} of the pump assembly",
+                                                "source_id": f"chunk-{i // 10}"})
+    for i in range(nodes):
+        for j in rng.integers(0, nodes, edges_per_node):
+            await graph.upsert_edge(f"ENTITY {i}", f"ENTITY {j}", {"weight": 1.0, "keywords": "part of",
+                                                                   "description": f"{i} connects to {j}",
+                                                                   "source_id": f"chunk-{i // 10}"})
+    for start in range(0, nodes, batch_size):
+        await rag.entities_vdb.upsert({f"ent-{i}": {"content": f"ENTITY {i} component", "entity_name": f"ENTITY {i}"}
+                                       for i in range(start, min(start + batch_size, nodes))})
+    await graph.index_done_callback()
+    await rag.entities_vdb.index_done_callback()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for nodes in args.sizes:
+        with tempfile.TemporaryDirectory() as working_dir:
+            asyncio.get_event_loop().run_until_complete(fill_graph(build_rag(working_dir), nodes))
+            size = sum(os.path.getsize(os.path.join(working_dir, name)) for name in os.listdir(working_dir))
+
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                # What ingest paid before: one rebuild for the ingest model and one for the generation model
+                build_rag(working_dir)
+                build_rag(working_dir)
+            rebuild = (time.perf_counter() - start) / args.repeats
+
+            wrapper = LightRagWrapper(working_dir=working_dir, llm_model_ingest="ingest", llm_model_gen="gen",
+                                      doc_dir=working_dir)
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                with wrapper.using_model(wrapper.ingest_model):
+                    pass
+                with wrapper.using_model(wrapper.gen_model):
+                    pass
+            switch = (time.perf_counter() - start) / args.repeats
+
+            print(f"{nodes} entities ({size / 2 ** 20:.1f} MB on disk): rebuild {rebuild:.3f}s per ingest, "
+                  f"using_model {switch * 1e6:.1f}us per ingest")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark DocumentLoader.load_documents: pages/sec against worker count.
+
+    python benchmarks/bench_load_documents.py [pdf_dir] --workers 1 2 4 8
+
+Without a pdf_dir a synthetic corpus is generated in a temporary directory.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.document_loader import DocumentLoader
+
+
+def write_pdf(path, pages, lines_per_page=40):
+    # Minimal uncompressed PDF with one text stream per page
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(pages):
+        text = " T* ".join(f"({os.path.basename(path)} page {page} line {line} lorem ipsum dolor sit amet) Tj"
+                           for line in range(lines_per_page))
+        stream = f"BT /F1 9 Tf 12 TL 40 780 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {pages} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf_dir", nargs="?")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_dir = args.pdf_dir
+        if pdf_dir is None:
+            pdf_dir = tmp
+            for i in range(args.files):
+                write_pdf(os.path.join(tmp, f"doc_{i:04d}.pdf"), args.pages)
+        file_paths = sorted(os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.endswith(".pdf"))
+
+        loader = DocumentLoader(db=None, data_path=pdf_dir)
+        print(f"{len(file_paths)} files")
+        print(f"{'workers':>8} {'pages':>8} {'seconds':>8} {'pages/s':>8}")
+        for workers in args.workers:
+            start = time.perf_counter()
+            pages = loader.load_documents(file_paths, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>8} {len(pages):>8} {elapsed:>8.2f} {len(pages) / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark OffsetTextSplitter against LangChain's RecursiveCharacterTextSplitter (800/80) and
+check that both produce the same chunks.
+
+    python benchmarks/bench_text_splitter.py --pages 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from services.text_splitter import OffsetTextSplitter
+
+
+def make_pages(count, seed=0):
+    rng = random.Random(seed)
+    words = ["revenue", "pump", "assembly", "section", "clause", "the", "of", "and", "P/N-4471-B", "torque"]
+    pages = []
+    for page in range(count):
+        paragraphs = []
+        for _ in range(rng.randint(3, 12)):
+            lines = [" ".join(rng.choice(words) for _ in range(rng.randint(5, 20)))
+                     for _ in range(rng.randint(1, 8))]
+            paragraphs.append("\n".join(lines))
+        pages.append(Document(page_content="\n\n".join(paragraphs), metadata={"source": "bench.pdf", "page": page}))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    characters = sum(len(page.page_content) for page in pages)
+    langchain_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=80,
+                                                        length_function=len, is_separator_regex=False)
+    offset_splitter = OffsetTextSplitter(chunk_size=800, chunk_overlap=80)
+
+    expected = [chunk.page_content for chunk in langchain_splitter.split_documents(pages)]
+    actual = [chunk.page_content for chunk in offset_splitter.split_documents(pages)]
+    assert expected == actual, "chunks differ from RecursiveCharacterTextSplitter"
+
+    runs = {
+        "RecursiveCharacterTextSplitter": lambda: langchain_splitter.split_documents(pages),
+        "OffsetTextSplitter.split_documents": lambda: offset_splitter.split_documents(pages),
+        "OffsetTextSplitter.split_spans": lambda: [offset_splitter.split_spans(page.page_content) for page in pages],
+    }
+    print(f"{len(pages)} pages, {characters / 1e6:.1f}M characters, {len(expected)} chunks")
+    for name, run in runs.items():
+        best = min(timed(run) for _ in range(args.repeat))
+        print(f"{name:>36}: {best:.3f}s ({characters / best / 1e6:.1f}M chars/s)")
+
+
+def timed(run):
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark VectorIndex search against a Chroma query over the same collection, for each storage
+precision, reporting the memory saved against float32 and recall@k against exact float32 search.
+
+    python benchmarks/bench_vector_index.py --chunks 50000 --dim 768
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from chromadb import PersistentClient
+from services.vector_index import VectorIndex, to_distances, top_k
+
+
+def disk_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--sources", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.chunks, args.dim), dtype=np.float32)
+    ids = [f"doc{i % args.sources}.pdf:{i}:0" for i in range(args.chunks)]
+    metadatas = [{"source": f"doc{i % args.sources}.pdf", "page": i} for i in range(args.chunks)]
+    documents = [f"chunk {i}" for i in range(args.chunks)]
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as path:
+        collection = PersistentClient(os.path.join(path, "chroma")).create_collection("bench")
+        for i in range(0, args.chunks, 5000):
+            collection.add(ids=ids[i:i + 5000], embeddings=vectors[i:i + 5000],
+                           documents=documents[i:i + 5000], metadatas=metadatas[i:i + 5000])
+
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        exact = top_k(to_distances(vectors @ queries.T, norms, queries), args.k)
+
+        def exact_vectors(chunk_ids):
+            result = collection.get(ids=chunk_ids, include=["embeddings"])
+            return dict(zip(result["ids"], result["embeddings"]))
+
+        for dtype in ("float32", "float16", "int8"):
+            index = VectorIndex(os.path.join(path, dtype), dtype=dtype, exact_vectors=exact_vectors)
+            start = time.perf_counter()
+            index.sync(collection)
+            stats = index.stats()
+            print(f"{dtype}: synced {args.chunks} chunks in {time.perf_counter() - start:.2f}s, "
+                  f"{stats['bytes'] / 2 ** 20:.1f} MB, {stats['bytes_saved'] / 2 ** 20:.1f} MB saved against float32, "
+                  f"{disk_size(os.path.join(path, dtype)) / 2 ** 20:.1f} MB on disk")
+            for rescore in (False, True):
+                start = time.perf_counter()
+                results = index.search_batch(queries, k=args.k, rescore=rescore)
+                elapsed = time.perf_counter() - start
+                hits = sum(len({doc.id for doc, _ in found} & {ids[row] for row in exact[:, column]})
+                           for column, found in enumerate(results))
+                print(f"  recall@{args.k} {'with' if rescore else 'without'} rescoring: "
+                      f"{hits / exact.size:.3f} ({elapsed / args.queries * 1e3:.2f}ms per query in a batch)")
+
+            for label, where in (("no filter", None), ("one source", {"source": "doc7.pdf"}),
+                                 ("ten sources", {"source": {"$in": [f"doc{i}.pdf" for i in range(10)]}})):
+                chroma_time, index_time, recall = 0.0, 0.0, 0
+                for query in queries:
+                    start = time.perf_counter()
+                    expected = collection.query(query_embeddings=[query], n_results=args.k, where=where)["ids"][0]
+                    chroma_time += time.perf_counter() - start
+                    start = time.perf_counter()
+                    actual = [doc.id for doc, _ in index.search(query, k=args.k, filter=where)]
+                    index_time += time.perf_counter() - start
+                    recall += len(set(expected) & set(actual))
+                print(f"  {label:>11}: chroma {chroma_time / args.queries * 1e3:.2f}ms, "
+                      f"index {index_time / args.queries * 1e3:.2f}ms, "
+                      f"overlap with chroma {recall / (args.queries * args.k):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Local stand-in for the Ollama HTTP API, for benchmarks that should not depend on a model.
+Embeddings are derived from a hash of the text, so equal texts get equal vectors.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllamaServer:
+    def __init__(self, dim=768, latency=0.05, per_text_latency=0.001, failure_rate=0.0, port=0,
+                 fail_requests=0, fail_marker=None):
+        self.dim = dim
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.failure_rate = failure_rate
+        # Deterministic failures for tests: the first fail_requests requests, and every request with a
+        # text containing fail_marker
+        self.fail_requests = fail_requests
+        self.fail_marker = fail_marker
+        self.requests = 0
+        self.texts = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        rng = random.Random(seed)
+        return [rng.uniform(-1, 1) for _ in range(self.dim)]
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+                texts = body.get("input", [])
+                texts = [texts] if isinstance(texts, str) else texts
+                with fake.lock:
+                    fake.requests += 1
+                    number = fake.requests
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    time.sleep(fake.latency + fake.per_text_latency * len(texts))
+                    if (self.path != "/api/embed" or random.random() < fake.failure_rate
+                            or number <= fake.fail_requests
+                            or fake.fail_marker is not None and any(fake.fail_marker in text for text in texts)):
+                        with fake.lock:
+                            fake.failures += 1
+                        self.send_response(500)
+                        self.end_headers()
+                        self.wfile.write(b'{"error": "injected failure"}')
+                        return
+                    with fake.lock:
+                        fake.texts += len(texts)
+                    payload = json.dumps({"model": body.get("model"),
+                                          "embeddings": [fake.embed(text) for text in texts]}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -2,6 +2,11 @@ import os
 from services.chroma_db import Database
 from services.document_loader import DocumentLoader
 from services.lightrag_wrapper import LightRagWrapper
+from services.ingest_jobs import IngestJobQueue
+from services.text_extractor import TextExtractor
+from services.answer_cache import AnswerCache
+from services.ollama_client import OllamaClient
+from services.llm_cache import LLMCache
 from gradio_funcs import HistoryManager, FileManager, ChatManager
 
 
@@ -21,39 +26,119 @@ class ApplicationContainer:
             "LIGHTRAG_DIR": os.environ.get("LIGHTRAG_DIR"),
             "LR_INGEST": os.environ.get("LR_INGEST"),
             "LR_GENERATE": os.environ.get("LR_GENERATE"),
-            "CHAT_LOG_DB": os.environ.get("CHAT_LOG_DB")
+            "CHAT_LOG_DB": os.environ.get("CHAT_LOG_DB"),
+            "LOAD_WORKERS": int(os.environ.get("LOAD_WORKERS", 1)),
+            "LOAD_TIMEOUT": float(os.environ.get("LOAD_TIMEOUT", 300)),
+            "EMBED_BATCH_SIZE": int(os.environ.get("EMBED_BATCH_SIZE", 64)),
+            "EMBED_CONCURRENCY": int(os.environ.get("EMBED_CONCURRENCY", 4)),
+            "INGEST_JOBS_DB": os.environ.get("INGEST_JOBS_DB", "ingest_jobs.sqlite3"),
+            "INGEST_WORKERS": int(os.environ.get("INGEST_WORKERS", 1)),
+            "EXTRACTION_CACHE_DIR": os.environ.get("EXTRACTION_CACHE_DIR", "extraction_cache"),
+            "NEAR_DUP_THRESHOLD": float(os.environ.get("NEAR_DUP_THRESHOLD", 0)) or None,
+            "QUERY_CACHE_SIZE": int(os.environ.get("QUERY_CACHE_SIZE", 1024)),
+            "QUERY_CACHE_TTL": float(os.environ.get("QUERY_CACHE_TTL", 600)),
+            "ANSWER_CACHE_PATH": os.environ.get("ANSWER_CACHE_PATH", "answer_cache.sqlite3"),
+            "ANSWER_CACHE_THRESHOLD": float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95)),
+            "VECTOR_INDEX": os.environ.get("VECTOR_INDEX", "false").lower() in ("1", "true", "yes"),
+            "VECTOR_INDEX_DTYPE": os.environ.get("VECTOR_INDEX_DTYPE", "float32"),
+            "VECTOR_INDEX_RESCORE": int(os.environ.get("VECTOR_INDEX_RESCORE", 4)),
+            "RETRIEVAL_MODE": os.environ.get("RETRIEVAL_MODE", "vector"),
+            "NUM_CTX": int(os.environ.get("NUM_CTX", 4096)),
+            "RESPONSE_TOKENS": int(os.environ.get("RESPONSE_TOKENS", 1024)),
+            "OLLAMA_MAX_CONNECTIONS": int(os.environ.get("OLLAMA_MAX_CONNECTIONS", 32)),
+            "OLLAMA_MAX_GENERATIONS": int(os.environ.get("OLLAMA_MAX_GENERATIONS", 4)),
+            "LR_MAX_PARALLEL_INSERT": int(os.environ.get("LR_MAX_PARALLEL_INSERT", 4)),
+            "LLM_CACHE_PATH": os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite3"),
+            "LLM_CACHE_MAX_MB": int(os.environ.get("LLM_CACHE_MAX_MB", 1024)),
+            "LLM_CACHE_MAX_AGE_DAYS": float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", 0)) or None,
+            "LLM_CACHE_PRUNE_MODELS": os.environ.get("LLM_CACHE_PRUNE_MODELS", "false").lower() in ("1", "true", "yes")
         }
 
     def initialize_services(self):
         # Core infrastructure
         chroma_db = Database(chroma_path=self.config["CHROMA_PATH"],
-                            collection_name=self.config["CHROMA_COLLECTION"])
+                            collection_name=self.config["CHROMA_COLLECTION"],
+                            embed_batch_size=self.config["EMBED_BATCH_SIZE"],
+                            embed_concurrency=self.config["EMBED_CONCURRENCY"],
+                            near_dup_threshold=self.config["NEAR_DUP_THRESHOLD"],
+                            query_cache_size=self.config["QUERY_CACHE_SIZE"],
+                            query_cache_ttl=self.config["QUERY_CACHE_TTL"],
+                            vector_index=self.config["VECTOR_INDEX"],
+                            vector_index_dtype=self.config["VECTOR_INDEX_DTYPE"],
+                            vector_index_rescore=self.config["VECTOR_INDEX_RESCORE"],
+                            retrieval_mode=self.config["RETRIEVAL_MODE"])
         self.services["chroma_db"] = chroma_db
 
+        ollama_client = OllamaClient(max_connections=self.config["OLLAMA_MAX_CONNECTIONS"],
+                                     max_generations=self.config["OLLAMA_MAX_GENERATIONS"])
+        self.services["ollama_client"] = ollama_client
+
         # Service layer
-        document_loader = DocumentLoader(db=chroma_db.db,
+        extractor = TextExtractor(cache_dir=self.config["EXTRACTION_CACHE_DIR"])
+        self.services["extractor"] = extractor
+
+        document_loader = DocumentLoader(db=chroma_db,
                                        collection_name=self.config["CHROMA_COLLECTION"],
-                                       data_path=self.config["SAVE_DIR"])
+                                       data_path=self.config["SAVE_DIR"],
+                                       load_workers=self.config["LOAD_WORKERS"],
+                                       load_timeout=self.config["LOAD_TIMEOUT"],
+                                       extractor=extractor)
         self.services["document_loader"] = document_loader
 
+        llm_cache = LLMCache(path=self.config["LLM_CACHE_PATH"], max_bytes=self.config["LLM_CACHE_MAX_MB"] << 20)
+        max_age = self.config["LLM_CACHE_MAX_AGE_DAYS"]
+        # Pruning drops the entries of every model but LR_INGEST, e.g. those left over from a previous
+        # LR_INGEST, so it is opt-in for caches shared between setups
+        prune = self.config["LLM_CACHE_PRUNE_MODELS"] and self.config["LR_INGEST"]
+        if max_age or prune:
+            dropped = llm_cache.compact(max_age=max_age * 86400 if max_age else None,
+                                        models=[self.config["LR_INGEST"]] if prune else None)
+            print(f"LLM cache compacted, {dropped} stale entries dropped")
+        self.services["llm_cache"] = llm_cache
+
         lightrag = LightRagWrapper(working_dir=self.config["LIGHTRAG_DIR"],
                                   llm_model_ingest=self.config["LR_INGEST"],
                                   llm_model_gen=self.config["LR_GENERATE"],
-                                  doc_dir=self.config["SAVE_DIR"])
+                                  doc_dir=self.config["SAVE_DIR"],
+                                  extractor=extractor,
+                                  ollama_client=ollama_client,
+                                  llm_model_max_async=self.config["OLLAMA_MAX_GENERATIONS"],
+                                  max_parallel_insert=self.config["LR_MAX_PARALLEL_INSERT"],
+                                  llm_cache=llm_cache)
         self.services["lightrag"] = lightrag
 
+        ingest_jobs = IngestJobQueue(db_path=self.config["INGEST_JOBS_DB"],
+                                     document_loader=document_loader,
+                                     lightrag=lightrag,
+                                     workers=self.config["INGEST_WORKERS"])
+        ingest_jobs.start()
+        self.services["ingest_jobs"] = ingest_jobs
+
         # Manager classes
         history_manager = HistoryManager(db_path=self.config["CHAT_LOG_DB"])
         self.services["history_manager"] = history_manager
 
         file_manager = FileManager(save_dir=self.config["SAVE_DIR"],
                                   document_loader=document_loader,
-                                  lightrag=lightrag)
+                                  lightrag=lightrag,
+                                  ingest_jobs=ingest_jobs)
         self.services["file_manager"] = file_manager
 
+        answer_cache = AnswerCache(path=self.config["ANSWER_CACHE_PATH"],
+                                   threshold=self.config["ANSWER_CACHE_THRESHOLD"])
+        # Answers are dropped when a document they were built from is re-ingested or deleted
+        chroma_db.on_change(lambda sources: answer_cache.invalidate_rag_type("NaiveRAG") if sources is None
+                            else answer_cache.invalidate_sources(sources))
+        lightrag.on_change(lambda file_paths: answer_cache.invalidate_rag_type("LightRAG"))
+        self.services["answer_cache"] = answer_cache
+
         chat_manager = ChatManager(chroma_db=chroma_db,
                                  lightrag_instance=lightrag,
-                                 history_manager=history_manager)
+                                 history_manager=history_manager,
+                                 answer_cache=answer_cache,
+                                 num_ctx=self.config["NUM_CTX"],
+                                 response_tokens=self.config["RESPONSE_TOKENS"],
+                                 ollama_client=ollama_client)
         self.services["chat_manager"] = chat_manager
 
     def get(self, service_name):
@@ -29,11 +29,10 @@ CHAT_LOG_DB = os.environ.get("CHAT_LOG_DB")
 # 4. Speed up ingestion of documents
 #       - already fast for NaiveRAG
 #       - LightRAG inherently slow
-# 5. Simplify DocumentLoader to just take a chroma_db
 # 6. LightRAG currently has no ability to understand tables from documents
 
 # chroma_db = Database(chroma_path=CHROMA_PATH, collection_name=CHROMA_COLLECTION)
-# document_loader = DocumentLoader(db=chroma_db.db, data_path=SAVE_DIR, collection_name=CHROMA_COLLECTION)
+# document_loader = DocumentLoader(db=chroma_db, data_path=SAVE_DIR, collection_name=CHROMA_COLLECTION)
 # lightrag_wrapper = LightRagWrapper(working_dir=LIGHTRAG_DIR, llm_model_ingest=LR_INGEST, llm_model_gen=LR_GEN, doc_dir=SAVE_DIR)
 # file_manager = FileManager(save_dir=SAVE_DIR, document_loader=document_loader, lightrag=lightrag_wrapper)
 # history_manager = HistoryManager(db_path=CHAT_LOG_DB)
@@ -50,6 +49,10 @@ def create_file_upload_component(ui):
 
         uploaded_files = gr.State()
         setup_file_handlers(ui, file_input, uploaded_files, status, file_checkboxes, delete_files_button)
+
+        # Ingestion runs in the background; poll its progress
+        ingest_progress = gr.Textbox(label="Ingestion Progress", lines=4)
+        gr.Timer(2).tick(ui.ingest_progress, outputs=ingest_progress)
         return file_input, status, file_checkboxes, delete_files_button
 
 def setup_file_handlers(ui, file_input, uploaded_files, status, file_checkboxes, delete_files_button):
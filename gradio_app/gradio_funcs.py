@@ -1,3 +1,4 @@
+import asyncio
 import os
 import shutil
 import re
@@ -8,16 +9,22 @@ from services.chatlog import ChatHistory, ChatMessage, ChatHistoryArena, ChatMes
 from services.utils import generate_session_id
 from services.lightrag_wrapper import LightRagWrapper
 from services.ollama_interface import OllamaInterface
+from services.ollama_client import OllamaClient
 from services.document_loader import DocumentLoader
+from services.ingest_jobs import IngestJobQueue
+from services.answer_cache import AnswerCache, context_fingerprint
+from services.single_flight import SingleFlight
 
 
 
 class FileManager:
-    def __init__(self, save_dir: str, document_loader: DocumentLoader, lightrag: LightRagWrapper):
+    def __init__(self, save_dir: str, document_loader: DocumentLoader, lightrag: LightRagWrapper,
+                 ingest_jobs: IngestJobQueue = None):
         self.save_dir = save_dir
         os.makedirs(self.save_dir, exist_ok=True)
         self.document_loader = document_loader
         self.lightrag = lightrag
+        self.ingest_jobs = ingest_jobs
 
     def save_files(self, files):
         """
@@ -59,18 +66,34 @@ class FileManager:
         if not uploaded_files:
             return "No files uploaded"
 
+        if self.ingest_jobs is not None:
+            job_id = self.ingest_jobs.submit(uploaded_files)
+            return f"Queued ingestion job {job_id[:8]} for: " + str(uploaded_files)
+
         try:
             # Processing for NaiveRAG
             self.document_loader.ingest(uploaded_files)
 
             # Processing for LightRAG
-            self.lightrag.ingest(uploaded_files)
+            errors = self.lightrag.ingest(uploaded_files)
 
         except Exception as e:
             return "Error processing files: " + str(e)
 
+        failed = [file for file, error in errors.items() if error]
+        if failed:
+            return f"Processed selected files: {uploaded_files}, LightRAG failed for: {failed}"
         return "Processed selected files: " + str(uploaded_files)
 
+    def ingest_progress(self):
+        """
+        Progress of the background ingestion jobs
+        :return: Progress text
+        """
+        if self.ingest_jobs is None:
+            return gr.update()
+        return self.ingest_jobs.format_progress()
+
     def delete_files(self, files):
         """
         Delete files from the data directory
@@ -79,10 +102,9 @@ class FileManager:
         """
         if not files:
             return "No files selected"
+        # Delete from NaiveRAG
+        self.document_loader.delete_documents(files)
         for file in files:
-            # Delete from NaiveRAG
-            self.document_loader.delete_document(file)
-
             # Delete from LightRAG
             self.lightrag.delete_document(file)
 
@@ -297,10 +319,15 @@ class HistoryManager:
 
 
 class ChatManager:
-    def __init__(self, chroma_db, lightrag_instance, history_manager: HistoryManager):
+    def __init__(self, chroma_db, lightrag_instance, history_manager: HistoryManager, answer_cache: AnswerCache = None,
+                 num_ctx=4096, response_tokens=1024, ollama_client: OllamaClient = None):
+        self.chroma_db = chroma_db
         self.lightrag = lightrag_instance
-        self.ollama = OllamaInterface("deepseek-r1e:latest", chroma_db.db)
+        self.ollama = OllamaInterface("deepseek-r1e:latest", chroma_db, num_ctx=num_ctx,
+                                      response_tokens=response_tokens, client=ollama_client)
         self.history_manager = history_manager
+        self.answer_cache = answer_cache
+        self.flights = SingleFlight()
 
     def user(self, user_message, history: list, session_id=None):
         """
@@ -324,6 +351,18 @@ class ChatManager:
         context = self.ollama.get_context(user_message, doc_ids)
         return context, history, user_message
 
+    def get_contexts(self, user_messages, doc_ids=None):
+        """
+        Get contexts for many user messages with batched embedding and search
+        :param user_messages: List of user messages
+        :param doc_ids: Registry doc IDs to restrict retrieval to
+        :return: List with the context of each message
+        """
+        return self.ollama.get_contexts(user_messages, doc_ids)
+
+    async def aget_contexts(self, user_messages, doc_ids=None):
+        return await self.ollama.aget_contexts(user_messages, doc_ids)
+
     def handle_reasoning(self, model_response):
         """
         Parse reasoning from model_response
@@ -336,33 +375,113 @@ class ChatManager:
             return model_response, thinking
         return model_response, None
 
-    def assistant(self, history: list, user_message, rag_type, context, session_id=None, arena_flag=False):
+    def visible_response(self, response):
+        """
+        Strip reasoning from a partial response, including a <think> block that is still open
+        :param response: Response generated so far
+        :return: Text to show
+        """
+        response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL)
+        if "<think>" in response:
+            response = response[:response.index("<think>")]
+        return response
+
+    def flight_key(self, history: list, user_message, rag_type, model, context_fp):
         """
-        Handle assistant response
+        Requests with the same key would generate the same answer, so they share one generation
+        """
+        query = " ".join(user_message.lower().split())
+        conversation = context_fingerprint(f"{message['role']}:{message['content']}" for message in history[:-1])
+        return rag_type, model, query, context_fp, conversation
+
+    async def generate_answer(self, history: list, user_message, rag_type, context, cache_entry=None):
+        """
+        Generate a response and cache it once it is complete
+        :param cache_entry: Dict with the answer cache fields, or None when the answer is not cached
+        :return: Async generator of response text pieces
+        """
+        failed = False
+        if rag_type == "LightRAG":
+            # LightRAG answers in one piece
+            content = await asyncio.to_thread(self.lightrag.query, user_message, history=history)
+            yield content
+        else:
+            pieces = []
+            try:
+                async for piece in self.ollama.aquery_stream(user_message, use_context=True, history=history,
+                                                             context=context):
+                    pieces.append(piece)
+                    yield piece
+            except Exception as e:
+                print(f"Error querying Ollama: {e}")
+                failed = True
+                yield "An error occurred. Please try again."
+            content = "".join(pieces)
+
+        if cache_entry is not None and not failed:
+            self.answer_cache.store(rag_type, cache_entry["model"], user_message, cache_entry["vector"], content,
+                                    cache_entry["context_fp"], sources=cache_entry["sources"])
+
+    async def generate_stream(self, history: list, user_message, rag_type, context):
+        """
+        Stream a response, reusing a cached answer to an equivalent question asked against the same
+        context. Only opening questions are cached, later turns depend on the conversation. A request
+        identical to one that is still generating follows that generation instead of starting another.
+        :param history: Chat history
+        :param user_message: User message
+        :param rag_type: RAG type
+        :param context: Context from vector search
+        :return: Async generator of dicts with a piece of the response content and whether it was a cache hit
+        """
+        model = self.lightrag.gen_model if rag_type == "LightRAG" else self.ollama.ollama_model_str
+        documents = [doc for doc, _score in context or []] if rag_type != "LightRAG" else []
+        context_fp = context_fingerprint(doc.metadata.get("id", "") for doc in documents)
+        cache_entry = None
+        if self.answer_cache is not None and len(history) <= 1:
+            vector = await asyncio.to_thread(self.chroma_db.embed_query, user_message)
+            if (content := self.answer_cache.lookup(rag_type, model, vector, context_fp)) is not None:
+                yield {"content": content, "cached": True}
+                return
+            cache_entry = {"model": model, "vector": vector, "context_fp": context_fp,
+                           "sources": [doc.metadata.get("source") for doc in documents]}
+
+        key = self.flight_key(history, user_message, rag_type, model, context_fp)
+        async for piece in self.flights.stream(
+                key, lambda: self.generate_answer(history, user_message, rag_type, context, cache_entry)):
+            yield {"content": piece, "cached": False}
+
+    async def assistant(self, history: list, user_message, rag_type, context, session_id=None, arena_flag=False):
+        """
+        Stream the assistant response into the chat history, saving it once the response is complete.
+        Runs on the caller's event loop, so concurrent chats do not hold a thread each while generating.
+        Answers served from the answer cache carry {"cached": True} in their message metadata, and a
+        title so the chat shows it.
         :param history: Chat history
         :param user_message: User message
         :param rag_type: RAG type
         :param context: Context from vector search
         :param session_id: Session ID
         :param arena_flag: Arena flag
+        :return: Async generator of the updated chat history
         """
         try:
-            if rag_type == "LightRAG":
-                content = self.lightrag.query(user_message, history=history)
-            else:
-                response = self.ollama.query(user_message, use_context=True, history=history, context=context)
-                content = response["message"]["content"]
-            content, thinking = self.handle_reasoning(content)
             history.append({"role": "assistant", "content": ""})
-            for character in content:
-                history[-1]["content"] += character
-                # yield history
-
+            response = ""
+            async for piece in self.generate_stream(history[:-1], user_message, rag_type, context):
+                if piece["cached"]:
+                    history[-1]["metadata"] = {"title": "Answered from cache", "cached": True}
+                response += piece["content"]
+                visible = self.visible_response(response)
+                if visible != history[-1]["content"]:
+                    history[-1]["content"] = visible
+                    yield history
+
+            history[-1]["content"], thinking = self.handle_reasoning(response)
+            yield history
             if arena_flag:
-                self.history_manager.save_chat_history_arena(history, rag_type, session_id)
+                await asyncio.to_thread(self.history_manager.save_chat_history_arena, history, rag_type, session_id)
             else:
-                self.history_manager.save_chat_history(history, rag_type, session_id)
-            return history
+                await asyncio.to_thread(self.history_manager.save_chat_history, history, rag_type, session_id)
         except Exception as e:
             print(f"Error in assistant: {e}")
 
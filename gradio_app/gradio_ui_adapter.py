@@ -14,6 +14,9 @@ class GradioUIAdapter:
     def process_files(self, uploaded_files):
         return self.file_manager.process_files(uploaded_files)
 
+    def ingest_progress(self):
+        return self.file_manager.ingest_progress()
+
     def update_files(self):
         files = self.file_manager.list_files()
         return gr.update(choices=files)
@@ -28,8 +31,9 @@ class GradioUIAdapter:
     def get_context(self, chat_log, user_message):
         return self.chat_manager.get_context(chat_log, user_message)
 
-    def assistant(self, chat_log, user_message, rag_type, context, session_id):
-        return self.chat_manager.assistant(chat_log, user_message, rag_type, context, session_id)
+    async def assistant(self, chat_log, user_message, rag_type, context, session_id):
+        async for history in self.chat_manager.assistant(chat_log, user_message, rag_type, context, session_id):
+            yield history
 
     # History methods
     def get_chat_histories(self):
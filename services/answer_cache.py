@@ -0,0 +1,100 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+
+
+def context_fingerprint(chunk_ids):
+    return hashlib.sha256("\n".join(sorted(chunk_ids)).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Persistent semantic cache of generated answers. An answer is reused for a query whose embedding
+    is within threshold cosine similarity of the original, for the same RAG type, model and set of
+    retrieved chunks. Entries are dropped when a source they were built from changes.
+    """
+
+    def __init__(self, path, threshold=0.95, max_entries=2000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS answers ("
+                              "id INTEGER PRIMARY KEY, rag_type TEXT NOT NULL, model TEXT NOT NULL, "
+                              "context_fp TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, "
+                              "answer TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS answers_key ON answers (rag_type, model, context_fp)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS answer_sources ("
+                              "answer_id INTEGER NOT NULL, source TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS answer_sources_source ON answer_sources (source)")
+
+    def lookup(self, rag_type, model, vector, context_fp=""):
+        """
+        :return: Cached answer, or None
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            rows = self.conn.execute("SELECT id, vector FROM answers WHERE rag_type = ? AND model = ? "
+                                     "AND context_fp = ?", (rag_type, model, context_fp)).fetchall()
+            best_id, best_similarity = None, self.threshold
+            if rows:
+                matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                similarities = matrix @ vector / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector) + 1e-12)
+                index = int(np.argmax(similarities))
+                if similarities[index] >= best_similarity:
+                    best_id = rows[index][0]
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), best_id))
+            return self.conn.execute("SELECT answer FROM answers WHERE id = ?", (best_id,)).fetchone()[0]
+
+    def store(self, rag_type, model, query, vector, answer, context_fp="", sources=()):
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO answers (rag_type, model, context_fp, query, vector, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (rag_type, model, context_fp, query, np.asarray(vector, dtype=np.float32).tobytes(), answer, now, now))
+            self.conn.executemany("INSERT INTO answer_sources (answer_id, source) VALUES (?, ?)",
+                                  [(cursor.lastrowid, source) for source in set(sources)])
+            count = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                evicted = [row[0] for row in self.conn.execute(
+                    "SELECT id FROM answers ORDER BY last_used LIMIT ?", (count - self.max_entries,))]
+                self._delete(evicted)
+
+    def _delete(self, ids):
+        self.conn.executemany("DELETE FROM answers WHERE id = ?", [(answer_id,) for answer_id in ids])
+        self.conn.executemany("DELETE FROM answer_sources WHERE answer_id = ?", [(answer_id,) for answer_id in ids])
+
+    def invalidate_sources(self, sources):
+        """
+        Drop every answer built from any of the given sources
+        """
+        with self.lock, self.conn:
+            ids = {row[0] for source in set(sources) for row in self.conn.execute(
+                "SELECT answer_id FROM answer_sources WHERE source = ?", (source,))}
+            self._delete(ids)
+            self.invalidations += len(ids)
+
+    def invalidate_rag_type(self, rag_type):
+        with self.lock, self.conn:
+            ids = [row[0] for row in self.conn.execute("SELECT id FROM answers WHERE rag_type = ?", (rag_type,))]
+            self._delete(ids)
+            self.invalidations += len(ids)
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                "entries": entries, "max_entries": self.max_entries}
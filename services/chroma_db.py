@@ -1,19 +1,112 @@
+import asyncio
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from langchain_chroma import Chroma
 from chromadb import PersistentClient
 from .get_embedding_func import get_embedding_function
+from .ingest_manifest import IngestManifest
+from .embedding_pipeline import EmbeddingPipeline
+from .embedding_cache import QueryEmbeddingCache
+from .near_duplicates import NearDuplicateIndex
+import numpy as np
+from langchain.schema.document import Document
+from .vector_index import VectorIndex, to_distances, top_k
+from .keyword_index import KeywordIndex, reciprocal_rank_fusion
+
+def source_filter(sources):
+    sources = list(sources)
+    return {"source": sources[0]} if len(sources) == 1 else {"source": {"$in": sources}}
+
 
 class Database:
-    def __init__(self, chroma_path="chroma", collection_name="documents"):
+    def __init__(self, chroma_path="chroma", collection_name="documents", embed_batch_size=64,
+                 embed_concurrency=4, embed_retries=3, near_dup_threshold=None, query_cache_size=1024,
+                 query_cache_ttl=600, vector_index=False, vector_index_dtype="float32",
+                 vector_index_rescore=4,
+                 retrieval_mode="vector", rrf_k=60, postfilter_selectivity=0.2, source_cache_size=64,
+                 legacy_source_dirs=("./data/pdfs", "data/pdfs")):
         self.collection_name = collection_name
         self.chroma_path = chroma_path
         self.persistent_client = PersistentClient(self.chroma_path)
         self.db = Chroma(client=self.persistent_client,
                          embedding_function=get_embedding_function(),
                          collection_name=self.collection_name)
+        self.embedding_pipeline = EmbeddingPipeline(self.db.embeddings,
+                                                    batch_size=embed_batch_size,
+                                                    max_concurrency=embed_concurrency,
+                                                    max_retries=embed_retries)
+        self.manifest = IngestManifest(os.path.join(self.chroma_path, f"{self.collection_name}_manifest.sqlite3"))
+        self.query_cache = QueryEmbeddingCache(maxsize=query_cache_size, ttl=query_cache_ttl)
+        self.listeners = []
+        self.near_duplicates = None
+        if near_dup_threshold:
+            self.near_duplicates = NearDuplicateIndex(
+                os.path.join(self.chroma_path, f"{self.collection_name}_near_duplicates.sqlite3"),
+                threshold=near_dup_threshold)
+        self.vector_index = None
+        if vector_index:
+            self.vector_index = VectorIndex(
+                os.path.join(self.chroma_path, f"{self.collection_name}_vector_index"),
+                dtype=vector_index_dtype,
+                space=(self.db._collection.metadata or {}).get("hnsw:space", "l2"),
+                rescore_factor=vector_index_rescore,
+                exact_vectors=self.get_embeddings)
+            print(f"Vector index synced with Chroma, {self.vector_index.sync(self.db._collection)} chunks updated")
+            stats = self.vector_index.stats()
+            print(f"Vector index stores {stats['vectors']} vectors as {stats['dtype']}, "
+                  f"{stats['bytes'] / 2 ** 20:.1f} MB, {stats['bytes_saved'] / 2 ** 20:.1f} MB saved against float32")
+        # "vector", "keyword" or "hybrid"; the keyword index is only kept when it is used. Scores follow
+        # the mode: Chroma distances for vector (lower is closer), BM25 for keyword and reciprocal rank
+        # fusion for hybrid (higher is better). Results are best first in every mode.
+        self.retrieval_mode = retrieval_mode
+        self.rrf_k = rrf_k
+        self.keyword_index = None
+        if retrieval_mode != "vector":
+            self.keyword_index = KeywordIndex(
+                os.path.join(self.chroma_path, f"{self.collection_name}_keywords.sqlite3"))
+            print(f"Keyword index synced with Chroma, "
+                  f"{self.keyword_index.sync(self.db._collection, manifest=self.manifest)} chunks updated")
+        self.search_executor = ThreadPoolExecutor(max_workers=2)
+        # Scoped searches over a small share of the collection filter first, broader ones filter results
+        self.postfilter_selectivity = postfilter_selectivity
+        self.source_cache_size = source_cache_size
+        self.source_cache = OrderedDict()
+        self.source_cache_lock = threading.Lock()
+        # Bumped on every invalidation, so a read that raced with a write is not cached
+        self.source_cache_generation = 0
+        self.on_change(self.invalidate_source_cache)
+        # Documents ingested before the registry are only known by their source metadata, which was the
+        # upload directory joined with the file name
+        self.legacy_source_dirs = legacy_source_dirs
+
+    def on_change(self, listener):
+        """
+        Register a callback run as listener(sources) after chunks of those sources are written or
+        deleted; sources is None when the whole collection is cleared
+        """
+        self.listeners.append(listener)
+
+    def notify(self, sources):
+        for listener in self.listeners:
+            try:
+                listener(sources)
+            except Exception as e:
+                print(f"Error notifying change listener: {e}")
 
     def clear_database(self):
         try:
             self.db.delete_collection()
+            self.notify(None)
+            self.manifest.clear()
+            if self.vector_index is not None:
+                self.vector_index.clear()
+            if self.keyword_index is not None:
+                self.keyword_index.clear()
+            if self.near_duplicates is not None:
+                self.near_duplicates.clear()
         except Exception as e:
             print(f"Error clearing database: {e}")
 
@@ -25,18 +118,365 @@ class Database:
         self.db = Chroma(persist_directory=self.chroma_path,
                          embedding_function=get_embedding_function(),
                          collection_name=self.collection_name)
+        self.embedding_pipeline.embedding_function = self.db.embeddings
+
+    def embed_query(self, query: str):
+        return self.query_cache.embed(query, self.db.embeddings.embed_query)
+
+    def embed_queries(self, queries):
+        """
+        Embed many queries, sending the ones that are not cached in a single embedding request
+        :param queries: List of query texts
+        :return: List of query vectors
+        """
+        vectors = [self.query_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+        if missing:
+            embedded = dict(zip(missing, self.db.embeddings.embed_documents(missing)))
+            for query, vector in embedded.items():
+                self.query_cache.put(query, vector)
+            vectors = [embedded[query] if vector is None else vector for query, vector in zip(queries, vectors)]
+        return vectors
+
+    def similarity_search_with_score(self, query: str, k=5, filter=None, sources=None):
+        """
+        :param sources: Dict of registered source to chunk count the search is restricted to, which
+            replaces filter
+        """
+        if sources is not None:
+            return self.search_sources_by_vector(self.embed_query(query), sources, k=k)
+        return self.similarity_search_by_vector_with_score(self.embed_query(query), k=k, filter=filter)
+
+    def search_sources_by_vector(self, embedding, sources: dict, k=5):
+        """
+        Vector search restricted to the given sources. Selective scopes are searched exactly over their
+        own vectors; broad scopes query the whole collection with a larger k and filter the results.
+        :param embedding: Query vector
+        :param sources: Dict of source to chunk count, as resolved by the document registry
+        :param k: Number of results
+        :return: List of (document, distance)
+        """
+        if self.vector_index is not None:
+            return self.vector_index.search(embedding, k=k, filter=source_filter(sources))
+        total = self.manifest.count_chunks() or 1
+        selected = sum(count or 0 for count in sources.values())
+        if selected / total >= self.postfilter_selectivity:
+            fetch_k = min(total, math.ceil(2 * k * total / max(selected, 1)))
+            results = [result for result in self.db.similarity_search_by_vector_with_relevance_scores(embedding, k=fetch_k)
+                       if result[0].metadata.get("source") in sources]
+            if len(results) >= k:
+                return results[:k]
+        return self.prefiltered_search(embedding, sources, k=k)
+
+    def prefiltered_search(self, embedding, sources, k=5):
+        return self.prefiltered_search_batch([embedding], sources, k=k)[0]
+
+    def prefiltered_search_batch(self, embeddings, sources, k=5):
+        """
+        Exact search over the cached vectors of the given sources, for every query at once
+        :return: List with the (document, distance) results of each query
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        space = (self.db._collection.metadata or {}).get("hnsw:space", "l2")
+        documents, vectors, norms = [], [], []
+        for source in sources:
+            source_documents, source_vectors, source_norms = self.get_source_vectors(source, space)
+            if source_documents:
+                documents.extend(source_documents)
+                vectors.append(source_vectors)
+                norms.append(source_norms)
+        if not documents:
+            return [[] for _ in range(len(queries))]
+        distances = to_distances(np.vstack(vectors) @ queries.T, np.concatenate(norms), queries, space)
+        top = top_k(distances, k)
+        return [[(documents[row], float(distances[row, column])) for row in top[:, column]]
+                for column in range(len(queries))]
+
+    def get_source_vectors(self, source, space):
+        """
+        Chunks and embeddings of one source, kept in a small LRU cache that is dropped when the source changes
+        :return: List of documents, matrix of their embeddings, and their norms
+        """
+        with self.source_cache_lock:
+            if (cached := self.source_cache.get(source)) is not None:
+                self.source_cache.move_to_end(source)
+                return cached
+            generation = self.source_cache_generation
+        result = self.db._collection.get(where={"source": source}, include=["embeddings", "documents", "metadatas"])
+        documents = [Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+                     for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])]
+        if not documents:
+            # Registered without chunks, e.g. when every chunk failed to embed or was linked to a near-duplicate
+            vectors = np.empty((0, 0), dtype=np.float32)
+        else:
+            vectors = np.asarray(result["embeddings"], dtype=np.float32).reshape(len(documents), -1)
+        norms = np.einsum("ij,ij->i", vectors, vectors) if space == "l2" else np.linalg.norm(vectors, axis=1)
+        cached = (documents, vectors, norms)
+        with self.source_cache_lock:
+            if self.source_cache_generation == generation:
+                self.source_cache[source] = cached
+                if len(self.source_cache) > self.source_cache_size:
+                    self.source_cache.popitem(last=False)
+        return cached
+
+    def invalidate_source_cache(self, sources):
+        with self.source_cache_lock:
+            self.source_cache_generation += 1
+            if sources is None:
+                self.source_cache.clear()
+                return
+            for source in sources:
+                self.source_cache.pop(source, None)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=5, filter=None):
+        """
+        Search with a precomputed query embedding, skipping the embedding request entirely
+        :param embedding: Query vector
+        :param k: Number of results
+        :param filter: Chroma metadata filter
+        :return: List of (document, distance)
+        """
+        if self.vector_index is not None:
+            try:
+                return self.vector_index.search(embedding, k=k, filter=filter)
+            except ValueError as e:
+                print(f"Vector index cannot serve this search, using Chroma: {e}")
+        return self.db.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)
+
+    def keyword_search(self, query: str, k=5, filter=None):
+        """
+        BM25 search over the keyword index, without embedding the query
+        :return: List of (document, BM25 score)
+        """
+        return self.keyword_index.search(query, k=k, filter=filter)
 
-    def similarity_search_with_score(self, query: str, k=5):
-        return self.db.similarity_search_with_score(query, k=k)
+    def hybrid_search(self, query: str, k=5, filter=None, fetch_k=None, sources=None):
+        """
+        Run keyword and vector search concurrently and fuse both rankings with reciprocal rank fusion
+        :param query: Query text
+        :param k: Number of results
+        :param filter: Chroma metadata filter
+        :param fetch_k: Number of candidates taken from each ranking
+        :param sources: Registered sources to restrict the vector search to
+        :return: List of (document, fused score)
+        """
+        fetch_k = fetch_k or max(4 * k, 20)
+        keyword = self.search_executor.submit(self.keyword_search, query, fetch_k, filter)
+        vector = self.search_executor.submit(self.similarity_search_with_score, query, fetch_k, filter, sources)
+        return reciprocal_rank_fusion([vector.result(), keyword.result()], k=k, rank_constant=self.rrf_k)
+
+    def resolve_scope(self, doc_ids):
+        """
+        Resolve the documents a search is restricted to. References the registry does not know, such as
+        files ingested before it, are matched on the source metadata as given and, for bare file names,
+        under the legacy upload directories.
+        :param doc_ids: Registry doc IDs, source paths or file names
+        :return: Dict of source to chunk count when every reference is registered, else None; and the
+            metadata filter covering every reference
+        """
+        sources, legacy = {}, []
+        for ref in doc_ids:
+            if resolved := self.manifest.resolve_documents([ref]):
+                sources.update(resolved)
+                continue
+            legacy.append(ref)
+            if os.path.basename(ref) == ref:
+                legacy.extend(os.path.join(directory, ref) for directory in self.legacy_source_dirs)
+        if not legacy:
+            return sources, source_filter(sources)
+        return None, source_filter(list(dict.fromkeys([*sources, *legacy])))
+
+    def search(self, query: str, k=5, filter=None, doc_ids=None):
+        """
+        Retrieve context with the configured retrieval mode
+        :param query: Query text
+        :param k: Number of results
+        :param filter: Chroma metadata filter
+        :param doc_ids: Registry doc IDs to restrict the search to, which replaces filter
+        :return: List of (document, score), best first. The score is a distance in vector mode and a
+            BM25 or fused score otherwise, so only compare scores within one retrieval mode
+        """
+        sources = None
+        if doc_ids:
+            sources, filter = self.resolve_scope(doc_ids)
+        if self.retrieval_mode == "keyword":
+            return self.keyword_search(query, k=k, filter=filter)
+        if self.retrieval_mode == "hybrid":
+            return self.hybrid_search(query, k=k, filter=filter, sources=sources)
+        return self.similarity_search_with_score(query, k=k, filter=filter, sources=sources)
+
+    def similarity_search_by_vectors_with_score(self, embeddings, k=5, filter=None, sources=None):
+        """
+        Vector search for many precomputed query embeddings in one multi-query search
+        :return: List with the (document, distance) results of each query
+        """
+        if self.vector_index is not None:
+            try:
+                return self.vector_index.search_batch(embeddings, k=k, filter=filter)
+            except ValueError as e:
+                print(f"Vector index cannot serve this search, using Chroma: {e}")
+        if sources is not None:
+            selected = sum(count or 0 for count in sources.values())
+            if selected / (self.manifest.count_chunks() or 1) < self.postfilter_selectivity:
+                return self.prefiltered_search_batch(embeddings, sources, k=k)
+        results = self.db._collection.query(query_embeddings=[list(embedding) for embedding in embeddings],
+                                            n_results=k, where=filter or None,
+                                            include=["documents", "metadatas", "distances"])
+        return [[(Document(page_content=text, metadata=metadata or {}, id=chunk_id), distance)
+                 for chunk_id, text, metadata, distance in zip(*columns)]
+                for columns in zip(results["ids"], results["documents"], results["metadatas"], results["distances"])]
+
+    def batch_search(self, queries, k=5, filter=None, doc_ids=None, batch_size=256):
+        """
+        Retrieve context for many queries: each batch is embedded in one request and searched with one
+        multi-query search, keyword searches for the batch run alongside on the search executor
+        :param queries: List of query texts
+        :param k: Number of results per query
+        :param filter: Chroma metadata filter
+        :param doc_ids: Registry doc IDs to restrict the search to, which replaces filter
+        :param batch_size: Queries embedded and searched together
+        :return: List with the (document, score) results of each query, scored as in search
+        """
+        sources = None
+        if doc_ids:
+            sources, filter = self.resolve_scope(doc_ids)
+        if self.retrieval_mode == "keyword":
+            return [self.keyword_search(query, k=k, filter=filter) for query in queries]
+
+        results = []
+        fetch_k = max(4 * k, 20) if self.retrieval_mode == "hybrid" else k
+        for i in range(0, len(queries), batch_size):
+            batch = queries[i:i + batch_size]
+            keyword = None
+            if self.retrieval_mode == "hybrid":
+                keyword = self.search_executor.submit(
+                    lambda batch: [self.keyword_search(query, k=fetch_k, filter=filter) for query in batch], batch)
+            vector = self.similarity_search_by_vectors_with_score(self.embed_queries(batch), k=fetch_k,
+                                                                  filter=filter, sources=sources)
+            if keyword is None:
+                results.extend(vector)
+                continue
+            results.extend(reciprocal_rank_fusion([vector_results, keyword_results], k=k, rank_constant=self.rrf_k)
+                           for vector_results, keyword_results in zip(vector, keyword.result()))
+        return results
+
+    async def abatch_search(self, queries, k=5, filter=None, doc_ids=None, batch_size=256):
+        """
+        Async variant of batch_search, running the batches concurrently in the default executor
+        """
+        loop = asyncio.get_running_loop()
+        batches = await asyncio.gather(*[
+            loop.run_in_executor(None, self.batch_search, queries[i:i + batch_size], k, filter, doc_ids, batch_size)
+            for i in range(0, len(queries), batch_size)])
+        return [results for batch in batches for results in batch]
+
+    def vector_index_report(self, queries, k=5, batch_size=5000):
+        """
+        Measure what the vector index precision costs: memory saved against float32 and recall@k of
+        its results, with and without rescoring, against exact float32 search over Chroma's embeddings
+        :param queries: List of sample query texts
+        :param k: Number of results per query
+        :return: Dict of index stats plus recall_at_k and recall_at_k_without_rescoring
+        """
+        embeddings = np.asarray(self.embed_queries(queries), dtype=np.float32)
+        space = (self.db._collection.metadata or {}).get("hnsw:space", "l2")
+        best_ids = np.empty((0, len(queries)), dtype=object)
+        best_distances = np.empty((0, len(queries)), dtype=np.float32)
+        # Exact top-k, streaming the stored embeddings page by page
+        offset = 0
+        while True:
+            page = self.db._collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            norms = np.einsum("ij,ij->i", vectors, vectors) if space == "l2" else np.linalg.norm(vectors, axis=1)
+            distances = np.vstack([best_distances, to_distances(vectors @ embeddings.T, norms, embeddings, space)])
+            ids = np.vstack([best_ids, np.repeat(np.array(page["ids"], dtype=object)[:, None], len(queries), axis=1)])
+            top = top_k(distances, k)
+            best_ids = np.take_along_axis(ids, top, axis=0)
+            best_distances = np.take_along_axis(distances, top, axis=0)
+
+        report = self.vector_index.stats()
+        for key, rescore in (("recall_at_k", True), ("recall_at_k_without_rescoring", False)):
+            results = self.vector_index.search_batch(embeddings, k=k, rescore=rescore)
+            hits = sum(len({doc.id for doc, _ in found} & set(best_ids[:, column]))
+                       for column, found in enumerate(results))
+            report[key] = hits / max(best_ids.size, 1)
+        return report
+
+    def list_documents(self):
+        return self.manifest.get_documents()
 
     def get_collection_name(self):
         return self.collection_name
 
     def delete(self, doc_id):
         self.db.delete(doc_id)
+        ids = [doc_id] if isinstance(doc_id, str) else doc_id
+        if self.vector_index is not None:
+            self.vector_index.delete(ids)
+        if self.keyword_index is not None:
+            self.keyword_index.delete(ids)
+        # chunk IDs are source:page:index
+        self.notify({chunk_id.rsplit(":", 2)[0] for chunk_id in ids})
+
+    def delete_by_source(self, sources):
+        """
+        Delete every chunk of the given sources through the metadata index
+        :param sources: List of source paths
+        """
+        if not sources:
+            return
+        where = source_filter(sources)
+        self.db._collection.delete(where=where)
+        if self.vector_index is not None:
+            self.vector_index.delete_where(where)
+        if self.keyword_index is not None:
+            self.keyword_index.delete_sources(sources)
+        self.notify(set(sources))
 
     def get(self):
         return self.db.get(include=None)
 
+    def get_existing_ids(self, ids, batch_size=500):
+        """
+        Check which of the given IDs are in the collection without reading the whole collection
+        :param ids: List of chunk IDs
+        :return: Set of the IDs that exist
+        """
+        existing = set()
+        for i in range(0, len(ids), batch_size):
+            existing.update(self.db.get(ids=ids[i:i + batch_size], include=[])["ids"])
+        return existing
+
+    def get_embeddings(self, ids):
+        """
+        Fetch stored embeddings without re-embedding
+        :param ids: List of chunk IDs
+        :return: Dict of chunk ID to embedding
+        """
+        result = self.db.get(ids=ids, include=["embeddings"])
+        return dict(zip(result["ids"], result["embeddings"]))
+
     def add_documents(self, new_chunks, ids):
-        self.db.add_documents(new_chunks, ids=ids)
\ No newline at end of file
+        """
+        Embed and upsert chunks batch by batch through the embedding pipeline
+        :return: List of IDs that could not be embedded
+        """
+        return self.embedding_pipeline.run(new_chunks, ids, self.add_embeddings)
+
+    def add_embeddings(self, new_chunks, ids, embeddings):
+        if not ids:
+            return
+        self.db._collection.upsert(ids=ids,
+                                   embeddings=embeddings,
+                                   documents=[chunk.page_content for chunk in new_chunks],
+                                   metadatas=[chunk.metadata for chunk in new_chunks])
+        if self.vector_index is not None:
+            self.vector_index.upsert(ids, embeddings, [chunk.page_content for chunk in new_chunks],
+                                     [chunk.metadata for chunk in new_chunks])
+        if self.keyword_index is not None:
+            self.keyword_index.upsert(ids, [chunk.page_content for chunk in new_chunks],
+                                      [chunk.metadata for chunk in new_chunks])
+        self.notify({chunk.metadata.get("source") for chunk in new_chunks})
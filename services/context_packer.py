@@ -0,0 +1,140 @@
+import re
+
+_PIECE = re.compile(r"\w+|[^\w\s]")
+
+
+class TokenCounter:
+    """
+    Counts tokens with a local tiktoken encoding, falling back to a word-piece estimate when the
+    encoding files are not available offline
+    """
+
+    def __init__(self, encoding="cl100k_base"):
+        self.encoding = None
+        try:
+            import tiktoken
+            self.encoding = tiktoken.get_encoding(encoding)
+        except Exception as e:
+            print(f"Tokenizer {encoding} unavailable, estimating token counts: {e}")
+
+    def count(self, text: str):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return max(len(_PIECE.findall(text)), len(text) // 4)
+
+    def truncate(self, text: str, max_tokens):
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        count = self.count(text)
+        return text if count <= max_tokens else text[:len(text) * max_tokens // count]
+
+
+class ContextPacker:
+    """
+    Fits retrieved chunks, chat history and the question into the model's context window. Context and
+    history get separate token budgets, overlapping chunks of the same page are merged, and the lowest
+    ranked material is dropped first.
+    """
+
+    def __init__(self, num_ctx=4096, response_tokens=1024, context_share=0.75, min_block_tokens=48,
+                 separator="\n\n---\n\n", counter: TokenCounter = None):
+        self.num_ctx = num_ctx
+        self.response_tokens = response_tokens
+        self.context_share = context_share
+        self.min_block_tokens = min_block_tokens
+        self.separator = separator
+        self.counter = counter or TokenCounter()
+
+    def merge_chunks(self, context):
+        """
+        Join chunks of the same page whose spans overlap or touch into one block
+        :param context: List of (document, score), best first
+        :return: List of block texts, best first
+        """
+        groups = {}
+        for rank, (doc, _score) in enumerate(context):
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            if doc.metadata.get("start_index") is None:
+                key = (key, rank)
+            groups.setdefault(key, []).append((rank, doc))
+
+        blocks = []
+        for members in groups.values():
+            members.sort(key=lambda member: member[1].metadata.get("start_index") or 0)
+            rank, doc = members[0]
+            text, start = doc.page_content, doc.metadata.get("start_index") or 0
+            for next_rank, next_doc in members[1:]:
+                next_start = next_doc.metadata["start_index"]
+                end = start + len(text)
+                if next_start <= end:
+                    text += next_doc.page_content[end - next_start:]
+                    rank = min(rank, next_rank)
+                    continue
+                blocks.append((rank, text))
+                rank, text, start = next_rank, next_doc.page_content, next_start
+            blocks.append((rank, text))
+        return [text for _rank, text in sorted(blocks, key=lambda block: block[0])]
+
+    def pack_context(self, context, budget):
+        """
+        :return: Context text of at most budget tokens, and its token count
+        """
+        parts, used = [], 0
+        separator_tokens = self.counter.count(self.separator)
+        for block in self.merge_chunks(context):
+            cost = self.counter.count(block) + (separator_tokens if parts else 0)
+            if used + cost <= budget:
+                parts.append(block)
+                used += cost
+                continue
+            # Keep the head of the first block that does not fit, then drop the rest
+            remaining = budget - used - (separator_tokens if parts else 0)
+            if remaining >= self.min_block_tokens:
+                block = self.counter.truncate(block, remaining)
+                used += self.counter.count(block) + (separator_tokens if parts else 0)
+                parts.append(block)
+            break
+        return self.separator.join(parts), used
+
+    def pack_history(self, history, budget, max_messages):
+        """
+        :return: The most recent messages that fit in budget tokens, oldest first, and their token count
+        """
+        kept, used = [], 0
+        for message in reversed(history[-max_messages:] if max_messages > 0 else []):
+            cost = self.counter.count(message.get("content") or "") + 4
+            if used + cost > budget:
+                break
+            kept.append(message)
+            used += cost
+        return kept[::-1], used
+
+    def pack(self, prompt_template, question, context=None, history=None, max_history_messages=9):
+        """
+        :param prompt_template: Template with {context} and {question} fields, or None to send the
+            question without context
+        :param question: User question
+        :param context: List of (document, score), best first
+        :param history: Chat history
+        :param max_history_messages: Upper bound on history messages regardless of tokens
+        :return: Dict with the prompt, the packed history and the token counts
+        """
+        available = self.num_ctx - self.response_tokens
+        base = prompt_template.format(context="", question="") if prompt_template else ""
+        question_budget = max(available // 2 - self.counter.count(base), 0)
+        if self.counter.count(question) > question_budget:
+            question = self.counter.truncate(question, question_budget)
+        available -= self.counter.count(base) + self.counter.count(question)
+
+        context_text, context_tokens = "", 0
+        if prompt_template:
+            context_text, context_tokens = self.pack_context(context or [], int(available * self.context_share))
+        # History gets its own share plus whatever the context left unused
+        messages, history_tokens = self.pack_history(history or [], available - context_tokens, max_history_messages)
+        prompt = prompt_template.format(context=context_text, question=question) if prompt_template else question
+        return {"prompt": prompt, "history": messages,
+                "tokens": {"prompt": self.counter.count(prompt), "context": context_tokens,
+                           "history": history_tokens, "budget": self.num_ctx - self.response_tokens}}
@@ -1,7 +1,34 @@
-from langchain_community.document_loaders import PyPDFDirectoryLoader, PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import os
+import concurrent.futures
+import multiprocessing
+import signal
+import time
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from langchain_community.document_loaders import PyPDFDirectoryLoader
 from langchain.schema.document import Document
 from services.chroma_db import Database
+from services.ingest_manifest import hash_file, hash_text
+from services.ingest_pipeline import run_stage
+from services.text_extractor import TextExtractor, parse_pages
+from services.text_splitter import OffsetTextSplitter
+
+_started = None
+
+
+def _init_worker(started):
+    global _started
+    _started = started
+
+
+def _parse_task(key, file_path):
+    """
+    Parse a file in a worker process, first reporting which process picked it up and when, so the
+    parent can time it from its actual start
+    """
+    _started.put((key, os.getpid(), time.monotonic()))
+    return parse_pages(file_path)
 
 
 class DocumentLoader:
@@ -9,49 +36,309 @@ class DocumentLoader:
     DocumentLoader class to load and split documents for use in RAG application
     """
 
-    def __init__(self, db: Database, collection_name="documents", data_path="data/pdfs"):
+    def __init__(self, db: Database, collection_name="documents", data_path="data/pdfs",
+                 load_workers=1, load_timeout=300, queue_size=2, extractor: TextExtractor = None):
         self.data_path = data_path
         self.loader = PyPDFDirectoryLoader(self.data_path)
         self.db = db
         self.collection_name = collection_name
+        self.load_workers = load_workers
+        self.load_timeout = load_timeout
+        self.queue_size = queue_size
+        self.extractor = extractor or TextExtractor()
+        self.text_splitter = OffsetTextSplitter(chunk_size=800, chunk_overlap=80)
 
-    def load_documents(self, file_paths=None):
+    def load_documents(self, file_paths=None, workers=None):
+        """
+        Load the pages of the given PDFs, or of every PDF in the data directory
+        :param file_paths: List of file paths
+        :param workers: Number of worker processes, defaults to load_workers
+        :return: List of pages, in the order of file_paths
+        """
         if file_paths:
-            documents = []
-            for file_path in file_paths:
-                full_path = f"{file_path}"
-                loader = PyPDFLoader(full_path)
-                documents.extend(loader.load())
-            return documents
+            return [page for _, pages in self.iter_documents(file_paths, workers) for page in pages]
         else:
             return self.loader.load()
 
+    def iter_documents(self, file_paths, workers=None, file_hashes=None):
+        """
+        Load PDFs one file at a time through the extractor, so files that were parsed before are
+        read from its cache. Files that fail to parse are skipped.
+        :param file_paths: List of file paths
+        :param workers: Number of worker processes, defaults to load_workers
+        :param file_hashes: Dict of file path to content hash, hashed from disk when missing
+        :return: Generator of (file path, pages), in the order of file_paths
+        """
+        workers = workers or self.load_workers
+        file_hashes = file_hashes or {}
+        if workers > 1 and len(file_paths) > 1:
+            yield from self.iter_documents_parallel(file_paths, workers, file_hashes)
+            return
+        for file_path in file_paths:
+            try:
+                pages = self.extractor.extract(file_path, file_hashes.get(file_path))
+            except Exception as e:
+                print(f"Error loading {file_path}: {e}")
+                continue
+            yield file_path, self.extractor.to_documents(file_path, pages)
+
+    def iter_documents_parallel(self, file_paths, workers, file_hashes=None):
+        """
+        Parse PDFs in a process pool, keeping at most two files per worker in flight. Files are
+        yielded in the order of file_paths and files that fail or run longer than load_timeout are
+        skipped instead of stalling the batch. The timeout counts from when a worker picks the file
+        up, not from when it was queued. When a worker dies, the files that were parsing in its pool
+        are suspects: they are parsed again one at a time, so only the file that crashes on its own
+        is given up on.
+        :param file_paths: List of file paths
+        :param workers: Number of worker processes
+        :param file_hashes: Dict of file path to content hash, hashed from disk when missing
+        :return: Generator of (file path, pages)
+        """
+        file_hashes = file_hashes or {}
+        workers = min(workers, len(file_paths))
+        started = multiprocessing.SimpleQueue()
+        starts = {}
+        pending = deque()
+        remaining = iter(enumerate(file_paths))
+
+        def new_executor(max_workers):
+            return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                          initargs=(started,))
+
+        executor = new_executor(workers)
+        # one-worker pool for suspects, created when a pool first breaks
+        isolated = None
+
+        def pool_of(task):
+            return isolated if task["suspect"] else executor
+
+        def dispatch(task):
+            nonlocal isolated
+            if task["suspect"] and isolated is None:
+                isolated = new_executor(1)
+            task["attempt"] += 1
+            task["executor"] = pool_of(task)
+            try:
+                task["future"] = task["executor"].submit(_parse_task, (task["index"], task["attempt"]),
+                                                         task["file_path"])
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # a worker died since the last submit, the pool is replaced when this result is collected
+                task["future"] = concurrent.futures.Future()
+                task["future"].set_exception(e)
+
+        def submit(index, file_path):
+            file_hash = file_hashes.get(file_path) or (hash_file(file_path) if self.extractor.cache_dir else None)
+            cached = self.extractor.load(file_hash)
+            task = {"index": index, "file_path": file_path, "file_hash": file_hash, "pages": cached,
+                    "future": None, "executor": None, "attempt": 0, "suspect": False, "crashed": False,
+                    "timed_out": False}
+            if cached is None:
+                dispatch(task)
+            pending.append(task)
+
+        def deadline(task):
+            while not started.empty():
+                key, pid, at = started.get()
+                starts[key] = (pid, at + self.load_timeout)
+            return starts.get((task["index"], task["attempt"]))
+
+        def broken(task):
+            future = task["future"]
+            if not future.done():
+                return task["executor"] is not pool_of(task)
+            return future.cancelled() or isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool)
+
+        def replace(pool):
+            # Files that were queued or parsing in the broken pool move to a new one
+            nonlocal executor, isolated
+            pool.shutdown(wait=False, cancel_futures=True)
+            if pool is executor:
+                executor = new_executor(workers)
+            else:
+                isolated = None
+            for task in pending:
+                if (task["executor"] is pool and not task["timed_out"] and not task["crashed"]
+                        and broken(task)):
+                    dispatch(task)
+
+        def kill(tasks):
+            # A hung parse never returns, so its worker is killed, which breaks the pool
+            for task in tasks:
+                task["timed_out"] = True
+                try:
+                    os.kill(deadline(task)[0], signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        def wait(task):
+            while not task["future"].done():
+                if (started_task := deadline(task)) is None:
+                    # still queued behind other files
+                    concurrent.futures.wait([task["future"]], timeout=0.1)
+                elif (timeout := started_task[1] - time.monotonic()) > 0:
+                    concurrent.futures.wait([task["future"]], timeout=timeout)
+                else:
+                    now = time.monotonic()
+                    expired = [task] + [other for other in pending if other["future"] is not None
+                                        and not other["future"].done()
+                                        and (other_task := deadline(other)) is not None and other_task[1] <= now]
+                    kill(expired)
+                    for pool in {id(other["executor"]): other["executor"] for other in expired}.values():
+                        if pool in (executor, isolated):
+                            replace(pool)
+                    return False
+            return True
+
+        try:
+            for index, file_path in islice(remaining, workers * 2):
+                submit(index, file_path)
+            # Collect in submission order; files later in the list keep parsing while we wait
+            while pending:
+                task = pending.popleft()
+                for index, next_path in islice(remaining, 1):
+                    submit(index, next_path)
+                file_path, pages = task["file_path"], task["pages"]
+                if task["future"] is not None:
+                    if task["timed_out"] or not wait(task):
+                        print(f"Timed out loading {file_path}")
+                        continue
+                    try:
+                        pages = task["future"].result()
+                    except concurrent.futures.process.BrokenProcessPool as e:
+                        # a worker died: files that were parsing beside it become suspects and are
+                        # parsed again one at a time, a file that breaks the one-worker pool crashed
+                        # on its own
+                        pool = task["executor"]
+                        if pool in (executor, isolated):
+                            for other in [task, *pending]:
+                                if (other["executor"] is pool and not other["timed_out"]
+                                        and deadline(other) is not None and broken(other)):
+                                    if pool is isolated:
+                                        other["crashed"] = True
+                                    else:
+                                        other["suspect"] = True
+                        if task["crashed"]:
+                            print(f"Error loading {file_path}: {e}")
+                        else:
+                            pending.appendleft(task)
+                        if pool in (executor, isolated):
+                            replace(pool)
+                        elif not task["crashed"]:
+                            dispatch(task)
+                        continue
+                    except Exception as e:
+                        print(f"Error loading {file_path}: {e}")
+                        continue
+                    self.extractor.save(task["file_hash"], pages)
+                yield file_path, self.extractor.to_documents(file_path, pages)
+        finally:
+            # when the caller stops early, files still parsing are abandoned
+            kill([task for task in pending if task["future"] is not None and not task["future"].done()
+                  and task["executor"] in (executor, isolated) and deadline(task) is not None])
+            executor.shutdown(wait=not pending, cancel_futures=True)
+            if isolated is not None:
+                isolated.shutdown(wait=not pending, cancel_futures=True)
+            started.close()
+
     def split_documents(self, documents: list[Document]):
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=80,
-            length_function=len,
-            is_separator_regex=False,
-        )
-        return text_splitter.split_documents(documents)
-
-    def add_to_chroma(self, chunks: list[Document]):
+        return self.text_splitter.split_documents(documents)
+
+    def add_to_chroma(self, chunks: list[Document], file_hashes=None):
+        """
+        Bring the collection in line with the given chunks, one source at a time: embed new or
+        changed chunks and delete the ones that disappeared, as recorded in the ingest manifest.
+        Text that is already embedded under another ID (e.g. a renamed file) reuses its embedding.
+        :param chunks: List of chunks
+        :param file_hashes: Dict of source to file hash, hashed from disk when missing
+        """
+        file_hashes = file_hashes or {}
+        manifest = self.db.manifest
         chunks_with_ids = self.calculate_chunk_ids(chunks)
 
-        existing_items = self.db.get()
-        existing_ids = set(existing_items["ids"])
-        print(f'Existing items: {len(existing_ids)}')
-
-        if new_chunks := [
-            chunk
-            for chunk in chunks_with_ids
-            if chunk.metadata["id"] not in existing_ids
-        ]:
-            new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
-            self.db.add_documents(new_chunks, ids=new_chunk_ids)
-        else:
+        chunks_by_source = {}
+        for chunk in chunks_with_ids:
+            chunks_by_source.setdefault(chunk.metadata.get("source"), []).append(chunk)
+
+        embedded, reused, deleted, skipped = 0, 0, 0, 0
+        for source, source_chunks in chunks_by_source.items():
+            text_hashes = {chunk.metadata["id"]: hash_text(chunk.page_content) for chunk in source_chunks}
+            recorded = manifest.get_chunks(source)
+            # chunks embedded before the manifest existed are kept as they are
+            unrecorded = [chunk_id for chunk_id in text_hashes if chunk_id not in recorded]
+            existing_ids = self.db.get_existing_ids(unrecorded) if unrecorded else set()
+
+            new_chunks = [
+                chunk
+                for chunk in source_chunks
+                if recorded.get(chunk.metadata["id"]) != text_hashes[chunk.metadata["id"]]
+                and chunk.metadata["id"] not in existing_ids
+            ]
+
+            stale_ids = [chunk_id for chunk_id in recorded if chunk_id not in text_hashes]
+            linked = {}
+            if self.db.near_duplicates is not None and (new_chunks or stale_ids):
+                changed = {chunk.metadata["id"] for chunk in new_chunks}
+                # links stay within a source, so links to chunks that change or disappear are matched
+                # again along with the changed chunks
+                relinked = self.db.near_duplicates.remove_ids([*changed, *stale_ids])
+                new_chunks = [chunk for chunk in source_chunks
+                              if chunk.metadata["id"] in changed or chunk.metadata["id"] in relinked]
+                new_chunks, linked, _ = self.db.near_duplicates.filter(new_chunks, source)
+                # a chunk that became a link no longer keeps its own entry
+                if replaced := [chunk_id for chunk_id in linked if chunk_id in recorded]:
+                    self.db.delete(replaced)
+
+            known = manifest.find_text_hashes(text_hashes[chunk.metadata["id"]] for chunk in new_chunks)
+            embeddings = self.db.get_embeddings(list(set(known.values()))) if known else {}
+            reusable, to_embed = [], []
+            for chunk in new_chunks:
+                if known.get(text_hashes[chunk.metadata["id"]]) in embeddings:
+                    reusable.append(chunk)
+                else:
+                    to_embed.append(chunk)
+
+            if reusable:
+                self.db.add_embeddings(reusable,
+                                       ids=[chunk.metadata["id"] for chunk in reusable],
+                                       embeddings=[embeddings[known[text_hashes[chunk.metadata["id"]]]]
+                                                   for chunk in reusable])
+            failed_ids = []
+            if to_embed:
+                failed_ids = self.db.add_documents(to_embed, ids=[chunk.metadata["id"] for chunk in to_embed])
+            # a changed chunk that failed to embed would otherwise keep its old text in the collection,
+            # where the existing-ID check of the next ingest would take it as up to date
+            if stale_ids or failed_ids:
+                self.db.delete(stale_ids + failed_ids)
+
+            file_hash = file_hashes.get(source) or (hash_file(source) if os.path.isfile(source) else "")
+            failed = set(failed_ids)
+            if failed_ids:
+                # leave the failed chunks, and the links to them, unrecorded so the next ingest of this
+                # file picks them up
+                print(f'Failed to embed {len(failed_ids)} chunks of {source}')
+                if self.db.near_duplicates is not None:
+                    failed.update(self.db.near_duplicates.remove_ids(failed_ids))
+                text_hashes = {chunk_id: text_hash for chunk_id, text_hash in text_hashes.items()
+                               if chunk_id not in failed}
+                file_hash = ""
+            stored = text_hashes.keys()
+            if self.db.near_duplicates is not None:
+                stored -= self.db.near_duplicates.linked_ids(source)
+            manifest.update_source(source, file_hash, text_hashes, chunk_count=len(stored))
+            embedded += len(to_embed) - len(failed_ids)
+            skipped += len(linked.keys() - failed)
+            reused += len(reusable)
+            deleted += len(stale_ids)
+
+        if not embedded and not reused and not deleted and not skipped:
             print("No new chunks to add")
-        print(f'New items: {len(new_chunks)}')
+        print(f'New items: {embedded}, reused embeddings: {reused}, deleted items: {deleted}, '
+              f'near-duplicates skipped: {skipped}')
+        if self.db.near_duplicates is not None:
+            stats = self.db.near_duplicates.stats()
+            print(f"Near-duplicates linked instead of embedded: {stats['embeddings_saved']} embeddings, "
+                  f"{stats['bytes_saved'] / 2 ** 20:.1f} MB saved")
 
     def calculate_chunk_ids(self, chunks: list[Document]):
         last_page_id = None
@@ -73,18 +360,86 @@ class DocumentLoader:
             chunk.metadata["id"] = chunk_id
         return chunks
 
-    def delete_document(self, docs_to_delete):
-        docs_to_delete = [docs_to_delete]
-        all_docs = self.get_documents()["ids"]
-        target_docs = [target for target in all_docs for doc in docs_to_delete if doc in target]
-        if target_docs:
-            self.db.delete(target_docs)
+    def delete_document(self, doc):
+        self.delete_documents([doc])
+
+    def delete_documents(self, docs):
+        """
+        Delete documents and all of their chunks in one pass
+        :param docs: List of file names or source paths
+        """
+        names = set(docs)
+        sources = {source for source in self.db.manifest.get_sources()
+                   if source in names or os.path.basename(source) in names}
+        # documents ingested before the manifest existed are matched by their path in the data directory
+        sources.update(os.path.join(self.data_path, doc) for doc in docs if os.path.basename(doc) == doc)
+        sources = sorted(sources)
+        self.db.delete_by_source(sources)
+        self.db.manifest.remove_sources(sources)
+        if self.db.near_duplicates is not None:
+            self.db.near_duplicates.remove_sources(sources)
 
     def get_documents(self):
         collection = self.db.get()
         return collection
 
-    def ingest(self, file_path):
-        documents = self.load_documents(file_path)
-        chunks = self.split_documents(documents)
-        self.add_to_chroma(chunks)
\ No newline at end of file
+    def list_documents(self):
+        return sorted(str(path) for path in Path(self.data_path).rglob("*.pdf") if not path.name.startswith("."))
+
+    def ingest(self, file_paths=None, progress=None):
+        """
+        Ingest files, skipping those whose content has not changed since they were last ingested.
+        Files stream through load, split and embed stages connected by bounded queues, so memory
+        stays flat with the batch size and each file is searchable as soon as it is written.
+        Without file_paths the data directory is synced, including removal of deleted files.
+        :param file_paths: List of file paths
+        :param progress: Called as progress(file_path, stage) as a file enters the parse, chunk and
+        embed stages, and with "done" once it is written
+        """
+        progress = progress or (lambda file_path, stage: None)
+        sync = not file_paths
+        if sync:
+            file_paths = self.list_documents()
+
+        file_hashes = {file_path: hash_file(file_path) for file_path in file_paths}
+        changed = [file_path for file_path in file_paths
+                   if self.db.manifest.get_file_hash(file_path) != file_hashes[file_path]]
+        print(f'Unchanged files: {len(file_paths) - len(changed)}')
+        for file_path in file_paths:
+            progress(file_path, "parse" if file_path in changed else "done")
+
+        if changed:
+            def parsed(item):
+                progress(item[0], "chunk")
+                return item
+
+            def split(item):
+                chunks = self.split_documents(item[1])
+                progress(item[0], "embed")
+                return item[0], chunks
+
+            # parsing runs on its own thread, ahead of splitting by at most queue_size files
+            loaded = run_stage(self.iter_documents(changed, file_hashes=file_hashes), parsed,
+                               maxsize=self.queue_size)
+            for file_path, chunks in run_stage(loaded, split, maxsize=self.queue_size):
+                self.add_to_chroma(chunks, file_hashes)
+                progress(file_path, "done")
+                print(f'Ingested {file_path}')
+
+        if sync:
+            self.remove_missing_sources(file_paths)
+
+    def remove_missing_sources(self, file_paths):
+        """
+        Delete the chunks of every recorded source that is not in file_paths
+        :param file_paths: List of file paths that should remain
+        """
+        keep = set(file_paths)
+        if missing := [source for source in self.db.manifest.get_sources() if source not in keep]:
+            ids = [chunk_id for source in missing for chunk_id in self.db.manifest.get_chunks(source)]
+            if ids:
+                self.db.delete(ids)
+            self.db.manifest.remove_sources(missing)
+            if self.db.near_duplicates is not None:
+                self.db.near_duplicates.remove_sources(missing)
+            print(f'Removed sources: {missing}')
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .ingest_manifest import hash_text
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache keyed by (model, text hash), evicting least recently used
+    entries once the stored vectors exceed max_bytes
+    """
+
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                              "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                              "size INTEGER NOT NULL, last_used REAL NOT NULL, "
+                              "PRIMARY KEY (model, text_hash)) WITHOUT ROWID")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, texts):
+        """
+        :param model: Embedding model name
+        :param texts: List of texts
+        :return: List with the cached vector of each text, or None where it is not cached
+        """
+        hashes = [hash_text(text) for text in texts]
+        found = {}
+        with self.lock:
+            unique = list(set(hashes))
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})", [model, *batch])
+                found.update(rows.fetchall())
+            if found:
+                with self.conn:
+                    now = time.time()
+                    self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                          [(now, model, text_hash) for text_hash in found])
+            vectors = [np.frombuffer(found[text_hash], dtype=np.float32) if text_hash in found else None
+                       for text_hash in hashes]
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, model, texts, vectors):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((model, hash_text(text), blob, len(blob), now))
+        with self.lock:
+            with self.conn:
+                for row in rows:
+                    previous = self.conn.execute("SELECT size FROM embeddings WHERE model = ? AND text_hash = ?",
+                                                 row[:2]).fetchone()
+                    self.conn.execute("INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_used) "
+                                      "VALUES (?, ?, ?, ?, ?)", row)
+                    self.size += row[3] - (previous[0] if previous else 0)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Trim to 90% of the limit so eviction does not run on every insert
+        target = self.max_bytes * 0.9
+        with self.conn:
+            while self.size > target:
+                rows = self.conn.execute("SELECT model, text_hash, size FROM embeddings "
+                                         "ORDER BY last_used LIMIT 1000").fetchall()
+                if not rows:
+                    break
+                evicted = []
+                for model, text_hash, size in rows:
+                    if self.size <= target:
+                        break
+                    evicted.append((model, text_hash))
+                    self.size -= size
+                self.conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", evicted)
+                self.evictions += len(evicted)
+
+    def embed(self, model, texts, embed):
+        """
+        Return embeddings for texts, calling embed only for the ones that are not cached
+        :param model: Embedding model name
+        :param texts: List of texts
+        :param embed: Function embedding a list of texts
+        :return: List of vectors
+        """
+        vectors = self.get_many(model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = embed([texts[i] for i in missing])
+            self.put_many(model, [texts[i] for i in missing], embedded)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+        return vectors
+
+    async def aembed(self, model, texts, embed):
+        """
+        Async variant of embed, for an embed coroutine function such as LightRAG's ollama_embed. The sqlite
+        reads, writes and evictions run in a thread, off the event loop.
+        :return: Array of vectors
+        """
+        vectors = await asyncio.to_thread(self.get_many, model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = await embed([texts[i] for i in missing])
+            await asyncio.to_thread(self.put_many, model, [texts[i] for i in missing], embedded)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+        return np.array(vectors)
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": entries, "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain embeddings wrapper that serves repeated texts from an EmbeddingCache
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [vector.tolist() for vector in self.cache.embed(self.model, texts, self.embeddings.embed_documents)]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.cache.embed(self.model, [text],
+                                lambda texts: [self.embeddings.embed_query(texts[0])])[0].tolist()
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU cache of query embeddings with a time to live, for repeated chat queries
+    """
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, vector):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def embed(self, query, embed_query):
+        """
+        :param query: Query text
+        :param embed_query: Function embedding a single query, called on a miss
+        :return: Query vector
+        """
+        if (vector := self.get(query)) is None:
+            vector = embed_query(query)
+            self.put(query, vector)
+        return vector
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "expirations": self.expirations,
+                    "size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl}
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Process-wide cache shared by every embedding caller, configured by EMBEDDING_CACHE_PATH
+    and EMBEDDING_CACHE_MAX_MB
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                os.environ.get("EMBEDDING_CACHE_PATH") or "embedding_cache.sqlite3",
+                max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", 1024)) << 20)
+        return _embedding_cache
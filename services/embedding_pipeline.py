@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class EmbeddingPipeline:
+    """
+    Embeds chunks in fixed-size batches with a bounded number of requests in flight.
+    Failed batches are retried on their own and every batch is written as soon as it is embedded.
+    """
+
+    def __init__(self, embedding_function, batch_size=64, max_concurrency=4, max_retries=3, retry_backoff=1.0):
+        self.embedding_function = embedding_function
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    def embed_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embedding_function.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Embedding batch failed ({e}), retrying")
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def run(self, chunks, ids, upsert):
+        """
+        Embed chunks and hand each finished batch to upsert
+        :param chunks: List of chunks
+        :param ids: List of chunk IDs
+        :param upsert: Called as upsert(chunks, ids, embeddings) for every embedded batch
+        :return: List of IDs whose batch failed after all retries
+        """
+        batches = [(chunks[i:i + self.batch_size], ids[i:i + self.batch_size])
+                   for i in range(0, len(chunks), self.batch_size)]
+        failed_ids = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {executor.submit(self.embed_batch, [chunk.page_content for chunk in batch_chunks]):
+                       (batch_chunks, batch_ids)
+                       for batch_chunks, batch_ids in batches}
+            # Writes stay on this thread, in completion order
+            for future in as_completed(futures):
+                batch_chunks, batch_ids = futures[future]
+                try:
+                    upsert(batch_chunks, batch_ids, future.result())
+                except Exception as e:
+                    print(f"Error embedding batch of {len(batch_ids)} chunks: {e}")
+                    failed_ids.extend(batch_ids)
+        return failed_ids
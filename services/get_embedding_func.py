@@ -1,8 +1,11 @@
 from langchain_ollama import OllamaEmbeddings
+from .embedding_cache import CachedEmbeddings, get_embedding_cache
+
+EMBEDDING_MODEL = "nomic-embed-text"
 
 
 def get_embedding_function():
     embeddings = OllamaEmbeddings(
-        model="nomic-embed-text"
+        model=EMBEDDING_MODEL
     )
-    return embeddings
+    return CachedEmbeddings(embeddings, EMBEDDING_MODEL, get_embedding_cache())
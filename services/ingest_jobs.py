@@ -0,0 +1,157 @@
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+STAGES = ["parse", "chunk", "embed", "graph-extract"]
+
+
+class IngestJobQueue:
+    """
+    Persistent background ingestion: jobs are recorded in sqlite, run by worker threads and report
+    per-file progress through the parse, chunk, embed and graph-extract stages.
+    Jobs that were queued or running when the process stopped are picked up again on start.
+    """
+
+    def __init__(self, db_path, document_loader, lightrag, workers=1):
+        self.document_loader = document_loader
+        self.lightrag = lightrag
+        self.workers = workers
+        self.pending = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                              "id TEXT PRIMARY KEY, status TEXT NOT NULL, error TEXT, "
+                              "created REAL NOT NULL, updated REAL NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS job_files ("
+                              "job_id TEXT NOT NULL, position INTEGER NOT NULL, file_path TEXT NOT NULL, "
+                              "stage TEXT NOT NULL, status TEXT NOT NULL, error TEXT, updated REAL NOT NULL, "
+                              "PRIMARY KEY (job_id, file_path))")
+
+    def start(self):
+        with self.lock:
+            unfinished = self.conn.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running') "
+                                           "ORDER BY created").fetchall()
+        for (job_id,) in unfinished:
+            self.pending.put(job_id)
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, file_paths):
+        """
+        Queue files for ingestion
+        :param file_paths: List of file paths
+        :return: Job ID
+        """
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO jobs (id, status, created, updated) VALUES (?, 'queued', ?, ?)",
+                              (job_id, now, now))
+            self.conn.executemany("INSERT INTO job_files (job_id, position, file_path, stage, status, updated) "
+                                  "VALUES (?, ?, ?, 'parse', 'queued', ?)",
+                                  [(job_id, i, file_path, now) for i, file_path in enumerate(file_paths)])
+        self.pending.put(job_id)
+        return job_id
+
+    def work(self):
+        while True:
+            job_id = self.pending.get()
+            try:
+                self.run(job_id)
+            except Exception as e:
+                print(f"Error running ingest job {job_id}: {e}")
+                self.set_job(job_id, "failed", str(e))
+            finally:
+                self.pending.task_done()
+
+    def run(self, job_id):
+        job = self.get_job(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        file_paths = [file["file_path"] for file in job["files"]]
+        self.set_job(job_id, "running")
+
+        # NaiveRAG reports parse -> chunk -> embed -> done for every file it handles
+        reached = {}
+
+        def progress(file_path, stage):
+            reached[file_path] = stage
+            self.set_file(job_id, file_path, stage if stage != "done" else "embed",
+                          "done" if stage == "done" else "running")
+
+        self.document_loader.ingest(file_paths, progress=progress)
+        parsed = [file_path for file_path in file_paths if reached.get(file_path) == "done"]
+        for file_path in file_paths:
+            if file_path not in parsed:
+                self.set_file(job_id, file_path, reached.get(file_path, "parse"), "failed",
+                              "Could not be parsed")
+
+        if parsed:
+            for file_path in parsed:
+                self.set_file(job_id, file_path, "graph-extract", "running")
+            try:
+                errors = self.lightrag.ingest(parsed)
+            except Exception as e:
+                for file_path in parsed:
+                    self.set_file(job_id, file_path, "graph-extract", "failed", str(e))
+                raise
+            for file_path in parsed:
+                error = errors.get(file_path)
+                self.set_file(job_id, file_path, "graph-extract", "failed" if error else "done", error)
+            parsed = [file_path for file_path in parsed if not errors.get(file_path)]
+
+        failed = len(file_paths) - len(parsed)
+        self.set_job(job_id, "failed" if failed else "done", f"{failed} file(s) failed" if failed else None)
+
+    def set_job(self, job_id, status, error=None):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                              (status, error, time.time(), job_id))
+
+    def set_file(self, job_id, file_path, stage, status, error=None):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE job_files SET stage = ?, status = ?, error = ?, updated = ? "
+                              "WHERE job_id = ? AND file_path = ?",
+                              (stage, status, error, time.time(), job_id, file_path))
+
+    def get_job(self, job_id):
+        """
+        :param job_id: Job ID
+        :return: Dict with the job status and the stage and status of every file, or None
+        """
+        with self.lock:
+            job = self.conn.execute("SELECT id, status, error, created, updated FROM jobs WHERE id = ?",
+                                    (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = self.conn.execute("SELECT file_path, stage, status, error FROM job_files "
+                                      "WHERE job_id = ? ORDER BY position", (job_id,)).fetchall()
+        return {
+            "id": job[0], "status": job[1], "error": job[2], "created": job[3], "updated": job[4],
+            "files": [{"file_path": f[0], "stage": f[1], "status": f[2], "error": f[3]} for f in files],
+        }
+
+    def list_jobs(self, limit=10):
+        with self.lock:
+            job_ids = self.conn.execute("SELECT id FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self.get_job(job_id) for (job_id,) in job_ids]
+
+    def format_progress(self, limit=3):
+        """
+        :return: Human readable progress of the most recent jobs
+        """
+        lines = []
+        for job in self.list_jobs(limit):
+            done = sum(file["stage"] == "graph-extract" and file["status"] == "done" for file in job["files"])
+            lines.append(f"Job {job['id'][:8]}: {job['status']} ({done}/{len(job['files'])} files)"
+                         + (f" - {job['error']}" if job["error"] else ""))
+            if job["status"] in ("queued", "running"):
+                for file in job["files"]:
+                    lines.append(f"  {file['file_path']}: {file['stage']} {file['status']}")
+        return "\n".join(lines) or "No ingestion jobs"
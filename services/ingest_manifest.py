@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def hash_file(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_text(text: str):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_id(source: str):
+    """
+    Stable ID of a document, derived from its path so it survives re-ingestion
+    """
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+class IngestManifest:
+    """
+    Persistent record of what has been embedded into the collection: the content hash of every
+    ingested file and the text hash of every chunk it produced. The files table doubles as the
+    document registry, with a stable doc ID, chunk count and ingest time per file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                              "source TEXT PRIMARY KEY, file_hash TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS chunks ("
+                              "id TEXT PRIMARY KEY, source TEXT NOT NULL, text_hash TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_text_hash ON chunks (text_hash)")
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+            for column, kind in (("doc_id", "TEXT"), ("chunk_count", "INTEGER"), ("ingested_at", "REAL")):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE files ADD COLUMN {column} {kind}")
+            for source, in self.conn.execute("SELECT source FROM files WHERE doc_id IS NULL").fetchall():
+                self.conn.execute("UPDATE files SET doc_id = ?, chunk_count = "
+                                  "(SELECT COUNT(*) FROM chunks WHERE source = ?) WHERE source = ?",
+                                  (document_id(source), source, source))
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS files_doc_id ON files (doc_id)")
+
+    def get_file_hash(self, source):
+        with self.lock:
+            row = self.conn.execute("SELECT file_hash FROM files WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def get_sources(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT source FROM files")]
+
+    def get_chunks(self, source):
+        """
+        :param source: Source path
+        :return: Dict of chunk ID to text hash
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT id, text_hash FROM chunks WHERE source = ?", (source,))
+            return dict(rows.fetchall())
+
+    def find_text_hashes(self, text_hashes):
+        """
+        Find chunks already embedded with the given texts, regardless of source
+        :param text_hashes: Iterable of text hashes
+        :return: Dict of text hash to the ID of a chunk holding that text
+        """
+        text_hashes = list(set(text_hashes))
+        found = {}
+        with self.lock:
+            for i in range(0, len(text_hashes), 500):
+                batch = text_hashes[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT text_hash, id FROM chunks WHERE text_hash IN ({','.join('?' * len(batch))})", batch)
+                found.update(rows.fetchall())
+        return found
+
+    def update_source(self, source, file_hash, chunks: dict, chunk_count=None):
+        """
+        Replace the recorded state of a source
+        :param source: Source path
+        :param file_hash: Content hash of the file
+        :param chunks: Dict of chunk ID to text hash
+        :param chunk_count: Number of those chunks stored in the collection, when some are only
+            linked to a near-duplicate
+        """
+        chunk_count = len(chunks) if chunk_count is None else chunk_count
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self.conn.executemany("INSERT OR REPLACE INTO chunks (id, source, text_hash) VALUES (?, ?, ?)",
+                                  [(chunk_id, source, text_hash) for chunk_id, text_hash in chunks.items()])
+            self.conn.execute("INSERT OR REPLACE INTO files (source, file_hash, doc_id, chunk_count, ingested_at) "
+                              "VALUES (?, ?, ?, ?, ?)",
+                              (source, file_hash, document_id(source), chunk_count, time.time()))
+
+    def remove_sources(self, sources):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM chunks WHERE source = ?", [(source,) for source in sources])
+            self.conn.executemany("DELETE FROM files WHERE source = ?", [(source,) for source in sources])
+
+    def get_documents(self):
+        """
+        :return: List of registered documents, as dicts of doc_id, source, file_hash, chunk_count and ingested_at
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT doc_id, source, file_hash, chunk_count, ingested_at FROM files "
+                                     "ORDER BY source").fetchall()
+        return [dict(zip(("doc_id", "source", "file_hash", "chunk_count", "ingested_at"), row)) for row in rows]
+
+    def resolve_documents(self, refs):
+        """
+        Resolve document references to registered sources
+        :param refs: Doc IDs, or for older callers source paths or file names
+        :return: Dict of source to its chunk count
+        """
+        resolved = {}
+        with self.lock:
+            for ref in refs:
+                rows = self.conn.execute("SELECT source, chunk_count FROM files WHERE doc_id = ? OR source = ?",
+                                         (ref, ref)).fetchall()
+                if not rows:
+                    rows = [row for row in self.conn.execute("SELECT source, chunk_count FROM files")
+                            if os.path.basename(row[0]) == ref]
+                resolved.update(rows)
+        return resolved
+
+    def count_chunks(self):
+        """
+        :return: Number of chunks stored in the collection
+        """
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(chunk_count), 0) FROM files").fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.execute("DELETE FROM files")
@@ -0,0 +1,50 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+
+def run_stage(items, fn, maxsize=2):
+    """
+    Apply fn to each item on a background thread and yield the results in order. The results pass
+    through a bounded queue, so the stage never runs more than maxsize items ahead of its consumer.
+    Stages chain by passing one stage's generator as the next one's items.
+    :param items: Iterable of inputs
+    :param fn: Function applied to every item
+    :param maxsize: Queue size between this stage and the consumer
+    """
+    results = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(value):
+        while not stopped.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            for item in items:
+                if not put(fn(item)):
+                    return
+        except BaseException as e:
+            put(_StageError(e))
+        put(_DONE)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while (result := results.get()) is not _DONE:
+            if isinstance(result, _StageError):
+                raise result.error
+            yield result
+    finally:
+        stopped.set()
@@ -0,0 +1,274 @@
+import heapq
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from langchain.schema.document import Document
+
+# Words plus identifiers such as P/N-4471-B or 3.2.1, which are also indexed by their parts
+_TOKEN = re.compile(r"[^\W_]+(?:[-_./:][^\W_]+)*")
+_PART = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str):
+    tokens = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if len(part) > 1)
+    return tokens
+
+
+def metadata_matches(metadata, where):
+    """
+    Evaluate a Chroma metadata filter against one metadata dict
+    """
+    if "$and" in where:
+        return all(metadata_matches(metadata, clause) for clause in where["$and"])
+    if "$or" in where:
+        return any(metadata_matches(metadata, clause) for clause in where["$or"])
+    for key, condition in where.items():
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        value = metadata.get(key)
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                matched = value == operand
+            elif operator == "$ne":
+                matched = value != operand
+            elif operator == "$in":
+                matched = value in operand
+            elif operator == "$nin":
+                matched = value not in operand
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                matched = {"$gt": value > operand, "$gte": value >= operand,
+                           "$lt": value < operand, "$lte": value <= operand}[operator]
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+            if not matched:
+                return False
+    return True
+
+
+def reciprocal_rank_fusion(rankings, k=5, rank_constant=60):
+    """
+    Fuse ranked result lists by summing 1 / (rank_constant + rank) per chunk
+    :param rankings: Lists of (document, score), best first
+    :param k: Number of results
+    :return: List of (document, fused score), best first
+    """
+    fused, documents = {}, {}
+    for ranking in rankings:
+        for rank, (document, _score) in enumerate(ranking, start=1):
+            chunk_id = document.id or document.metadata.get("id")
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1 / (rank_constant + rank)
+            documents.setdefault(chunk_id, document)
+    return [(documents[chunk_id], score)
+            for chunk_id, score in heapq.nlargest(k, fused.items(), key=lambda item: item[1])]
+
+
+class KeywordIndex:
+    """
+    On-disk BM25 inverted index over the chunks of a collection, updated incrementally as chunks are
+    written and deleted
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS docs ("
+                              "id TEXT PRIMARY KEY, source TEXT, length INTEGER NOT NULL, "
+                              "document TEXT NOT NULL, metadata TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS docs_source ON docs (source)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) "
+                              "WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS postings ("
+                              "term TEXT NOT NULL, id TEXT NOT NULL, tf INTEGER NOT NULL, "
+                              "PRIMARY KEY (term, id)) WITHOUT ROWID")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS postings_id ON postings (id)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS synced_sources (source TEXT PRIMARY KEY)")
+        self.count, self.total_length = self.read_stats()
+        self.lengths = dict(self.conn.execute("SELECT id, length FROM docs").fetchall())
+
+    def read_stats(self):
+        stats = dict(self.conn.execute("SELECT key, value FROM stats").fetchall())
+        return stats.get("count", 0), stats.get("total_length", 0)
+
+    def write_stats(self):
+        self.conn.executemany("INSERT OR REPLACE INTO stats (key, value) VALUES (?, ?)",
+                              [("count", self.count), ("total_length", self.total_length)])
+
+    def _remove(self, ids):
+        for chunk_id in ids:
+            row = self.conn.execute("SELECT length FROM docs WHERE id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                continue
+            terms = [(term,) for term, in self.conn.execute("SELECT term FROM postings WHERE id = ?", (chunk_id,))]
+            self.conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", terms)
+            self.conn.executemany("DELETE FROM terms WHERE term = ? AND df <= 0", terms)
+            self.conn.execute("DELETE FROM postings WHERE id = ?", (chunk_id,))
+            self.conn.execute("DELETE FROM docs WHERE id = ?", (chunk_id,))
+            self.count -= 1
+            self.total_length -= row[0]
+            self.lengths.pop(chunk_id, None)
+
+    def upsert(self, ids, documents, metadatas):
+        """
+        :param ids: List of chunk IDs
+        :param documents: List of chunk texts
+        :param metadatas: List of metadata dicts
+        """
+        chunks = {chunk_id: (document, metadata or {}) for chunk_id, document, metadata in zip(ids, documents, metadatas)}
+        with self.lock, self.conn:
+            self._remove(chunks)
+            for chunk_id, (document, metadata) in chunks.items():
+                frequencies = Counter(tokenize(document))
+                length = sum(frequencies.values())
+                self.conn.execute("INSERT INTO docs (id, source, length, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                                  (chunk_id, metadata.get("source"), length, document, json.dumps(metadata)))
+                self.conn.executemany("INSERT INTO postings (term, id, tf) VALUES (?, ?, ?)",
+                                      [(term, chunk_id, tf) for term, tf in frequencies.items()])
+                self.conn.executemany("INSERT INTO terms (term, df) VALUES (?, 1) "
+                                      "ON CONFLICT (term) DO UPDATE SET df = df + 1",
+                                      [(term,) for term in frequencies])
+                self.count += 1
+                self.total_length += length
+                self.lengths[chunk_id] = length
+            self.write_stats()
+
+    def delete(self, ids):
+        with self.lock, self.conn:
+            self._remove(ids)
+            self.write_stats()
+
+    def delete_sources(self, sources):
+        with self.lock, self.conn:
+            ids = [row[0] for source in sources
+                   for row in self.conn.execute("SELECT id FROM docs WHERE source = ?", (source,))]
+            self._remove(ids)
+            self.write_stats()
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM terms")
+            self.conn.execute("DELETE FROM docs")
+            self.count, self.total_length = 0, 0
+            self.lengths = {}
+            self.write_stats()
+            self.conn.execute("DELETE FROM stats WHERE key = 'synced_at'")
+            self.conn.execute("DELETE FROM synced_sources")
+
+    def get_ids(self):
+        with self.lock:
+            return set(self.lengths)
+
+    def search(self, query: str, k=5, filter=None):
+        """
+        :param query: Query text
+        :param k: Number of results
+        :param filter: Chroma metadata filter
+        :return: List of (document, BM25 score), best first
+        """
+        terms = set(tokenize(query))
+        with self.lock:
+            if not terms or not self.count:
+                return []
+            average_length = self.total_length / self.count
+            scores = {}
+            for term in terms:
+                row = self.conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if not row or not row[0]:
+                    continue
+                idf = math.log(1 + (self.count - row[0] + 0.5) / (row[0] + 0.5))
+                for chunk_id, tf in self.conn.execute("SELECT id, tf FROM postings WHERE term = ?", (term,)):
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / average_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            # Filtered searches walk the ranking until k matches are found
+            ranked = heapq.nlargest(len(scores) if filter else k, scores.items(), key=lambda item: item[1])
+            results = []
+            for i in range(0, len(ranked), 100):
+                batch = ranked[i:i + 100]
+                placeholders = ",".join("?" * len(batch))
+                rows = {chunk_id: (document, metadata) for chunk_id, document, metadata in self.conn.execute(
+                    f"SELECT id, document, metadata FROM docs WHERE id IN ({placeholders})",
+                    [chunk_id for chunk_id, _ in batch])}
+                for chunk_id, score in batch:
+                    document, metadata = rows[chunk_id]
+                    metadata = json.loads(metadata)
+                    if filter and not metadata_matches(metadata, filter):
+                        continue
+                    results.append((Document(page_content=document, metadata=metadata, id=chunk_id), score))
+                    if len(results) == k:
+                        return results
+            return results
+
+    def sync(self, collection, manifest=None, batch_size=1000):
+        """
+        Reconcile the index with the Chroma collection. With the ingest manifest only the sources
+        ingested or removed since the last sync are read again; the first sync, or one without a
+        manifest, compares every ID.
+        :param collection: Chroma collection
+        :param manifest: IngestManifest of the collection
+        :return: Number of ids added, updated and removed
+        """
+        started = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM stats WHERE key = 'synced_at'").fetchone()
+            synced_sources = {row[0] for row in self.conn.execute("SELECT source FROM synced_sources")}
+        if manifest is None:
+            return self.sync_all(collection, batch_size)
+        documents = manifest.get_documents()
+        if row is None:
+            changed = self.sync_all(collection, batch_size)
+        else:
+            sources = [document["source"] for document in documents
+                       if document["source"] not in synced_sources or (document["ingested_at"] or 0) >= row[0]]
+            removed = synced_sources - {document["source"] for document in documents}
+            changed = sum(self.sync_source(collection, source) for source in sources + sorted(removed))
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO stats (key, value) VALUES ('synced_at', ?)", (started,))
+            self.conn.execute("DELETE FROM synced_sources")
+            self.conn.executemany("INSERT INTO synced_sources (source) VALUES (?)",
+                                  [(document["source"],) for document in documents])
+        return changed
+
+    def sync_all(self, collection, batch_size=1000):
+        """
+        Reconcile the index with every ID of the Chroma collection
+        :return: Number of ids added and removed
+        """
+        expected = set(collection.get(include=[])["ids"])
+        indexed = self.get_ids()
+        missing = [chunk_id for chunk_id in expected if chunk_id not in indexed]
+        extra = [chunk_id for chunk_id in indexed if chunk_id not in expected]
+        self.delete(extra)
+        for i in range(0, len(missing), batch_size):
+            result = collection.get(ids=missing[i:i + batch_size], include=["documents", "metadatas"])
+            self.upsert(result["ids"], result["documents"], result["metadatas"])
+        return len(missing) + len(extra)
+
+    def sync_source(self, collection, source):
+        """
+        Re-index the chunks of one source from the Chroma collection
+        :return: Number of ids written and removed
+        """
+        result = collection.get(where={"source": source}, include=["documents", "metadatas"])
+        with self.lock:
+            indexed = {row[0] for row in self.conn.execute("SELECT id FROM docs WHERE source = ?", (source,))}
+        extra = list(indexed - set(result["ids"]))
+        self.delete(extra)
+        self.upsert(result["ids"], result["documents"], result["metadatas"])
+        return len(result["ids"]) + len(extra)
@@ -1,18 +1,32 @@
+import contextvars
 import os
+from contextlib import contextmanager
 from lightrag.lightrag import LightRAG
-from lightrag.base import QueryParam
-from lightrag.llm.ollama import ollama_model_complete, ollama_embed
-from lightrag.utils import EmbeddingFunc
-import textract
+from lightrag.base import QueryParam, DocStatus
+from lightrag.llm.ollama import _ollama_model_if_cache, ollama_embed
+from lightrag.utils import EmbeddingFunc, always_get_an_event_loop
+from .embedding_cache import get_embedding_cache
+from .get_embedding_func import EMBEDDING_MODEL
+from .text_extractor import TextExtractor
+from .ollama_client import OllamaClient
+from .llm_cache import LLMCache
 from typing import Literal
 
 import asyncio
 import nest_asyncio
 
 llm_model_kwargs = {"host": "http://localhost:11434", "options": {"num_ctx": 32768}}
+# Model for the LLM calls of the current task and the tasks it starts, None for the generation model.
+# Per context rather than per wrapper, so a query running during an ingest keeps the generation model.
+_llm_model = contextvars.ContextVar("lightrag_llm_model", default=None)
+# Whether those calls go through the LLM cache
+_llm_caching = contextvars.ContextVar("lightrag_llm_caching", default=False)
+
 class LightRagWrapper:
     def __init__(self, working_dir, llm_model_ingest, llm_model_gen, doc_dir, llm_model_kwargs=llm_model_kwargs, llm_model_max_async=4,
-                 llm_model_max_token_size=32768, embedding_dim=768, max_token_size=8192):
+                 llm_model_max_token_size=32768, embedding_dim=768, max_token_size=8192, extractor: TextExtractor = None,
+                 ollama_client: OllamaClient = None, max_parallel_insert=4, extract_workers=4,
+                 llm_cache: LLMCache = None):
 
         if not os.path.exists(working_dir):
             os.mkdir(working_dir)
@@ -26,47 +40,160 @@ class LightRagWrapper:
         self.embedding_func = EmbeddingFunc(
             embedding_dim=embedding_dim,
             max_token_size=max_token_size,
-            func=lambda texts: ollama_embed(
-                texts, embed_model="nomic-embed-text", host="http://localhost:11434"
+            func=lambda texts: get_embedding_cache().aembed(
+                EMBEDDING_MODEL, texts,
+                lambda missing: ollama_embed(missing, embed_model=EMBEDDING_MODEL, host="http://localhost:11434")
             ),
         )
+        # Storages are loaded once here; using_model only changes the model model_complete asks for
         self.rag = LightRAG(
             working_dir=working_dir,
-            llm_model_func=ollama_model_complete,
+            llm_model_func=self.model_complete,
             llm_model_name=self.gen_model,
             llm_model_max_async=llm_model_max_async,
             llm_model_max_token_size=llm_model_max_token_size,
             llm_model_kwargs=llm_model_kwargs,
             embedding_func=self.embedding_func,
+            max_parallel_insert=max_parallel_insert,
         )
         self.doc_dir = doc_dir
+        self.extractor = extractor or TextExtractor()
+        self.extract_workers = extract_workers
+        # Shared with the chat generations, so graph building and chat together stay within one LLM budget
+        self.ollama_client = ollama_client
+        self.llm_cache = llm_cache
+        self.listeners = []
+
+    async def model_complete(self, prompt, system_prompt=None, history_messages=[], keyword_extraction=False,
+                             **kwargs):
+        """
+        ollama_model_complete with the model set by using_model in the calling context instead of the
+        LightRAG config.
+        Calls made in a using_model block with caching go through the persistent LLM cache.
+        """
+        if kwargs.pop("keyword_extraction", None) or keyword_extraction:
+            kwargs["format"] = "json"
+        model = _llm_model.get() or self.gen_model
+
+        async def complete(prompt, **kwargs):
+            call = _ollama_model_if_cache(model, prompt, **kwargs)
+            if self.ollama_client is None or kwargs.get("stream"):
+                return await call
+            return await self.ollama_client.alimit(call)
+
+        if self.llm_cache is not None and _llm_caching.get() and not kwargs.get("stream"):
+            return await self.llm_cache.acomplete(model, complete, prompt, system_prompt=system_prompt,
+                                                  history_messages=history_messages, **kwargs)
+        return await complete(prompt, system_prompt=system_prompt, history_messages=history_messages, **kwargs)
+
+    def on_change(self, listener):
+        """
+        Register a callback run as listener(file_paths) after documents are inserted or deleted
+        """
+        self.listeners.append(listener)
+
+    def notify(self, file_paths):
+        for listener in self.listeners:
+            try:
+                listener(file_paths)
+            except Exception as e:
+                print(f"Error notifying change listener: {e}")
 
     def ingest(self, file_paths):
-        self.switch_model(self.ingest_model)
-        for path in file_paths:
-            text_content = textract.process(path)
-            self.rag.insert(text_content.decode("utf-8"), ids=path)
-        self.switch_model(self.gen_model)
+        """
+        :param file_paths: List of file paths
+        :return: Dict of file path to error message, None for the files inserted into the graph
+        """
+        return always_get_an_event_loop().run_until_complete(self.aingest(file_paths))
+
+    async def aingest(self, file_paths):
+        """
+        Extract the files concurrently and insert them into the graph in one batch, so entity extraction
+        overlaps across documents. A file that fails does not stop the others.
+        :param file_paths: List of file paths
+        :return: Dict of file path to error message, None for the files inserted into the graph
+        """
+        file_paths = list(dict.fromkeys(file_paths))
+        results = {}
+        workers = asyncio.Semaphore(self.extract_workers)
+
+        async def extract(path):
+            async with workers:
+                try:
+                    text = await asyncio.to_thread(self.extractor.extract_text, path)
+                except Exception as e:
+                    print(f"Error extracting {path}: {e}")
+                    results[path] = str(e)
+                    return None
+                if not text.strip():
+                    results[path] = "No text extracted"
+                    return None
+                return text
+
+        texts = await asyncio.gather(*[extract(path) for path in file_paths])
+        extracted = {path: text for path, text in zip(file_paths, texts) if text is not None}
+
+        if extracted:
+            error = None
+            try:
+                with self.using_model(self.ingest_model, caching=True):
+                    await self.rag.ainsert(list(extracted.values()), ids=list(extracted))
+            except Exception as e:
+                print(f"Error inserting documents into LightRAG: {e}")
+                # Documents the pipeline finished before the error are in the graph all the same
+                error = str(e)
+            if self.llm_cache is not None:
+                print(f"LLM cache: {self.llm_cache.stats()}")
+
+            for path in extracted:
+                status = await self.rag.doc_status.get_by_id(path)
+                if status is None:
+                    results[path] = error or "Not inserted"
+                elif status.get("status") != DocStatus.PROCESSED:
+                    results[path] = status.get("error") or error or f"Document is {status.get('status')}"
+                else:
+                    results[path] = None
+
+        inserted = [path for path in file_paths if results.get(path, "") is None]
+        if inserted:
+            self.notify(inserted)
+        failed = len(file_paths) - len(inserted)
+        print(f"LightRAG ingested {len(inserted)} of {len(file_paths)} files" + (f", {failed} failed" if failed else ""))
+        return {path: results[path] for path in file_paths}
 
     def query(self, query_text, history: list = None, mode: Literal["local", "global", "hybrid", "naive","mix"]='mix', only_need_context=False):
         return self.rag.query(query_text, param=QueryParam(mode=mode, conversation_history=history, only_need_context=only_need_context))
 
+    async def aquery(self, query_text, history: list = None, mode: Literal["local", "global", "hybrid", "naive", "mix"] = 'mix',
+                     only_need_context=False):
+        """
+        query for async callers, answered on their event loop. The LLM calls go through model_complete,
+        so they share the OllamaClient generation limit.
+        """
+        return await self.rag.aquery(query_text, param=QueryParam(mode=mode, conversation_history=history,
+                                                                  only_need_context=only_need_context))
+
     def delete_document(self, file_path):
-        self.delete_by_doc_id(file_path)
+        always_get_an_event_loop().run_until_complete(self.delete_by_doc_id(file_path))
 
     async def delete_by_doc_id(self, doc_id):
         await self.rag.adelete_by_doc_id(doc_id)
+        self.notify([doc_id])
 
     def delete_by_entity_id(self, entity_id):
         self.rag.delete_by_entity(entity_id)
 
-    def switch_model(self, model_name):
-        self.rag = LightRAG(
-            working_dir=self.rag.working_dir,
-            llm_model_func=ollama_model_complete,
-            llm_model_name=model_name,
-            llm_model_max_async=self.rag.llm_model_max_async,
-            llm_model_max_token_size=self.rag.llm_model_max_token_size,
-            llm_model_kwargs=self.rag.llm_model_kwargs,
-            embedding_func=self.embedding_func,
-        )
+    @contextmanager
+    def using_model(self, model_name, caching=False):
+        """
+        Use model_name for the LLM calls made in this block, including by the tasks it starts, keeping the
+        loaded graph, KV and vector storages. Concurrent tasks keep their own model.
+        :param caching: Answer the calls from the LLM cache, storing the ones it misses
+        """
+        model_token = _llm_model.set(model_name)
+        caching_token = _llm_caching.set(caching)
+        try:
+            yield
+        finally:
+            _llm_caching.reset(caching_token)
+            _llm_model.reset(model_token)
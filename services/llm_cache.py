@@ -0,0 +1,135 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from .ingest_manifest import hash_text
+
+
+def prompt_hash(prompt, system_prompt=None, history_messages=None, **kwargs):
+    """
+    Hash of everything that shapes a completion besides the model: the messages plus the output format
+    and model options
+    """
+    return hash_text(json.dumps({"prompt": prompt, "system_prompt": system_prompt,
+                                 "history_messages": history_messages or [],
+                                 "format": kwargs.get("format"), "options": kwargs.get("options")},
+                                sort_keys=True, default=str))
+
+
+class LLMCache:
+    """
+    Disk-backed cache of LLM completions keyed by (model, prompt hash). It lives outside the LightRAG
+    working dir, so rebuilding the graph or resuming an interrupted ingest replays finished extractions
+    instead of calling the model again. Least recently used entries are evicted past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS completions ("
+                              "model TEXT NOT NULL, prompt_hash TEXT NOT NULL, response TEXT NOT NULL, "
+                              "size INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL, "
+                              "PRIMARY KEY (model, prompt_hash)) WITHOUT ROWID")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, model, key):
+        """
+        :param model: Model name
+        :param key: Prompt hash
+        :return: Cached response, or None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM completions WHERE model = ? AND prompt_hash = ?",
+                                    (model, key)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE completions SET last_used = ? WHERE model = ? AND prompt_hash = ?",
+                                  (time.time(), model, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, key, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            with self.conn:
+                previous = self.conn.execute("SELECT size FROM completions WHERE model = ? AND prompt_hash = ?",
+                                             (model, key)).fetchone()
+                self.conn.execute("INSERT OR REPLACE INTO completions "
+                                  "(model, prompt_hash, response, size, created, last_used) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", (model, key, response, size, now, now))
+                self.size += size - (previous[0] if previous else 0)
+            if self.size > self.max_bytes:
+                self.evict(self.max_bytes * 0.9)
+
+    def evict(self, target):
+        with self.conn:
+            while self.size > target:
+                rows = self.conn.execute("SELECT model, prompt_hash, size FROM completions "
+                                         "ORDER BY last_used LIMIT 1000").fetchall()
+                if not rows:
+                    break
+                evicted = []
+                for model, key, size in rows:
+                    if self.size <= target:
+                        break
+                    evicted.append((model, key))
+                    self.size -= size
+                self.conn.executemany("DELETE FROM completions WHERE model = ? AND prompt_hash = ?", evicted)
+                self.evictions += len(evicted)
+
+    def compact(self, max_age=None, models=None):
+        """
+        Drop stale entries and reclaim their disk space, if any were dropped
+        :param max_age: Drop entries unused for this many seconds
+        :param models: Keep only the entries of these models, such as the current ingest model
+        :return: Number of entries dropped
+        """
+        with self.lock:
+            before = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            with self.conn:
+                if max_age is not None:
+                    self.conn.execute("DELETE FROM completions WHERE last_used < ?", (time.time() - max_age,))
+                if models is not None:
+                    self.conn.execute(f"DELETE FROM completions WHERE model NOT IN ({','.join('?' * len(models))})",
+                                      list(models))
+            self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            if self.size > self.max_bytes:
+                self.evict(self.max_bytes * 0.9)
+            dropped = before - self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            if dropped:
+                self.conn.execute("VACUUM")
+        return dropped
+
+    async def acomplete(self, model, complete, prompt, system_prompt=None, history_messages=None, **kwargs):
+        """
+        Return the cached completion, calling complete only on a miss. The sqlite reads and writes run in a
+        thread, so a slow disk or a long eviction does not stall the other calls on the event loop.
+        :param model: Model name
+        :param complete: Coroutine function called as complete(prompt, system_prompt=..., history_messages=...,
+            **kwargs)
+        :return: Completion text
+        """
+        key = prompt_hash(prompt, system_prompt, history_messages, **kwargs)
+        if (response := await asyncio.to_thread(self.get, model, key)) is not None:
+            return response
+        response = await complete(prompt, system_prompt=system_prompt, history_messages=history_messages, **kwargs)
+        if isinstance(response, str):
+            await asyncio.to_thread(self.put, model, key, response)
+        return response
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": entries, "bytes": self.size, "max_bytes": self.max_bytes}
@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+import zlib
+import numpy as np
+
+_PRIME = (1 << 31) - 1
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index over the embedded chunks of a collection. Chunks whose estimated Jaccard
+    similarity to an already embedded chunk of the same source reaches threshold are linked to that
+    chunk instead of being embedded and stored again. Links stay within a source, so a search scoped
+    to some documents still finds the text of every chunk they hold.
+    """
+
+    def __init__(self, path, threshold=0.9, num_perm=128, bands=16, shingle_size=5, embedding_dim=768):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.embedding_dim = embedding_dim
+        # Fixed seed so signatures stay comparable across processes
+        rng = np.random.RandomState(1)
+        self.a = rng.randint(1, _PRIME, num_perm, dtype=np.int64)
+        self.b = rng.randint(0, _PRIME, num_perm, dtype=np.int64)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS signatures ("
+                              "chunk_id TEXT PRIMARY KEY, source TEXT NOT NULL, signature BLOB NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS buckets ("
+                              "band INTEGER NOT NULL, bucket INTEGER NOT NULL, chunk_id TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (band, bucket)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_chunk ON buckets (chunk_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS signatures_source ON signatures (source)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS links ("
+                              "chunk_id TEXT PRIMARY KEY, source TEXT NOT NULL, canonical_id TEXT NOT NULL, "
+                              "bytes INTEGER NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS links_canonical ON links (canonical_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS links_source ON links (source)")
+
+    def signature(self, text):
+        words = text.split()
+        shingles = {" ".join(words[i:i + self.shingle_size])
+                    for i in range(max(1, len(words) - self.shingle_size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                             dtype=np.int64, count=len(shingles)) % _PRIME
+        return ((np.outer(hashes, self.a) + self.b) % _PRIME).min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature):
+        return [(band, zlib.crc32(signature[band * self.rows:(band + 1) * self.rows].tobytes()))
+                for band in range(self.bands)]
+
+    def find(self, signature, source, exclude_id=None):
+        """
+        :return: ID of the most similar indexed chunk of source at or above threshold, or None
+        """
+        candidates = {}
+        for band, bucket in self.band_keys(signature):
+            candidates.update(self.conn.execute(
+                "SELECT buckets.chunk_id, signature FROM buckets JOIN signatures USING (chunk_id) "
+                "WHERE band = ? AND bucket = ? AND source = ?", (band, bucket, source)))
+        candidates.pop(exclude_id, None)
+        best, best_similarity = None, self.threshold
+        for chunk_id, candidate in candidates.items():
+            similarity = float(np.mean(np.frombuffer(candidate, dtype=np.uint32) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = chunk_id, similarity
+        return best
+
+    def filter(self, chunks, source):
+        """
+        Split chunks into the ones to embed and the near-duplicates of already indexed chunks.
+        Chunks to embed are indexed right away, so duplicates within the batch are caught too.
+        :param chunks: List of chunks with an "id" in their metadata
+        :param source: Source the chunks belong to
+        :return: List of chunks to embed, dict of linked chunk ID to canonical chunk ID, and dict of
+            orphaned chunk ID to source for links to the previous text of these chunks
+        """
+        keep, linked = [], {}
+        with self.lock, self.conn:
+            orphaned = self._remove_ids([chunk.metadata["id"] for chunk in chunks])
+            for chunk in chunks:
+                chunk_id = chunk.metadata["id"]
+                signature = self.signature(chunk.page_content)
+                if canonical_id := self.find(signature, source, exclude_id=chunk_id):
+                    self.conn.execute("INSERT INTO links (chunk_id, source, canonical_id, bytes) VALUES (?, ?, ?, ?)",
+                                      (chunk_id, source, canonical_id,
+                                       len(chunk.page_content.encode("utf-8")) + self.embedding_dim * 4))
+                    linked[chunk_id] = canonical_id
+                    continue
+                self.conn.execute("INSERT INTO signatures (chunk_id, source, signature) VALUES (?, ?, ?)",
+                                  (chunk_id, source, signature.tobytes()))
+                self.conn.executemany("INSERT INTO buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                                      [(band, bucket, chunk_id) for band, bucket in self.band_keys(signature)])
+                keep.append(chunk)
+        return keep, linked, orphaned
+
+    def _remove_ids(self, ids):
+        """
+        :return: Dict of chunk ID to source of the links to the removed chunks, which are dropped too
+            since the text they stood for is no longer embedded anywhere
+        """
+        removed = set(ids)
+        orphaned = {}
+        for chunk_id in ids:
+            orphaned.update(self.conn.execute("SELECT chunk_id, source FROM links WHERE canonical_id = ?",
+                                              (chunk_id,)).fetchall())
+        orphaned = {chunk_id: source for chunk_id, source in orphaned.items() if chunk_id not in removed}
+        rows = [(chunk_id,) for chunk_id in [*ids, *orphaned]]
+        self.conn.executemany("DELETE FROM buckets WHERE chunk_id = ?", rows)
+        self.conn.executemany("DELETE FROM signatures WHERE chunk_id = ?", rows)
+        self.conn.executemany("DELETE FROM links WHERE chunk_id = ?", rows)
+        return orphaned
+
+    def remove_ids(self, ids):
+        """
+        :param ids: List of chunk IDs
+        :return: Dict of orphaned chunk ID to its source
+        """
+        with self.lock, self.conn:
+            return self._remove_ids(ids)
+
+    def remove_sources(self, sources):
+        """
+        Drop the chunks and links of removed sources
+        :param sources: List of source paths
+        """
+        with self.lock, self.conn:
+            ids = [row[0] for source in sources
+                   for row in self.conn.execute("SELECT chunk_id FROM signatures WHERE source = ?", (source,))]
+            self._remove_ids(ids)
+            for source in sources:
+                self.conn.execute("DELETE FROM links WHERE source = ?", (source,))
+
+    def linked_ids(self, source):
+        """
+        :return: Set of the chunk IDs of source that are linked instead of stored
+        """
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT chunk_id FROM links WHERE source = ?", (source,))}
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM buckets")
+            self.conn.execute("DELETE FROM signatures")
+            self.conn.execute("DELETE FROM links")
+
+    def stats(self):
+        with self.lock:
+            linked, saved = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM links").fetchone()
+            indexed = self.conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+        return {"indexed_chunks": indexed, "embeddings_saved": linked, "bytes_saved": saved}
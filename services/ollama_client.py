@@ -0,0 +1,150 @@
+import asyncio
+import queue
+import threading
+import httpx
+import ollama
+
+_DONE = object()
+
+
+class OllamaClient:
+    """
+    Asyncio client for Ollama with one pooled HTTP connection set and a limit on generations in flight.
+    Requests run on a private event loop thread, so coroutines from any loop (Gradio's, or the one
+    Flask starts per async view) share the pool and the limit. Cancelling a call, or closing a stream
+    early, closes its connection and Ollama stops generating. The sync methods mirror the ollama
+    module for existing callers.
+    """
+
+    def __init__(self, host=None, max_connections=32, max_generations=4):
+        self.max_generations = max_generations
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="ollama-client", daemon=True).start()
+        self.client = ollama.AsyncClient(host, limits=httpx.Limits(max_connections=max_connections,
+                                                                   max_keepalive_connections=max_connections))
+        self.generations = asyncio.Semaphore(max_generations)
+        self.active = 0
+
+    async def _run(self, coro):
+        # Cancelling the awaiting task cancels the request on the client loop
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def _generation(self, method, kwargs):
+        return await self._limited(method(**kwargs))
+
+    async def _limited(self, coro):
+        async with self.generations:
+            self.active += 1
+            try:
+                return await coro
+            finally:
+                self.active -= 1
+
+    async def _generation_stream(self, method, kwargs, put):
+        async with self.generations:
+            self.active += 1
+            try:
+                async for part in await method(stream=True, **kwargs):
+                    put(part)
+            finally:
+                self.active -= 1
+
+    async def _stream(self, method, kwargs):
+        """
+        Relay a streamed generation from the client loop to the calling loop
+        """
+        loop = asyncio.get_running_loop()
+        parts = asyncio.Queue()
+
+        def put(part):
+            loop.call_soon_threadsafe(parts.put_nowait, part)
+
+        future = asyncio.run_coroutine_threadsafe(self._generation_stream(method, kwargs, put), self.loop)
+        future.add_done_callback(lambda _future: put(_DONE))
+        try:
+            while (part := await parts.get()) is not _DONE:
+                yield part
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+        finally:
+            future.cancel()
+
+    def _iterate(self, method, kwargs):
+        """
+        Relay a streamed generation from the client loop to a calling thread
+        """
+        parts = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._generation_stream(method, kwargs, parts.put), self.loop)
+        future.add_done_callback(lambda _future: parts.put(_DONE))
+        try:
+            while (part := parts.get()) is not _DONE:
+                yield part
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+        finally:
+            future.cancel()
+
+    async def achat(self, stream=False, **kwargs):
+        """
+        :param stream: Return an async generator of response parts instead of the whole response
+        :param kwargs: Arguments of ollama.chat
+        """
+        if stream:
+            return self._stream(self.client.chat, kwargs)
+        return await self._run(self._generation(self.client.chat, kwargs))
+
+    async def agenerate(self, stream=False, **kwargs):
+        if stream:
+            return self._stream(self.client.generate, kwargs)
+        return await self._run(self._generation(self.client.generate, kwargs))
+
+    async def alimit(self, coro):
+        """
+        Run a coroutine that makes one non-streamed generation with its own client, such as a LightRAG LLM
+        call, on the client loop and under the same generation limit
+        """
+        return await self._run(self._limited(coro))
+
+    async def aembed(self, **kwargs):
+        return await self._run(self.client.embed(**kwargs))
+
+    async def alist(self):
+        return await self._run(self.client.list())
+
+    async def aps(self):
+        return await self._run(self.client.ps())
+
+    async def apull(self, model):
+        return await self._run(self.client.pull(model))
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def chat(self, stream=False, **kwargs):
+        if stream:
+            return self._iterate(self.client.chat, kwargs)
+        return self.call(self._generation(self.client.chat, kwargs))
+
+    def generate(self, stream=False, **kwargs):
+        if stream:
+            return self._iterate(self.client.generate, kwargs)
+        return self.call(self._generation(self.client.generate, kwargs))
+
+    def embed(self, **kwargs):
+        return self.call(self.client.embed(**kwargs))
+
+    def list(self):
+        return self.call(self.client.list())
+
+    def ps(self):
+        return self.call(self.client.ps())
+
+    def pull(self, model):
+        return self.call(self.client.pull(model))
+
+    def stats(self):
+        return {"active_generations": self.active, "max_generations": self.max_generations}
+
+    def close(self):
+        self.call(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
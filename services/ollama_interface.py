@@ -1,6 +1,7 @@
-import ollama
-from langchain_chroma import Chroma
 from langchain.prompts import ChatPromptTemplate
+from .chroma_db import Database
+from .context_packer import ContextPacker
+from .ollama_client import OllamaClient
 
 
 PROMPT_TEMPLATE = """
@@ -30,67 +31,94 @@ def extract_model_names(json):
 
 
 class OllamaInterface:
-    def __init__(self, model: str, db: Chroma):
-        self.ollama = ollama
+    def __init__(self, model: str, db: Database, num_ctx=4096, response_tokens=1024, client: OllamaClient = None):
+        self.ollama = client or OllamaClient()
         self.ollama_model_str = model
         self.db = db
+        self.num_ctx = num_ctx
+        self.context_packer = ContextPacker(num_ctx=num_ctx, response_tokens=response_tokens)
         # load LLM into memory
         self.ollama.generate(model=self.ollama_model_str,
                              keep_alive=-1)
 
+    def build_messages(self, prompt: str, use_context: bool = True, history: list = None, history_limit: int = 5,
+                       context=None):
+        prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE) if use_context else None
+        packed = self.context_packer.pack(prompt_template, prompt, context=context or [], history=history,
+                                          max_history_messages=history_limit * 2 - 1)
+        print("Prompt tokens: ", packed["tokens"])
+        return packed["history"] + [{"role": "user", "content": packed["prompt"]}]
+
     def query(self, prompt: str, use_context: bool = True, history: list = None, history_limit: int = 5, context=None):
-        if context is None:
-            context = []
         try:
-            if use_context:
-                context_text = "\n\n---\n\n".join([doc.page_content for doc, _score in context])
-                prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
-                prompt_updated = prompt_template.format(context=context_text, question=prompt)
-            else:
-                prompt_updated = prompt
-            if history:
-                chat_history = history + [{"role": "user", "content": prompt_updated}]
-            else:
-                chat_history = [{"role": "user", "content": prompt_updated}]
-            chat_history = chat_history[-(history_limit * 2):]
             return self.ollama.chat(
                 model=self.ollama_model_str,
-                messages=chat_history,
+                messages=self.build_messages(prompt, use_context, history, history_limit, context),
                 stream=False,
-                keep_alive=-1
+                keep_alive=-1,
+                options={"num_ctx": self.num_ctx}
             )
         except Exception as e:
             print(f"Error querying Ollama: {e}")
-            return {"message": {"content": "An error occurred. Please try again."}}
+            return {"message": {"content": "An error occurred. Please try again."}, "error": True}
 
-    def get_context(self, prompt: str, doc_ids=None):
-        filters = None
-        if doc_ids:
-            if isinstance(doc_ids, str):
-                if "," in doc_ids:
-                    doc_ids = ["./data/pdfs/"+id.strip() for id in doc_ids.split(",")]
-                else:
-                    doc_ids = ["./data/pdfs/" + doc_ids]
-
-            if len(doc_ids) == 1:
-                filters = {"source": doc_ids[0]}
-            else:
-                filters = {"source": {"$in": doc_ids}}
-        print("Filters: ", filters)
-        if filters is None:
-            filtered_context = self.db.similarity_search_with_score(
-                query=prompt,
-                k=5
-            )
-        else:
-            filtered_context = self.db.similarity_search_with_score(
-                query=prompt,
-                k=5,
-                filter=filters
+    async def aquery(self, prompt: str, use_context: bool = True, history: list = None, history_limit: int = 5,
+                     context=None):
+        try:
+            return await self.ollama.achat(
+                model=self.ollama_model_str,
+                messages=self.build_messages(prompt, use_context, history, history_limit, context),
+                keep_alive=-1,
+                options={"num_ctx": self.num_ctx}
             )
-            print("Filtered context: ", filtered_context)
+        except Exception as e:
+            print(f"Error querying Ollama: {e}")
+            return {"message": {"content": "An error occurred. Please try again."}, "error": True}
+
+    async def aquery_stream(self, prompt: str, use_context: bool = True, history: list = None,
+                            history_limit: int = 5, context=None):
+        """
+        Stream the response as Ollama generates it. Errors are raised to the caller and closing the
+        generator early cancels the generation.
+        :return: Async generator of response text pieces
+        """
+        stream = await self.ollama.achat(
+            model=self.ollama_model_str,
+            messages=self.build_messages(prompt, use_context, history, history_limit, context),
+            stream=True,
+            keep_alive=-1,
+            options={"num_ctx": self.num_ctx})
+        async for part in stream:
+            if content := part["message"]["content"]:
+                yield content
 
-        return filtered_context
+    def get_context(self, prompt: str, doc_ids=None):
+        """
+        :param prompt: User question
+        :param doc_ids: Registry doc IDs to talk to, as a list or comma separated string; file names
+            are still accepted
+        :return: List of (document, score)
+        """
+        if isinstance(doc_ids, str):
+            doc_ids = [doc_id.strip() for doc_id in doc_ids.split(",") if doc_id.strip()]
+        context = self.db.search(query=prompt, k=5, doc_ids=doc_ids or None)
+        if doc_ids:
+            print(f"Retrieved {len(context)} chunks from {len(doc_ids)} selected documents")
+        return context
+
+    def get_contexts(self, prompts, doc_ids=None):
+        """
+        Batch variant of get_context, for evaluation sets and bulk generation
+        :return: List with the context of each prompt
+        """
+        if isinstance(doc_ids, str):
+            doc_ids = [doc_id.strip() for doc_id in doc_ids.split(",") if doc_id.strip()]
+        return self.db.batch_search(list(prompts), k=5, doc_ids=doc_ids or None)
+
+    async def aget_contexts(self, prompts, doc_ids=None):
+        if isinstance(doc_ids, str):
+            doc_ids = [doc_id.strip() for doc_id in doc_ids.split(",") if doc_id.strip()]
+        return await self.db.abatch_search(list(prompts), k=5, doc_ids=doc_ids or None)
 
     def get_details(self):
         details = self.ollama.list()
@@ -2,6 +2,7 @@ from flask import request, Blueprint, make_response, jsonify, url_for
 from .document_loader import DocumentLoader
 from .ollama_interface import OllamaInterface
 from .lightrag_wrapper import LightRagWrapper
+import asyncio
 import os
 from .chatlog import db, ChatLog, ChatHistory, ChatMessage
 from .chroma_db import Database
@@ -12,8 +13,8 @@ nest_asyncio.apply()
 lightrag = LightRagWrapper(working_dir="lightrag_docs", llm_model_name="deepseek-r1:8b",
                            doc_dir="./data/pdfs-lightrag")
 chroma_db = Database(chroma_path="chroma", collection_name="documents")
-ollama_interface = OllamaInterface(model="deepseek-r1:14b", db=chroma_db.db)
-document_loader = DocumentLoader(db=chroma_db.db, collection_name="documents")
+ollama_interface = OllamaInterface(model="deepseek-r1:14b", db=chroma_db)
+document_loader = DocumentLoader(db=chroma_db, collection_name="documents")
 document_loader_lightrag = DocumentLoader
 route_api = Blueprint("route_api", __name__)
 
@@ -44,7 +45,7 @@ async def query():
 @route_api.route("/fetch_response", methods=["GET"])
 async def fetch_response():
     query_text = request.args.get("query")
-    response_text = chat(query_text)
+    response_text = await chat(query_text)
 
     session_id = request.cookies.get("sessionID")
     add_chat_to_db(session_id, query_text, response_text)
@@ -66,13 +67,15 @@ async def query_lightrag():
         # Use HTMX to load the response asynchronously
         response_div = f'''
                     {user_query_div}
-                    <div id="chatbot-response-lightrag" hx-get="/fetch_response?query={query_text}" hx-trigger="load"></div>
+                    <div id="chatbot-response-lightrag" hx-get="/fetch_response_lightrag?query={query_text}" hx-trigger="load"></div>
                 '''
         return response_div
 
+
+@route_api.route("/fetch_response_lightrag", methods=["GET"])
 async def fetch_response_lightrag():
     query_text = request.args.get("query")
-    response_text = chat_lightrag(query_text)
+    response_text = await chat_lightrag(query_text)
 
     session_id = request.cookies.get("sessionID")
     add_chat_to_db(session_id, query_text, response_text)
@@ -90,14 +93,14 @@ def div_generator(classname, text):
     return f"<div class='{classname}'>{text}</div> "
 
 
-def chat(query_text):
-    context = ollama_interface.get_context(query_text)
-    result = ollama_interface.query(query_text, context=context)
+async def chat(query_text):
+    context = await asyncio.to_thread(ollama_interface.get_context, query_text)
+    result = await ollama_interface.aquery(query_text, context=context)
     return result['message']['content']
 
 
-def chat_lightrag(query_text):
-    result = lightrag.query(query_text)
+async def chat_lightrag(query_text):
+    result = await lightrag.aquery(query_text)
     return result
 
 @route_api.route('/chat-history', methods=["GET"])
@@ -222,16 +225,19 @@ def list_files():
     return response
 
 
+@route_api.route("/documents", methods=["GET"])
+def list_registered_documents():
+    # Registry doc IDs are what scoped chat requests select documents by
+    return jsonify(chroma_db.list_documents())
+
+
 @route_api.route("/vectorize", methods=["POST"])
 def vectorize():
     # takes in a list of pdf files and vectorizes them
     if request.method != "POST":
         return "Method not allowed"
     try:
-        documents = document_loader.load_documents()
-
-        chunks = document_loader.split_documents(documents)
-        document_loader.add_to_chroma(chunks)
+        document_loader.ingest()
     except:
         reinitialize_db()
 
@@ -332,11 +338,13 @@ def insert():
     files = request.form.getlist("file-lightrag")
     if len(files) == 0:
         return "No files selected"
-    for file in files:
-        try:
-            lightrag.ingest(file)
-        except Exception as e:
-            return f"Error processing file {file}"
+    try:
+        # one batch, so entity extraction overlaps across the files
+        results = lightrag.ingest(files)
+    except Exception as e:
+        return f"Error processing files: {e}"
+    if errors := {file: error for file, error in results.items() if error is not None}:
+        return "Error processing files: " + ", ".join(f"{file} ({error})" for file, error in errors.items())
 
     return "Files inserted successfully"
 
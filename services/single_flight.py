@@ -0,0 +1,79 @@
+import asyncio
+
+
+class _Flight:
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical streams that overlap in time. The first caller for a key starts the source and
+    later callers attach to it, replaying the pieces produced so far and then following along. The source
+    runs in its own task, so it outlives the caller that started it and is cancelled only once every
+    caller has gone. Callers must share one event loop.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def _produce(self, key, flight, source):
+        try:
+            async for piece in source:
+                async with flight.changed:
+                    flight.pieces.append(piece)
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+
+    async def stream(self, key, source_factory):
+        """
+        :param key: Hashable key of the request
+        :param source_factory: Called without arguments to create the async generator when no identical
+            request is in flight
+        :return: Async generator of the pieces of the shared stream
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._produce(key, flight, source_factory()))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        flight.followers += 1
+        try:
+            position = 0
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: flight.done or len(flight.pieces) > position)
+                    pieces, done = flight.pieces[position:], flight.done
+                position += len(pieces)
+                for piece in pieces:
+                    yield piece
+                if done and position == len(flight.pieces):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.followers -= 1
+            if not flight.followers and not flight.done:
+                # Nobody is listening any more, stop the generation
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                flight.task.cancel()
+
+    def stats(self):
+        return {"in_flight": len(self.flights), "started": self.started, "coalesced": self.coalesced}
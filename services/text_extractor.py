@@ -0,0 +1,73 @@
+import gzip
+import json
+import os
+from langchain_community.document_loaders import PyPDFLoader
+from langchain.schema.document import Document
+from .ingest_manifest import hash_file
+
+
+def parse_pages(file_path):
+    """
+    Parse a file into pages of (text, metadata). Module level so it can run in worker processes.
+    """
+    if str(file_path).lower().endswith(".pdf"):
+        pages = PyPDFLoader(f"{file_path}").load()
+        return [(page.page_content, {key: value for key, value in page.metadata.items() if key != "source"})
+                for page in pages]
+    # Other formats are only needed by LightRAG and arrive as a single page
+    import textract
+    return [(textract.process(file_path).decode("utf-8"), {"page": 0})]
+
+
+class TextExtractor:
+    """
+    Parses each file once and keeps its per-page text in a gzip cache keyed by the file's content
+    hash, so NaiveRAG and LightRAG ingestion, re-chunking and graph rebuilds share one parse
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_path(self, file_hash):
+        return os.path.join(self.cache_dir, f"{file_hash}.json.gz")
+
+    def load(self, file_hash):
+        """
+        :param file_hash: Content hash of the file
+        :return: Cached pages, or None
+        """
+        if not self.cache_dir or not file_hash or not os.path.exists(self.cache_path(file_hash)):
+            return None
+        with gzip.open(self.cache_path(file_hash), "rt", encoding="utf-8") as f:
+            return [tuple(page) for page in json.load(f)]
+
+    def save(self, file_hash, pages):
+        if not self.cache_dir or not file_hash:
+            return
+        path = self.cache_path(file_hash)
+        with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as f:
+            json.dump(pages, f)
+        os.replace(f"{path}.tmp", path)
+
+    def extract(self, file_path, file_hash=None):
+        """
+        Return the pages of a file, parsing it only if it is not cached
+        :param file_path: File path
+        :param file_hash: Content hash of the file, hashed from disk when missing
+        :return: List of (text, metadata)
+        """
+        file_hash = file_hash or (hash_file(file_path) if self.cache_dir else None)
+        if (pages := self.load(file_hash)) is None:
+            pages = parse_pages(file_path)
+            self.save(file_hash, pages)
+        return pages
+
+    def extract_text(self, file_path, file_hash=None):
+        return "\n\n".join(text for text, _ in self.extract(file_path, file_hash))
+
+    @staticmethod
+    def to_documents(file_path, pages):
+        return [Document(page_content=text, metadata={"source": f"{file_path}", **metadata})
+                for text, metadata in pages]
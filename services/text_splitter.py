@@ -0,0 +1,105 @@
+from langchain.schema.document import Document
+
+
+class OffsetTextSplitter:
+    """
+    Recursive character splitter producing (start, end) offsets into the source text instead of
+    copied strings. Chunks match RecursiveCharacterTextSplitter with length_function=len and its
+    default keep_separator and strip_whitespace behaviour; Documents are only built when iterated.
+    """
+
+    def __init__(self, chunk_size=800, chunk_overlap=80, separators=None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or ["\n\n", "\n", " ", ""]
+
+    def split_spans(self, text: str):
+        """
+        :param text: Text to split
+        :return: List of (start, end) offsets of the chunks
+        """
+        spans = []
+        self._split(text, 0, len(text), self.separators, spans)
+        return spans
+
+    def _split(self, text, start, end, separators, spans):
+        separator = separators[-1]
+        remaining = []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                remaining = separators[i + 1:]
+                break
+
+        good = []
+        for piece in self._pieces(text, start, end, separator):
+            if piece[1] - piece[0] < self.chunk_size:
+                good.append(piece)
+                continue
+            if good:
+                self._merge(text, good, spans)
+                good = []
+            if not remaining:
+                self._append(text, piece[0], piece[1], spans)
+            else:
+                self._split(text, piece[0], piece[1], remaining, spans)
+        if good:
+            self._merge(text, good, spans)
+
+    @staticmethod
+    def _pieces(text, start, end, separator):
+        # Separators stay attached to the start of the piece that follows them
+        if separator == "":
+            return [(i, i + 1) for i in range(start, end)]
+        pieces = []
+        piece_start = start
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position > piece_start:
+                pieces.append((piece_start, position))
+            piece_start = position
+            position = text.find(separator, position + len(separator), end)
+        if end > piece_start:
+            pieces.append((piece_start, end))
+        return pieces
+
+    def _merge(self, text, pieces, spans):
+        window = []
+        total = 0
+        for piece in pieces:
+            length = piece[1] - piece[0]
+            if total + length > self.chunk_size and window:
+                self._append(text, window[0][0], window[-1][1], spans)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= window[0][1] - window[0][0]
+                    window.pop(0)
+            window.append(piece)
+            total += length
+        if window:
+            self._append(text, window[0][0], window[-1][1], spans)
+
+    @staticmethod
+    def _append(text, start, end, spans):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append((start, end))
+
+    def iter_chunks(self, documents: list[Document]):
+        """
+        Split documents, building each chunk's Document only when it is reached
+        :param documents: List of documents
+        :return: Generator of chunks with a start_index into their page
+        """
+        for document in documents:
+            text = document.page_content
+            for start, end in self.split_spans(text):
+                yield Document(page_content=text[start:end], metadata={**document.metadata, "start_index": start})
+
+    def split_documents(self, documents: list[Document]):
+        return list(self.iter_chunks(documents))
@@ -0,0 +1,507 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from langchain.schema.document import Document
+
+
+def to_distances(scores, norms, query, space="l2"):
+    """
+    Turn dot products with the query into distances in Chroma's convention for the collection space
+    :param scores: Dot products of the stored vectors with the query, one column per query for a batch
+    :param norms: Squared norms of the stored vectors for l2, norms otherwise
+    :param query: Query vector, or matrix of one query per row
+    """
+    if query.ndim == 2:
+        norms = norms[:, None]
+        squared = np.einsum("ij,ij->i", query, query)
+    else:
+        squared = float(query @ query)
+    if space == "l2":
+        return norms - 2 * scores + squared
+    if space == "cosine":
+        return 1 - scores / (norms * np.sqrt(squared) + 1e-12)
+    return 1 - scores
+
+
+def content_hash(embedding, document, metadata):
+    """
+    Hash of what the index mirrors for a chunk, to tell when Chroma holds a different version of it
+    """
+    digest = hashlib.blake2b(np.asarray(embedding, dtype=np.float32).tobytes(), digest_size=16)
+    digest.update((document or "").encode("utf-8"))
+    digest.update(json.dumps(metadata or {}, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def top_k(distances, k):
+    """
+    :return: Positions of the k smallest distances, closest first; per column for a matrix
+    """
+    k = min(k, len(distances))
+    if k <= 0:
+        return np.empty((0,) + distances.shape[1:], dtype=np.int64)
+    top = np.argpartition(distances, k - 1, axis=0)[:k]
+    order = np.argsort(np.take_along_axis(distances, top, axis=0), axis=0, kind="stable")
+    return np.take_along_axis(top, order, axis=0)
+
+
+class VectorIndex:
+    """
+    In-process search over a mirror of a Chroma collection. Embeddings live in a memory-mapped
+    matrix, so every process opening the same path shares one copy through the page cache; ids,
+    documents and metadata live in sqlite. Chroma stays the source of truth and sync() reconciles
+    the mirror against it. Writers in any process take turns through an immediate sqlite transaction,
+    which covers row allocation, the matrix files and the version readers reload on.
+
+    The matrix is float32, float16, or int8 with a per-vector scale, and it is the only local copy of
+    the vectors, so float16 halves the mirror on disk and in the page cache and int8 quarters it.
+    Quantized searches pick rescore_factor * k candidates and re-rank them with their float32 vectors,
+    fetched by ID through exact_vectors (Chroma) in one call per block of queries.
+    """
+
+    def __init__(self, path, dtype="float32", space="l2", max_bitmaps=256, block_rows=4096, rescore_factor=4,
+                 exact_vectors=None, query_block=1024):
+        os.makedirs(path, exist_ok=True)
+        self.matrix_path = os.path.join(path, "vectors.npy")
+        self.norms_path = os.path.join(path, "norms.npy")
+        self.scales_path = os.path.join(path, "scales.npy")
+        self.rescore_factor = rescore_factor
+        # Function mapping a list of chunk IDs to a dict of their full precision embeddings
+        self.exact_vectors = exact_vectors
+        self.dtype = np.dtype(dtype)
+        self.space = space
+        self.max_bitmaps = max_bitmaps
+        self.block_rows = block_rows
+        # Search keeps at most block_rows x query_block distances in memory at once
+        self.query_block = query_block
+        self.lock = threading.RLock()
+        self.write_depth = 0
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite3"), timeout=60, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS rows ("
+                              "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, "
+                              "metadata TEXT NOT NULL, hash TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            if "hash" not in [column[1] for column in self.conn.execute("PRAGMA table_info(rows)")]:
+                # Rows written before content hashes were kept are re-copied by the next sync()
+                self.conn.execute("ALTER TABLE rows ADD COLUMN hash TEXT")
+        self.version = None
+        requested = self.dtype
+        self.load()
+        if self.matrix is not None and self.matrix.dtype != requested:
+            self.dtype = requested
+            # Stored with another precision: start over, sync() refills from Chroma
+            self.clear()
+        legacy_exact = os.path.join(path, "exact.npy")
+        if os.path.exists(legacy_exact):
+            # Float32 copy kept by earlier versions for rescoring, which now reads Chroma
+            os.remove(legacy_exact)
+
+    def load(self):
+        """
+        (Re)read the index state written by this or another process
+        """
+        meta = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        self.version = meta.get("version", 0)
+        self.matrix = self.norms = self.scales = None
+        if os.path.exists(self.matrix_path) and os.path.exists(self.norms_path):
+            self.matrix = np.load(self.matrix_path, mmap_mode="r+")
+            self.norms = np.load(self.norms_path, mmap_mode="r+")
+            if self.matrix.dtype == np.int8:
+                self.scales = np.load(self.scales_path, mmap_mode="r+")
+        capacity = 0 if self.matrix is None else len(self.matrix)
+        self.ids = np.empty(capacity, dtype=object)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.metadatas = [None] * capacity
+        self.row_of = {}
+        for row, chunk_id, metadata in self.conn.execute("SELECT row, id, metadata FROM rows"):
+            self.ids[row] = chunk_id
+            self.alive[row] = True
+            self.metadatas[row] = json.loads(metadata)
+            self.row_of[chunk_id] = row
+        self.size = int(np.flatnonzero(self.alive)[-1]) + 1 if self.row_of else 0
+        self.free = [int(row) for row in np.flatnonzero(~self.alive[:self.size])]
+        self.columns = {}
+        self.bitmaps = OrderedDict()
+        if self.matrix is not None:
+            # Follow the precision another process may have switched the shared files to
+            self.dtype = self.matrix.dtype
+
+    def refresh(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if (row[0] if row else 0) != self.version:
+            self.load()
+
+    @contextmanager
+    def writing(self):
+        """
+        Hold the write lock of the index across threads and processes. The state is reloaded first if
+        another process wrote since, and the version is bumped in the same transaction as the rows.
+        """
+        with self.lock:
+            if self.write_depth:
+                self.write_depth += 1
+                try:
+                    yield
+                finally:
+                    self.write_depth -= 1
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.write_depth = 1
+            try:
+                self.refresh()
+                yield
+                self.version = self.conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                    "ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value").fetchone()[0]
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                self.load()
+                raise
+            finally:
+                self.write_depth = 0
+
+    def count(self):
+        with self.lock:
+            self.refresh()
+            return len(self.row_of)
+
+    def resize(self, dim, capacity):
+        """
+        Move the matrix into files of a new capacity, swapped in atomically so readers mapping the old
+        files keep a consistent view until they reload
+        """
+        used = 0 if self.matrix is None else min(len(self.matrix), capacity)
+        matrix = np.lib.format.open_memmap(self.matrix_path + ".tmp", mode="w+", dtype=self.dtype,
+                                           shape=(capacity, dim))
+        norms = np.lib.format.open_memmap(self.norms_path + ".tmp", mode="w+", dtype=np.float32,
+                                          shape=(capacity,))
+        scales = None
+        if self.dtype == np.int8:
+            scales = np.lib.format.open_memmap(self.scales_path + ".tmp", mode="w+", dtype=np.float32,
+                                               shape=(capacity,))
+        if used:
+            matrix[:used] = self.matrix[:used]
+            norms[:used] = self.norms[:used]
+            if scales is not None:
+                scales[:used] = self.scales[:used]
+        matrix.flush()
+        norms.flush()
+        if scales is not None:
+            scales.flush()
+            os.replace(self.scales_path + ".tmp", self.scales_path)
+        os.replace(self.matrix_path + ".tmp", self.matrix_path)
+        os.replace(self.norms_path + ".tmp", self.norms_path)
+        self.matrix, self.norms, self.scales = matrix, norms, scales
+
+        grown = capacity - len(self.ids)
+        self.ids = np.concatenate([self.ids, np.empty(grown, dtype=object)])
+        self.alive = np.concatenate([self.alive, np.zeros(grown, dtype=bool)])
+        self.metadatas.extend([None] * grown)
+        for key in self.columns:
+            self.columns[key] = np.concatenate([self.columns[key], np.empty(grown, dtype=object)])
+        for key in self.bitmaps:
+            self.bitmaps[key] = np.concatenate([self.bitmaps[key], np.zeros(grown, dtype=bool)])
+
+    def vector_norms(self, vectors):
+        if self.space == "l2":
+            return np.einsum("ij,ij->i", vectors, vectors)
+        return np.linalg.norm(vectors, axis=1)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        """
+        :param ids: List of chunk IDs
+        :param embeddings: List of vectors
+        :param documents: List of chunk texts
+        :param metadatas: List of metadata dicts
+        """
+        if not len(ids):
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self.writing():
+            if self.matrix is not None and self.matrix.shape[1] != vectors.shape[1]:
+                self.clear()
+            rows = []
+            for chunk_id in ids:
+                row = self.row_of.get(chunk_id)
+                if row is None:
+                    if self.free:
+                        row = self.free.pop()
+                    else:
+                        row = self.size
+                        self.size += 1
+                    self.row_of[chunk_id] = row
+                rows.append(row)
+            capacity = 0 if self.matrix is None else len(self.matrix)
+            if self.size > capacity:
+                self.resize(vectors.shape[1], max(1024, self.size, 2 * capacity))
+            rows = np.array(rows)
+            if self.scales is not None:
+                # Symmetric scalar quantization, one scale per vector
+                scales = np.abs(vectors).max(axis=1) / 127
+                scales[scales == 0] = 1
+                self.matrix[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+                self.scales[rows] = scales
+                self.scales.flush()
+            else:
+                self.matrix[rows] = vectors
+            self.norms[rows] = self.vector_norms(vectors)
+            self.matrix.flush()
+            self.norms.flush()
+            self.conn.executemany("INSERT OR REPLACE INTO rows (row, id, document, metadata, hash) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  [(int(row), chunk_id, document, json.dumps(metadata or {}),
+                                    content_hash(vector, document, metadata))
+                                   for row, chunk_id, vector, document, metadata
+                                   in zip(rows, ids, vectors, documents, metadatas)])
+            for row, chunk_id, metadata in zip(rows, ids, metadatas):
+                self.set_row(row, chunk_id, metadata or {})
+
+    def set_row(self, row, chunk_id, metadata):
+        self.ids[row] = chunk_id
+        self.alive[row] = metadata is not None
+        self.metadatas[row] = metadata
+        metadata = metadata or {}
+        for key, column in self.columns.items():
+            column[row] = metadata.get(key)
+        for (key, value), bitmap in self.bitmaps.items():
+            bitmap[row] = key in metadata and metadata[key] == value
+
+    def delete(self, ids):
+        if not len(ids):
+            return
+        with self.writing():
+            rows = [self.row_of.pop(chunk_id) for chunk_id in ids if chunk_id in self.row_of]
+            if not rows:
+                return
+            self.conn.executemany("DELETE FROM rows WHERE row = ?", [(int(row),) for row in rows])
+            for row in rows:
+                self.set_row(row, None, None)
+            self.free.extend(int(row) for row in rows)
+
+    def delete_where(self, where):
+        """
+        Delete the chunks matching a Chroma metadata filter
+        """
+        with self.writing():
+            self.delete(list(self.ids[np.flatnonzero(self.alive & self.resolve(where))]))
+
+    def clear(self):
+        with self.writing():
+            self.conn.execute("DELETE FROM rows")
+            for path in (self.matrix_path, self.norms_path, self.scales_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.load()
+
+    def column(self, key):
+        if key not in self.columns:
+            column = np.empty(len(self.metadatas), dtype=object)
+            for row, metadata in enumerate(self.metadatas):
+                if metadata is not None:
+                    column[row] = metadata.get(key)
+            self.columns[key] = column
+        return self.columns[key]
+
+    def bitmap(self, key, value):
+        """
+        :return: Boolean mask of the rows whose metadata key equals value, kept current across writes
+        """
+        bitmap = self.bitmaps.get((key, value))
+        if bitmap is None:
+            bitmap = self.column(key) == value
+            self.bitmaps[(key, value)] = bitmap
+            if len(self.bitmaps) > self.max_bitmaps:
+                self.bitmaps.popitem(last=False)
+        else:
+            self.bitmaps.move_to_end((key, value))
+        return bitmap
+
+    def resolve(self, where):
+        """
+        Resolve a Chroma metadata filter into a row mask
+        :param where: Filter using $and, $or, $eq, $ne, $in and $nin
+        :return: Boolean mask over the rows
+        """
+        capacity = len(self.alive)
+        if "$and" in where:
+            return np.logical_and.reduce([self.resolve(clause) for clause in where["$and"]] + [np.ones(capacity, bool)])
+        if "$or" in where:
+            return np.logical_or.reduce([self.resolve(clause) for clause in where["$or"]] + [np.zeros(capacity, bool)])
+        mask = np.ones(capacity, dtype=bool)
+        for key, condition in where.items():
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, value in condition.items():
+                if operator in ("$eq", "$ne"):
+                    matches = self.bitmap(key, value)
+                elif operator in ("$in", "$nin"):
+                    matches = np.logical_or.reduce([self.bitmap(key, item) for item in value]
+                                                   + [np.zeros(capacity, bool)])
+                else:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+                mask &= ~matches if operator in ("$ne", "$nin") else matches
+        return mask
+
+    def distances(self, rows, queries):
+        """
+        Distances in Chroma's convention for the collection space, widening float16 and int8 rows
+        to float32 only for the given rows
+        :param rows: Slice or array of rows
+        :return: Matrix with a row per stored vector and a column per query
+        """
+        scores = self.matrix[rows].astype(np.float32, copy=False) @ queries.T
+        if self.scales is not None:
+            scores *= self.scales[rows][:, None]
+        return to_distances(scores, self.norms[rows], queries, self.space)
+
+    def block_top_k(self, mask, candidates, queries, k):
+        """
+        Top-k rows per query over the masked rows, keeping a running top-k across blocks of rows so
+        memory stays at one block of distances whatever the number of rows
+        :param mask: Boolean mask over the first size rows
+        :param candidates: Rows set in mask
+        :return: Matrices of rows and distances with k rows and a column per query, closest first
+        """
+        best_rows = np.empty((0, len(queries)), dtype=np.int64)
+        best = np.empty((0, len(queries)), dtype=np.float32)
+        # Scanning the contiguous prefix beats gathering most of the rows
+        dense = len(candidates) > self.size // 4
+        total = self.size if dense else len(candidates)
+        for start in range(0, total, self.block_rows):
+            stop = min(start + self.block_rows, total)
+            if dense:
+                rows = np.arange(start, stop)
+                distances = self.distances(slice(start, stop), queries)
+                distances[~mask[start:stop]] = np.inf
+            else:
+                rows = candidates[start:stop]
+                distances = self.distances(rows, queries)
+            distances = np.vstack([best, distances])
+            rows = np.vstack([best_rows, np.broadcast_to(rows[:, None], (len(rows), len(queries)))])
+            top = top_k(distances, k)
+            best_rows = np.take_along_axis(rows, top, axis=0)
+            best = np.take_along_axis(distances, top, axis=0)
+        return best_rows, best
+
+    def search(self, embedding, k=5, filter=None):
+        """
+        Exact top-k search
+        :param embedding: Query vector
+        :param k: Number of results
+        :param filter: Chroma metadata filter
+        :return: List of (document, distance), closest first
+        """
+        return self.search_batch([embedding], k=k, filter=filter)[0]
+
+    def search_batch(self, embeddings, k=5, filter=None, rescore=True):
+        """
+        Top-k search for many queries with one pass over the matrix per query_block queries
+        :param embeddings: List of query vectors
+        :param k: Number of results per query
+        :param filter: Chroma metadata filter applied to every query
+        :param rescore: Re-rank candidates of a quantized matrix with their float32 vectors
+        :return: List with the (document, distance) results of each query
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        with self.lock:
+            self.refresh()
+            if self.matrix is None or not self.row_of or not len(queries):
+                return [[] for _ in range(len(queries))]
+            mask = self.alive[:self.size]
+            if filter:
+                mask = mask & self.resolve(filter)[:self.size]
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return [[] for _ in range(len(queries))]
+            rescore = rescore and self.dtype != np.float32 and self.exact_vectors is not None
+            fetch_k = min(k * self.rescore_factor if rescore else k, len(candidates))
+            ranked = []
+            for start in range(0, len(queries), self.query_block):
+                block = queries[start:start + self.query_block]
+                rows, distances = self.block_top_k(mask, candidates, block, fetch_k)
+                block_ranked = [[(int(row), float(distance)) for row, distance in zip(rows[:, column], distances[:, column])]
+                                for column in range(rows.shape[1])]
+                ranked.extend(self.rescore(block_ranked, block, k) if rescore else block_ranked)
+            rows = list({row for results in ranked for row, _ in results})
+            documents = {}
+            for i in range(0, len(rows), 500):
+                placeholders = ",".join("?" * len(rows[i:i + 500]))
+                documents.update(self.conn.execute(f"SELECT row, document FROM rows WHERE row IN ({placeholders})",
+                                                   rows[i:i + 500]).fetchall())
+            return [[(Document(page_content=documents[row], metadata=self.metadatas[row], id=self.ids[row]), distance)
+                     for row, distance in results] for results in ranked]
+
+    def rescore(self, ranked, queries, k):
+        """
+        Re-rank quantized candidates by their exact distances, fetching the candidates of all the given
+        queries in one exact_vectors call
+        :param ranked: List with the (row, approximate distance) candidates of each query
+        :return: List with the k best (row, exact distance) of each query
+        """
+        rows = list({row for results in ranked for row, _ in results})
+        try:
+            exact = self.exact_vectors([self.ids[row] for row in rows])
+        except Exception as e:
+            print(f"Error fetching exact vectors, keeping quantized distances: {e}")
+            return [results[:k] for results in ranked]
+        rescored = []
+        for query, results in zip(queries, ranked):
+            found = [(row, exact[self.ids[row]]) for row, _ in results if self.ids[row] in exact]
+            if len(found) < len(results):
+                rescored.append(results[:k])
+                continue
+            vectors = np.asarray([vector for _, vector in found], dtype=np.float32)
+            distances = to_distances(vectors @ query, self.vector_norms(vectors), query, self.space)
+            rescored.append([(found[i][0], float(distances[i])) for i in top_k(distances, k)])
+        return rescored
+
+    def stats(self):
+        """
+        :return: Dict with the stored precision, vector count and the bytes the local vectors take and
+            save against float32. Chroma keeps its own float32 copy either way.
+        """
+        with self.lock:
+            self.refresh()
+            count = len(self.row_of)
+            dim = 0 if self.matrix is None else self.matrix.shape[1]
+            stored = count * (dim * self.dtype.itemsize + 4 + (4 if self.scales is not None else 0))
+            full = count * (dim * 4 + 4)
+            return {"dtype": str(self.dtype), "vectors": count, "dim": dim, "bytes": stored,
+                    "float32_bytes": full, "bytes_saved": full - stored}
+
+    def sync(self, collection, batch_size=1000):
+        """
+        Reconcile the mirror with the Chroma collection a page at a time: copy chunks that are missing
+        or whose embedding, document or metadata changed, and drop ids Chroma no longer has
+        :param collection: Chroma collection
+        :return: Number of ids added, updated and removed
+        """
+        with self.lock:
+            self.refresh()
+            stored = dict(self.conn.execute("SELECT id, hash FROM rows").fetchall())
+        seen = set()
+        updated = 0
+        offset = 0
+        while True:
+            result = collection.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            if not len(result["ids"]):
+                break
+            offset += len(result["ids"])
+            seen.update(result["ids"])
+            changed = [i for i, (chunk_id, embedding, document, metadata)
+                       in enumerate(zip(result["ids"], result["embeddings"], result["documents"], result["metadatas"]))
+                       if stored.get(chunk_id) != content_hash(embedding, document, metadata)]
+            if changed:
+                self.upsert([result["ids"][i] for i in changed], [result["embeddings"][i] for i in changed],
+                            [result["documents"][i] for i in changed], [result["metadatas"][i] for i in changed])
+                updated += len(changed)
+        extra = [chunk_id for chunk_id in stored if chunk_id not in seen]
+        self.delete(extra)
+        return updated + len(extra)
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import Embeddings
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings hashed from the text, so tests run without Ollama. Texts containing
+    fail_marker raise, like an embedding server that is down.
+    """
+
+    def __init__(self):
+        self.texts = 0
+        self.fail_marker = None
+
+    def embed_documents(self, texts):
+        if self.fail_marker is not None and any(self.fail_marker in text for text in texts):
+            raise RuntimeError("Embedding server unavailable")
+        self.texts += len(texts)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+    def vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [byte / 255 for byte in digest[:16]]
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    fake = FakeEmbeddings()
+    monkeypatch.setattr("services.chroma_db.get_embedding_function", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def make_loader(tmp_path, embeddings):
+    """
+    :return: Function building a DocumentLoader over a fresh Database, with Database options as kwargs
+    """
+    from services.chroma_db import Database
+    from services.document_loader import DocumentLoader
+
+    def make(**kwargs):
+        db = Database(chroma_path=str(tmp_path / "chroma"), collection_name="documents", **kwargs)
+        # Fail fast instead of retrying with backoff
+        db.embedding_pipeline.max_retries = 0
+        db.embedding_pipeline.retry_backoff = 0
+        return DocumentLoader(db=db, collection_name="documents", data_path=str(tmp_path / "pdfs"))
+
+    return make
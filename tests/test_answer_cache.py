@@ -0,0 +1,66 @@
+from langchain.schema.document import Document
+
+from services.answer_cache import AnswerCache, context_fingerprint
+
+QUERY = [1.0, 0.0, 0.0]
+SIMILAR_QUERY = [0.99, 0.1, 0.0]
+OTHER_QUERY = [0.0, 1.0, 0.0]
+
+
+def test_lookup_matches_similar_queries_with_the_same_key(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), threshold=0.95)
+    fingerprint = context_fingerprint(["a.pdf:0:0", "b.pdf:1:0"])
+    cache.store("NaiveRAG", "llama", "question", QUERY, "answer", context_fp=fingerprint)
+
+    assert cache.lookup("NaiveRAG", "llama", SIMILAR_QUERY, context_fingerprint(["b.pdf:1:0", "a.pdf:0:0"])) == "answer"
+    assert cache.lookup("NaiveRAG", "llama", OTHER_QUERY, fingerprint) is None
+    assert cache.lookup("NaiveRAG", "llama", QUERY, context_fingerprint(["a.pdf:0:0"])) is None
+    assert cache.lookup("NaiveRAG", "mistral", QUERY, fingerprint) is None
+    assert cache.lookup("LightRAG", "llama", QUERY, fingerprint) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 4
+
+
+def test_invalidation_drops_answers_of_changed_sources_and_rag_types(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    cache.store("NaiveRAG", "llama", "from a", QUERY, "a answer", sources=["a.pdf"])
+    cache.store("NaiveRAG", "llama", "from a and b", SIMILAR_QUERY, "ab answer", context_fp="ab",
+                sources=["a.pdf", "b.pdf"])
+    cache.store("NaiveRAG", "llama", "from c", OTHER_QUERY, "c answer", context_fp="c", sources=["c.pdf"])
+    cache.store("LightRAG", "llama", "graph", QUERY, "graph answer")
+
+    cache.invalidate_sources(["b.pdf"])
+    assert cache.lookup("NaiveRAG", "llama", SIMILAR_QUERY, "ab") is None
+    assert cache.lookup("NaiveRAG", "llama", QUERY) == "a answer"
+
+    cache.invalidate_rag_type("LightRAG")
+    assert cache.lookup("LightRAG", "llama", QUERY) is None
+    assert cache.lookup("NaiveRAG", "llama", OTHER_QUERY, "c") == "c answer"
+    assert cache.stats()["invalidations"] == 2 and cache.stats()["entries"] == 2
+
+
+def test_least_recently_used_answers_are_evicted(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), max_entries=2)
+    cache.store("NaiveRAG", "llama", "first", QUERY, "first answer", context_fp="1", sources=["a.pdf"])
+    cache.store("NaiveRAG", "llama", "second", QUERY, "second answer", context_fp="2")
+    assert cache.lookup("NaiveRAG", "llama", QUERY, "1") == "first answer"
+    cache.store("NaiveRAG", "llama", "third", QUERY, "third answer", context_fp="3")
+
+    assert cache.lookup("NaiveRAG", "llama", QUERY, "2") is None
+    assert cache.lookup("NaiveRAG", "llama", QUERY, "1") == "first answer"
+    assert cache.conn.execute("SELECT COUNT(*) FROM answer_sources").fetchone()[0] == 1
+
+
+def test_ingesting_a_source_invalidates_its_answers(tmp_path, make_loader, embeddings):
+    loader = make_loader()
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    loader.db.on_change(lambda sources: cache.invalidate_rag_type("NaiveRAG") if sources is None
+                        else cache.invalidate_sources(sources))
+    cache.store("NaiveRAG", "llama", "from a", QUERY, "a answer", sources=["a.pdf"])
+    cache.store("NaiveRAG", "llama", "from b", OTHER_QUERY, "b answer", sources=["b.pdf"])
+
+    loader.add_to_chroma([Document(page_content="new text", metadata={"source": "a.pdf", "page": 0})])
+    assert cache.lookup("NaiveRAG", "llama", QUERY) is None
+    assert cache.lookup("NaiveRAG", "llama", OTHER_QUERY) == "b answer"
+
+    loader.db.clear_database()
+    assert cache.lookup("NaiveRAG", "llama", OTHER_QUERY) is None
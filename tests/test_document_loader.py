@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import services.document_loader as document_loader
+from services.document_loader import DocumentLoader
+
+
+def fake_parse(file_path):
+    """
+    Stand-in for parse_pages, driven by the file name: crash kills its worker, hang never returns,
+    error raises and name_0.2 parses in 0.2s
+    """
+    name = os.path.basename(file_path)
+    if name.startswith("crash"):
+        os._exit(1)
+    if name.startswith("hang"):
+        time.sleep(1000)
+    if name.startswith("error"):
+        raise ValueError("Corrupt PDF")
+    time.sleep(float(name.split("_")[1]))
+    return [(f"text of {name}", {"page": 0})]
+
+
+class FakeExtractor:
+    cache_dir = None
+
+    def load(self, file_hash):
+        return None
+
+    def save(self, file_hash, pages):
+        pass
+
+    def to_documents(self, file_path, pages):
+        return pages
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    # Workers are forked, so they inherit the patched parser
+    monkeypatch.setattr(document_loader, "parse_pages", fake_parse)
+    loader = DocumentLoader.__new__(DocumentLoader)
+    loader.extractor = FakeExtractor()
+    loader.load_timeout = 2.0
+    yield loader
+    for child in multiprocessing.active_children():
+        child.join(timeout=5)
+
+
+def loaded(loader, files, workers):
+    return [file_path for file_path, _ in loader.iter_documents_parallel(files, workers)]
+
+
+def test_files_parsing_beside_a_crash_are_not_blamed(loader):
+    files = ["a_0.3", "b_0.3", "crash", "c_0.3", "d_0.1", "e_0.1", "f_0.1"]
+    assert loaded(loader, files, 4) == [name for name in files if name != "crash"]
+
+
+def test_repeated_crashes_only_drop_the_crashing_files(loader):
+    files = ["a_0.2", "crash1", "b_0.2", "crash2", "c_0.2", "d_0.2"]
+    assert loaded(loader, files, 3) == ["a_0.2", "b_0.2", "c_0.2", "d_0.2"]
+
+
+def test_hung_and_failing_files_are_skipped(loader):
+    start = time.monotonic()
+    assert loaded(loader, ["a_0.1", "hang", "error", "b_0.5", "c_0.1"], 2) == ["a_0.1", "b_0.5", "c_0.1"]
+    assert time.monotonic() - start < 10
+
+
+def test_closing_early_stops_the_workers(loader):
+    files = loader.iter_documents_parallel(["a_0.1", "hang", "b_0.1", "c_0.1"], 2)
+    assert next(files)[0] == "a_0.1"
+    files.close()
+    deadline = time.monotonic() + 5
+    while multiprocessing.active_children() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from services.embedding_cache import EmbeddingCache
+
+DIM = 16
+
+
+def vector(i):
+    return np.full(DIM, i, dtype=np.float32)
+
+
+def test_eviction_stops_at_the_target(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_bytes=100 * DIM * 4)
+    for i in range(101):
+        cache.put_many("model", [f"text {i}"], [vector(i)])
+
+    # Trimmed to 90% of the limit, dropping the least recently used vectors only
+    assert cache.stats()["entries"] == 90
+    assert cache.size == 90 * DIM * 4
+    assert cache.evictions == 11
+    assert cache.get_many("model", ["text 10", "text 11", "text 100"])[0] is None
+    assert all(found is not None for found in cache.get_many("model", ["text 11", "text 100"]))
+
+
+def test_aembed_embeds_only_missing_texts_off_the_event_loop(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    cache.put_many("model", ["cached"], [vector(1)])
+    embedded, threads = [], []
+    get_many = cache.get_many
+
+    def tracked_get_many(*args):
+        threads.append(threading.current_thread())
+        return get_many(*args)
+
+    cache.get_many = tracked_get_many
+
+    async def embed(texts):
+        embedded.extend(texts)
+        return [vector(2) for _ in texts]
+
+    vectors = asyncio.run(cache.aembed("model", ["cached", "new"], embed))
+    assert embedded == ["new"]
+    assert vectors.shape == (2, DIM) and vectors[0][0] == 1 and vectors[1][0] == 2
+    assert threads and threading.main_thread() not in threads
+    assert cache.get_many("model", ["new"])[0] is not None
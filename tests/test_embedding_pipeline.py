@@ -0,0 +1,72 @@
+from langchain.schema.document import Document
+from langchain_ollama import OllamaEmbeddings
+
+from benchmarks.fake_ollama import FakeOllamaServer
+from services.embedding_pipeline import EmbeddingPipeline
+
+
+def chunks(count, poisoned=()):
+    return [Document(page_content=f"POISON chunk {i}" if i in poisoned else f"chunk {i}",
+                     metadata={"source": "a.pdf", "page": i}) for i in range(count)]
+
+
+def run(server, chunk_list, **kwargs):
+    pipeline = EmbeddingPipeline(OllamaEmbeddings(model="nomic-embed-text", base_url=server.url),
+                                 retry_backoff=0, **kwargs)
+    ids = [f"a.pdf:{i}:0" for i in range(len(chunk_list))]
+    written = []
+    failed = pipeline.run(chunk_list, ids, lambda batch, batch_ids, embeddings: written.extend(
+        zip(batch_ids, [len(embedding) for embedding in embeddings])))
+    return written, failed
+
+
+def test_batches_stay_within_the_concurrency_limit():
+    with FakeOllamaServer(dim=8, latency=0.05, per_text_latency=0) as server:
+        written, failed = run(server, chunks(95), batch_size=10, max_concurrency=3)
+    assert failed == []
+    assert sorted(chunk_id for chunk_id, _ in written) == sorted(f"a.pdf:{i}:0" for i in range(95))
+    assert all(dim == 8 for _, dim in written)
+    assert server.requests == 10
+    assert 1 < server.max_in_flight <= 3
+
+
+def test_failed_batches_are_retried_on_their_own():
+    with FakeOllamaServer(dim=8, latency=0, per_text_latency=0, fail_requests=2) as server:
+        written, failed = run(server, chunks(40), batch_size=10, max_concurrency=1, max_retries=2)
+    assert failed == [] and len(written) == 40
+    # Only the failed requests are repeated, not the whole job
+    assert server.requests == 4 + 2
+
+
+def test_batches_failing_every_retry_are_reported_and_the_rest_written():
+    with FakeOllamaServer(dim=8, latency=0, per_text_latency=0, fail_marker="POISON") as server:
+        written, failed = run(server, chunks(40, poisoned={12}), batch_size=10, max_concurrency=2, max_retries=1)
+    assert sorted(failed) == sorted(f"a.pdf:{i}:0" for i in range(10, 20))
+    assert len(written) == 30
+    assert server.failures == 2
+
+
+def pages(source, texts):
+    return [Document(page_content=text, metadata={"source": source, "page": page}) for page, text in enumerate(texts)]
+
+
+def stored_documents(db, ids):
+    result = db.db.get(ids=ids, include=["documents"])
+    return dict(zip(result["ids"], result["documents"]))
+
+
+def test_failed_embed_drops_stale_text_and_retries(make_loader, embeddings):
+    loader = make_loader()
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "beta text"]))
+
+    embeddings.fail_marker = "FAIL"
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "FAIL beta changed"]))
+    # The old text of the failed chunk must not stay searchable, nor pass for up to date
+    assert stored_documents(loader.db, ["a.pdf:0:0", "a.pdf:1:0"]) == {"a.pdf:0:0": "alpha text"}
+    assert set(loader.db.manifest.get_chunks("a.pdf")) == {"a.pdf:0:0"}
+    assert loader.db.manifest.get_file_hash("a.pdf") == ""
+
+    embeddings.fail_marker = None
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "FAIL beta changed"]))
+    assert stored_documents(loader.db, ["a.pdf:1:0"]) == {"a.pdf:1:0": "FAIL beta changed"}
+    assert set(loader.db.manifest.get_chunks("a.pdf")) == {"a.pdf:0:0", "a.pdf:1:0"}
@@ -0,0 +1,41 @@
+from langchain.schema.document import Document
+
+
+def pages(source, texts):
+    return [Document(page_content=text, metadata={"source": source, "page": page}) for page, text in enumerate(texts)]
+
+
+def stored_documents(db, ids):
+    result = db.db.get(ids=ids, include=["documents"])
+    return dict(zip(result["ids"], result["documents"]))
+
+
+def test_unchanged_chunks_are_not_embedded_again(make_loader, embeddings):
+    loader = make_loader()
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "beta text"]))
+    assert embeddings.texts == 2
+
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "beta text"]))
+    assert embeddings.texts == 2
+
+
+def test_changed_and_removed_chunks_are_synced(make_loader, embeddings):
+    loader = make_loader()
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "beta text", "gamma text"]))
+
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "beta changed"]))
+    assert embeddings.texts == 4
+    assert stored_documents(loader.db, ["a.pdf:0:0", "a.pdf:1:0", "a.pdf:2:0"]) == {
+        "a.pdf:0:0": "alpha text", "a.pdf:1:0": "beta changed"}
+    assert set(loader.db.manifest.get_chunks("a.pdf")) == {"a.pdf:0:0", "a.pdf:1:0"}
+
+
+def test_moved_text_reuses_its_embedding(make_loader, embeddings):
+    loader = make_loader()
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "beta text"]))
+
+    loader.add_to_chroma(pages("b.pdf", ["beta text", "alpha text"]))
+    assert embeddings.texts == 2
+    assert stored_documents(loader.db, ["b.pdf:0:0", "b.pdf:1:0"]) == {
+        "b.pdf:0:0": "beta text", "b.pdf:1:0": "alpha text"}
+
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from services.llm_cache import LLMCache, prompt_hash
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm.sqlite3"), max_bytes=1000)
+    for i in range(5):
+        cache.put("model", f"key{i}", "x" * 200)
+    # key0 is now the most recently used entry
+    assert cache.get("model", "key0") == "x" * 200
+    cache.put("model", "key5", "x" * 200)
+
+    assert cache.size <= 1000
+    assert cache.get("model", "key0") is not None
+    assert cache.get("model", "key1") is None
+    assert cache.evictions >= 1
+
+
+def test_compact_drops_other_models_and_stale_entries(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm.sqlite3"))
+    cache.put("ingest", "fresh", "kept")
+    cache.put("ingest", "stale", "dropped")
+    cache.put("old-ingest", "fresh", "dropped")
+    with cache.conn:
+        cache.conn.execute("UPDATE completions SET last_used = ? WHERE prompt_hash = 'stale'",
+                           (time.time() - 7200,))
+
+    assert cache.compact(max_age=3600, models=["ingest"]) == 2
+    assert cache.get("ingest", "fresh") == "kept"
+    assert cache.stats()["entries"] == 1
+    assert cache.size == len("kept")
+
+
+def test_compact_keeps_other_models_and_only_vacuums_after_drops(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm.sqlite3"))
+    cache.put("ingest", "key", "kept")
+    cache.put("other-ingest", "key", "kept")
+    statements = []
+    cache.conn.set_trace_callback(statements.append)
+
+    assert cache.compact(max_age=3600) == 0
+    assert cache.stats()["entries"] == 2
+    assert "VACUUM" not in statements
+
+    with cache.conn:
+        cache.conn.execute("UPDATE completions SET last_used = ? WHERE model = 'other-ingest'", (time.time() - 7200,))
+    assert cache.compact(max_age=3600) == 1
+    assert "VACUUM" in statements
+
+
+def test_resumed_ingest_replays_cached_completions(tmp_path):
+    path = str(tmp_path / "llm.sqlite3")
+    calls = []
+
+    async def complete(prompt, **kwargs):
+        calls.append(prompt)
+        return f"entities of {prompt}"
+
+    async def extract(cache, prompts):
+        return [await cache.acomplete("ingest", complete, prompt, system_prompt="extract",
+                                      options={"num_ctx": 32768}) for prompt in prompts]
+
+    # The first run is interrupted after two chunks
+    assert asyncio.run(extract(LLMCache(path), ["chunk 1", "chunk 2"])) == ["entities of chunk 1",
+                                                                           "entities of chunk 2"]
+    resumed = LLMCache(path)
+    assert resumed.size == 2 * len("entities of chunk 1")
+    results = asyncio.run(extract(resumed, ["chunk 1", "chunk 2", "chunk 3"]))
+    assert results == ["entities of chunk 1", "entities of chunk 2", "entities of chunk 3"]
+    assert calls == ["chunk 1", "chunk 2", "chunk 3"]
+    assert resumed.stats()["hits"] == 2
+
+
+def test_prompt_hash_covers_output_format_and_options():
+    assert prompt_hash("prompt") == prompt_hash("prompt", history_messages=[])
+    assert prompt_hash("prompt") != prompt_hash("prompt", format="json")
+    assert prompt_hash("prompt") != prompt_hash("prompt", options={"temperature": 0})
@@ -0,0 +1,107 @@
+from langchain.schema.document import Document
+
+from services.near_duplicates import NearDuplicateIndex
+
+TEXT = " ".join(f"word{i}" for i in range(60))
+NEAR_TEXT = TEXT + " extra"
+OTHER_TEXT = " ".join(f"other{i}" for i in range(60))
+
+
+def pages(source, texts):
+    return [Document(page_content=text, metadata={"source": source, "page": page}) for page, text in enumerate(texts)]
+
+
+def chunk(chunk_id, text):
+    return Document(page_content=text, metadata={"id": chunk_id})
+
+
+def test_filter_links_near_duplicates_within_a_source(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "dups.sqlite3"), threshold=0.8)
+    keep, linked, orphaned = index.filter([chunk("a:0:0", TEXT), chunk("a:1:0", OTHER_TEXT)], "a")
+    assert [doc.metadata["id"] for doc in keep] == ["a:0:0", "a:1:0"]
+    assert linked == {} and orphaned == {}
+
+    keep, linked, orphaned = index.filter([chunk("a:2:0", NEAR_TEXT)], "a")
+    assert keep == [] and linked == {"a:2:0": "a:0:0"}
+    assert index.linked_ids("a") == {"a:2:0"}
+    # Another source keeps its own copy, so searches scoped to it still find the text
+    keep, linked, _ = index.filter([chunk("b:0:0", NEAR_TEXT)], "b")
+    assert [doc.metadata["id"] for doc in keep] == ["b:0:0"] and linked == {}
+
+
+def test_removing_a_canonical_chunk_orphans_its_links(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "dups.sqlite3"), threshold=0.8)
+    index.filter([chunk("a:0:0", TEXT), chunk("a:1:0", NEAR_TEXT)], "a")
+
+    assert index.remove_ids(["a:0:0"]) == {"a:1:0": "a"}
+    assert index.stats()["embeddings_saved"] == 0
+    # Nothing is left to link to, so the orphan is kept the next time round
+    keep, linked, _ = index.filter([chunk("a:1:0", NEAR_TEXT)], "a")
+    assert [doc.metadata["id"] for doc in keep] == ["a:1:0"] and linked == {}
+
+
+def test_refiltering_a_canonical_chunk_orphans_its_links(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "dups.sqlite3"), threshold=0.8)
+    index.filter([chunk("a:0:0", TEXT), chunk("a:1:0", NEAR_TEXT)], "a")
+
+    _, _, orphaned = index.filter([chunk("a:0:0", OTHER_TEXT)], "a")
+    assert orphaned == {"a:1:0": "a"}
+
+
+def test_removed_sources_take_their_links_along(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "dups.sqlite3"), threshold=0.8)
+    index.filter([chunk("a:0:0", TEXT), chunk("a:1:0", NEAR_TEXT)], "a")
+    index.filter([chunk("b:0:0", TEXT), chunk("b:1:0", NEAR_TEXT)], "b")
+
+    index.remove_sources(["a"])
+    assert index.stats() == {"indexed_chunks": 1, "embeddings_saved": 1,
+                             "bytes_saved": len(NEAR_TEXT) + index.embedding_dim * 4}
+
+
+def test_linked_chunks_are_not_counted_but_found_by_scoped_search(make_loader, embeddings):
+    loader = make_loader(near_dup_threshold=0.8)
+    loader.add_to_chroma(pages("a.pdf", [TEXT, NEAR_TEXT]))
+    loader.add_to_chroma(pages("b.pdf", [NEAR_TEXT]))
+    db = loader.db
+
+    assert db.get_existing_ids(["a.pdf:0:0", "a.pdf:1:0", "b.pdf:0:0"]) == {"a.pdf:0:0", "b.pdf:0:0"}
+    assert db.manifest.resolve_documents(["a.pdf", "b.pdf"]) == {"a.pdf": 1, "b.pdf": 1}
+    assert db.manifest.count_chunks() == 2
+    for source in ("a.pdf", "b.pdf"):
+        assert [document.metadata["source"] for document, _ in db.search(NEAR_TEXT, doc_ids=[source])] == [source]
+
+
+def test_changed_canonical_chunk_gets_its_duplicates_embedded(make_loader, embeddings):
+    loader = make_loader(near_dup_threshold=0.8)
+    loader.add_to_chroma(pages("a.pdf", [TEXT, NEAR_TEXT]), file_hashes={"a.pdf": "v1"})
+    assert loader.db.get_existing_ids(["a.pdf:1:0"]) == set()
+
+    # The link is matched again in the same pass, with no second ingest of the file
+    loader.add_to_chroma(pages("a.pdf", [OTHER_TEXT, NEAR_TEXT]), file_hashes={"a.pdf": "v2"})
+    assert loader.db.get_existing_ids(["a.pdf:0:0", "a.pdf:1:0"]) == {"a.pdf:0:0", "a.pdf:1:0"}
+    assert loader.db.manifest.get_file_hash("a.pdf") == "v2"
+    assert loader.db.manifest.resolve_documents(["a.pdf"]) == {"a.pdf": 2}
+
+
+def test_removed_canonical_chunk_gets_its_duplicates_embedded(make_loader, embeddings):
+    loader = make_loader(near_dup_threshold=0.8)
+    loader.add_to_chroma(pages("a.pdf", [TEXT, NEAR_TEXT]), file_hashes={"a.pdf": "v1"})
+
+    loader.add_to_chroma([Document(page_content=NEAR_TEXT, metadata={"source": "a.pdf", "page": 1})],
+                         file_hashes={"a.pdf": "v2"})
+    assert loader.db.get_existing_ids(["a.pdf:0:0", "a.pdf:1:0"]) == {"a.pdf:1:0"}
+    assert loader.db.manifest.resolve_documents(["a.pdf"]) == {"a.pdf": 1}
+
+
+def test_links_to_a_failed_chunk_are_left_for_the_next_ingest(make_loader, embeddings):
+    loader = make_loader(near_dup_threshold=0.8)
+    embeddings.fail_marker = "word0"
+    loader.add_to_chroma(pages("a.pdf", [TEXT, NEAR_TEXT]), file_hashes={"a.pdf": "v1"})
+    assert loader.db.manifest.get_chunks("a.pdf") == {}
+    assert loader.db.manifest.resolve_documents(["a.pdf"]) == {"a.pdf": 0}
+
+    embeddings.fail_marker = None
+    loader.add_to_chroma(pages("a.pdf", [TEXT, NEAR_TEXT]), file_hashes={"a.pdf": "v1"})
+    assert loader.db.get_existing_ids(["a.pdf:0:0", "a.pdf:1:0"]) == {"a.pdf:0:0"}
+    assert set(loader.db.manifest.get_chunks("a.pdf")) == {"a.pdf:0:0", "a.pdf:1:0"}
+    assert loader.db.manifest.resolve_documents(["a.pdf"]) == {"a.pdf": 1}
@@ -0,0 +1,36 @@
+from langchain.schema.document import Document
+
+
+def pages(source, texts):
+    return [Document(page_content=text, metadata={"source": source, "page": page}) for page, text in enumerate(texts)]
+
+
+def sources(results):
+    return {document.metadata["source"] for document, _ in results}
+
+
+def test_scoped_search_stays_within_its_sources(make_loader, embeddings):
+    loader = make_loader(postfilter_selectivity=0.2)
+    for name in "abcdefgh":
+        loader.add_to_chroma(pages(f"{name}.pdf", [f"{name} text {page}" for page in range(3)]))
+    db = loader.db
+
+    # One source of eight is searched over its own vectors, five of eight by filtering a wider search
+    assert sources(db.search("a text", k=3, doc_ids=["a.pdf"])) == {"a.pdf"}
+    assert sources(db.search("a text", k=5, doc_ids=["a.pdf", "b.pdf", "c.pdf", "d.pdf", "e.pdf"])) <= {
+        "a.pdf", "b.pdf", "c.pdf", "d.pdf", "e.pdf"}
+    for results in db.batch_search(["a text 0", "b text 1"], k=3, doc_ids=["b.pdf"]):
+        assert sources(results) == {"b.pdf"}
+
+
+def test_scoped_search_over_a_source_without_chunks(make_loader, embeddings):
+    loader = make_loader()
+    loader.add_to_chroma(pages("a.pdf", ["alpha text", "beta text"]))
+    embeddings.fail_marker = "POISON"
+    loader.add_to_chroma(pages("b.pdf", ["POISON text"]))
+    db = loader.db
+    assert db.manifest.resolve_documents(["b.pdf"]) == {"b.pdf": 0}
+
+    assert db.search("alpha", doc_ids=["b.pdf"]) == []
+    assert db.batch_search(["alpha", "beta"], doc_ids=["b.pdf"]) == [[], []]
+    assert sources(db.search("alpha", doc_ids=["a.pdf", "b.pdf"])) == {"a.pdf"}
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def gated_source(pieces, gate, events=None):
+    """
+    :return: Source factory yielding pieces, waiting on gate before each one after the first
+    """
+    events = events if events is not None else []
+
+    async def source():
+        events.append("start")
+        try:
+            for i, piece in enumerate(pieces):
+                if i:
+                    await gate.wait()
+                    gate.clear()
+                yield piece
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+
+    return source
+
+
+async def collect(stream):
+    return [piece async for piece in stream]
+
+
+async def step(gate):
+    gate.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_identical_requests_share_one_stream():
+    async def run():
+        flights, gate, events = SingleFlight(), asyncio.Event(), []
+        source = gated_source(["a", "b", "c"], gate, events)
+        first = asyncio.create_task(collect(flights.stream("key", source)))
+        await step(gate)
+        # Joins after two pieces, which are replayed before it follows along
+        second = asyncio.create_task(collect(flights.stream("key", source)))
+        other = asyncio.create_task(collect(flights.stream("other", gated_source(["x"], gate))))
+        await step(gate)
+        results = await asyncio.gather(first, second, other)
+        assert results == [["a", "b", "c"], ["a", "b", "c"], ["x"]]
+        assert events == ["start"]
+        assert flights.stats() == {"in_flight": 0, "started": 2, "coalesced": 1}
+
+        # A request after the flight finished starts a new one
+        assert await collect(flights.stream("key", gated_source(["d"], gate))) == ["d"]
+        assert flights.stats()["started"] == 3
+
+    asyncio.run(run())
+
+
+def test_errors_reach_every_follower():
+    async def failing():
+        yield "a"
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Ollama is down")
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(collect(flights.stream("key", failing)),
+                                       collect(flights.stream("key", failing)), return_exceptions=True)
+        assert [str(result) for result in results] == ["Ollama is down", "Ollama is down"]
+        assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 1}
+
+    asyncio.run(run())
+
+
+def test_generation_is_cancelled_only_when_every_follower_has_gone():
+    async def run():
+        flights, gate, events = SingleFlight(), asyncio.Event(), []
+        source = gated_source(["a", "b", "c"], gate, events)
+        leaving = flights.stream("key", source)
+        staying = flights.stream("key", source)
+        assert await leaving.__anext__() == "a"
+        assert await staying.__anext__() == "a"
+
+        await leaving.aclose()
+        await step(gate)
+        assert events == ["start"]
+        assert await staying.__anext__() == "b"
+
+        await staying.aclose()
+        await asyncio.sleep(0)
+        assert events == ["start", "cancelled"]
+        assert flights.stats()["in_flight"] == 0
+        # The key is free again, so the next request starts a new generation
+        assert await collect(flights.stream("key", gated_source(["d"], gate))) == ["d"]
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_stop_the_others():
+    async def run():
+        flights, gate = SingleFlight(), asyncio.Event()
+        source = gated_source(["a", "b"], gate)
+        cancelled = asyncio.create_task(collect(flights.stream("key", source)))
+        kept = asyncio.create_task(collect(flights.stream("key", source)))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await step(gate)
+        assert await kept == ["a", "b"]
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+    asyncio.run(run())
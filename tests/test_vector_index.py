@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+from chromadb import PersistentClient
+
+from services.vector_index import VectorIndex, to_distances, top_k
+
+
+def random_vectors(count, dim=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim), dtype=np.float32)
+
+
+def fill(index, vectors, start=0):
+    ids = [f"doc{i % 3}.pdf:{i}:0" for i in range(start, start + len(vectors))]
+    index.upsert(ids, vectors, [f"chunk {i}" for i in range(start, start + len(vectors))],
+                 [{"source": f"doc{i % 3}.pdf"} for i in range(start, start + len(vectors))])
+    return ids
+
+
+def exact_top_k(vectors, queries, k):
+    distances = to_distances(vectors @ queries.T, np.einsum("ij,ij->i", vectors, vectors), queries)
+    return top_k(distances, k)
+
+
+def test_writes_bump_the_version_seen_by_other_instances(tmp_path):
+    writer = VectorIndex(str(tmp_path))
+    reader = VectorIndex(str(tmp_path))
+    ids = fill(writer, random_vectors(10))
+    assert writer.version == 1
+    assert reader.count() == 10 and reader.version == 1
+
+    writer.delete(ids[:4])
+    assert writer.version == 2
+    assert reader.count() == 6 and reader.version == 2
+
+
+def write_batches(path, worker, batches=5, batch_size=20):
+    index = VectorIndex(path)
+    for batch in range(batches):
+        start = (worker * batches + batch) * batch_size
+        fill(index, random_vectors(batch_size, seed=start), start=start)
+
+
+def test_writers_in_other_processes_do_not_lose_rows(tmp_path):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=write_batches, args=(str(tmp_path), worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    index = VectorIndex(str(tmp_path))
+    assert index.count() == 400 and index.version == 20
+    assert len(set(index.row_of.values())) == 400
+
+
+def test_failed_write_rolls_back(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    fill(index, random_vectors(5))
+    with pytest.raises(RuntimeError):
+        with index.writing():
+            index.conn.execute("DELETE FROM rows")
+            raise RuntimeError("crashed mid-write")
+    assert index.version == 1 and index.count() == 5
+    assert VectorIndex(str(tmp_path)).count() == 5
+
+
+def test_sync_copies_changes_and_drops_extra_ids(tmp_path):
+    collection = PersistentClient(str(tmp_path / "chroma")).create_collection("documents")
+    vectors = random_vectors(20)
+    ids = [f"doc.pdf:{i}:0" for i in range(20)]
+    collection.add(ids=ids, embeddings=vectors, documents=[f"chunk {i}" for i in range(20)],
+                   metadatas=[{"source": "doc.pdf"}] * 20)
+    index = VectorIndex(str(tmp_path / "index"))
+    assert index.sync(collection, batch_size=7) == 20
+    assert index.sync(collection, batch_size=7) == 0
+
+    collection.update(ids=[ids[0]], embeddings=[vectors[0]], documents=["edited"])
+    collection.delete(ids=[ids[1]])
+    assert index.sync(collection, batch_size=7) == 2
+    assert index.count() == 19
+    assert index.search(vectors[0], k=1)[0][0].page_content == "edited"
+
+
+def test_search_batch_matches_exact_search_across_blocks(tmp_path):
+    index = VectorIndex(str(tmp_path), block_rows=64, query_block=3)
+    vectors, queries = random_vectors(500), random_vectors(10, seed=1)
+    ids = fill(index, vectors)
+    results = index.search_batch(queries, k=5)
+    expected = exact_top_k(vectors, queries, 5)
+    assert [[doc.id for doc, _ in found] for found in results] == \
+           [[ids[row] for row in expected[:, column]] for column in range(len(queries))]
+
+    results = index.search_batch(queries, k=5, filter={"source": "doc1.pdf"})
+    assert all(doc.metadata["source"] == "doc1.pdf" for found in results for doc, _ in found)
+
+
+def exact_lookup(ids, vectors, calls):
+    def exact_vectors(chunk_ids):
+        calls.append(len(chunk_ids))
+        return {chunk_id: vectors[ids.index(chunk_id)] for chunk_id in chunk_ids}
+    return exact_vectors
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_search_rescores_with_float32_vectors(tmp_path, dtype):
+    vectors, queries = random_vectors(300), random_vectors(10, seed=1)
+    ids = [f"doc{i % 3}.pdf:{i}:0" for i in range(300)]
+    calls = []
+    index = VectorIndex(str(tmp_path), dtype=dtype, query_block=4, exact_vectors=exact_lookup(ids, vectors, calls))
+    fill(index, vectors)
+    expected = exact_top_k(vectors, queries, 5)
+    for query, found, column in zip(queries, index.search_batch(queries, k=5), range(len(queries))):
+        assert [doc.id for doc, _ in found] == [ids[row] for row in expected[:, column]]
+        # Rescored distances are the float32 ones
+        exact = float(np.sum((vectors[ids.index(found[0][0].id)] - query) ** 2))
+        assert found[0][1] == pytest.approx(exact, rel=1e-4)
+    # One fetch of the candidates per block of queries
+    assert len(calls) == 3 and all(count <= 4 * 5 * index.rescore_factor for count in calls)
+
+
+@pytest.mark.parametrize("dtype, itemsize", [("float32", 4), ("float16", 2), ("int8", 1)])
+def test_quantized_matrix_is_the_only_local_copy(tmp_path, dtype, itemsize):
+    index = VectorIndex(str(tmp_path), dtype=dtype)
+    fill(index, random_vectors(300))
+    stats = index.stats()
+    assert stats["bytes"] == 300 * (32 * itemsize + 4 + (4 if dtype == "int8" else 0))
+    assert stats["bytes_saved"] == stats["float32_bytes"] - stats["bytes"]
+    assert sorted(os.listdir(tmp_path)) == sorted(["index.sqlite3", "norms.npy", "vectors.npy"]
+                                                  + (["scales.npy"] if dtype == "int8" else []))
+
+
+def test_failed_exact_fetch_keeps_quantized_ranking(tmp_path):
+    def exact_vectors(chunk_ids):
+        raise RuntimeError("Chroma unavailable")
+
+    index = VectorIndex(str(tmp_path), dtype="int8", exact_vectors=exact_vectors)
+    vectors = random_vectors(50)
+    ids = fill(index, vectors)
+    found = index.search(vectors[7], k=3)
+    assert len(found) == 3 and found[0][0].id == ids[7]
+
+
+def test_float32_copy_of_earlier_versions_is_removed(tmp_path):
+    index = VectorIndex(str(tmp_path), dtype="int8")
+    fill(index, random_vectors(10))
+    np.save(tmp_path / "exact.npy", random_vectors(10))
+    assert VectorIndex(str(tmp_path), dtype="int8").count() == 10
+    assert not (tmp_path / "exact.npy").exists()